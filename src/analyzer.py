@@ -2,16 +2,21 @@
 __author__ = 'Du, Changbin <changbin.du@gmail.com>'
 
 import os
+import json
 import math
 import shutil
 import logging
 import datetime
 import traceback
+import multiprocessing
 from threadpool import ThreadPool, makeRequests
 from jinja2 import Template, Environment, FileSystemLoader
 from tqdm import tqdm
 from stock import Stock
 from plot import StockPlot
+from screen import ScreenEngine
+from panel import MarketPanel
+import util
 
 
 class Result(object):
@@ -22,10 +27,30 @@ class Result(object):
         self.exception = None
 
 
+def _screen_shard(panel_path, config, rows, basics):
+    """process pool worker, screen rows of the market panel shared by memory-mapped file"""
+    panel = MarketPanel.open(panel_path)
+    result = ScreenEngine(config).screen(panel, basics, rows)
+    return result.codes, result.reasons, result.messages()
+
+
+def _init_plot_worker():
+    """process pool initializer, plotting processes only save figures to files"""
+    StockPlot.use_backend('Agg')
+
+
+def _plot_worker(args):
+    """process pool worker, plot what StockPlot.data_of() returns to path"""
+    data, path = args
+    StockPlot().plot(data, path)
+    return path
+
+
 class Analyzer(object):
-    def __init__(self, stocks, indexes, config):
+    def __init__(self, stocks, indexes, config, panel=None):
         self.stocks = stocks
         self.indexs = indexes
+        self.panel = panel
 
         self.global_status = 'NAN'
         self.good_stocks = []
@@ -33,11 +58,14 @@ class Analyzer(object):
 
         self._config = config
 
-    def analyze(self, threads=1):
+    def analyze(self, threads=1, processes=0):
         self.global_status = 'GOOD' if self._analyze_index() else 'BAD'
 
+        # screen stocks in market panel all at once, others one by one
+        stocks = self._analyze_panel(processes) if self.panel is not None else list(self.stocks.values())
+
         pool = ThreadPool(threads)
-        requests = makeRequests(self._analyze_single_stock, [s for _, s in self.stocks.items()])
+        requests = makeRequests(self._analyze_single_stock, stocks)
         [pool.putRequest(req) for req in requests]
         pool.wait()
 
@@ -46,7 +74,36 @@ class Analyzer(object):
 
     def _analyze_index(self):
         sz_index = self.indexs['000001']
-        return sz_index.hist_data.ma10[0] > sz_index.hist_data.ma20[0]
+        return sz_index.hist_data.ma10.iloc[-1] > sz_index.hist_data.ma20.iloc[-1]
+
+    def _analyze_panel(self, processes=0):
+        """screen stocks with vectorized engine, return stocks not in panel"""
+        codes = [code for code in self.stocks if code in self.panel]
+        if processes > 1:
+            # workers map the panel file themselves, only codes and fundamentals are sent to them
+            shards = list(util.chunks(codes, int(math.ceil(len(codes) / processes)) or 1))
+            args = [(self.panel.path, self._config, [self.panel.row(code) for code in shard],
+                     ScreenEngine.basics_of(self.stocks, shard)) for shard in shards]
+            with multiprocessing.Pool(processes) as pool:
+                for codes, reasons, messages in pool.starmap(_screen_shard, args):
+                    self._collect_screen_result(codes, reasons, messages)
+        else:
+            engine = ScreenEngine(self._config)
+            result = engine.screen(self.panel, ScreenEngine.basics_of(self.stocks, codes),
+                                   rows=[self.panel.row(code) for code in codes])
+            self._collect_screen_result(result.codes, result.reasons, result.messages())
+        return [stock for code, stock in self.stocks.items() if code not in self.panel]
+
+    def _collect_screen_result(self, codes, reasons, messages):
+        for code, reason, message in zip(codes, reasons, messages):
+            result = Result(self.stocks[code])
+            if reason == 0:
+                result.status = 'GOOD'
+                self.good_stocks.append(result)
+            else:
+                result.status = 'BAD'
+                result.log = message
+                self.bad_stocks.append(result)
 
     def _analyze_single_stock(self, stock):
         """return if this stock is good"""
@@ -92,8 +149,8 @@ class Analyzer(object):
             # 最新价格
             config_max_price = get_config('max_price')
             if config_max_price is not None:
-                if hist_data.close[0] > config_max_price:
-                    raise BadStockException('price is too high, %d RMB' % (hist_data.close[0]))
+                if hist_data.close.iloc[-1] > config_max_price:
+                    raise BadStockException('price is too high, %d RMB' % (hist_data.close.iloc[-1]))
 
             # 流通市值
             config_max_nmc = get_config('max_nmc')
@@ -126,7 +183,8 @@ class Analyzer(object):
                         raise BadStockException('%d days average turnover is too low, %.2f%% < %.2f%%' % (days, avg, min_avg))
 
             # delay this until we really need
-            qfq_data = stock.qfq_data
+            qfq_close = stock.qfq_data.close
+            close = qfq_close.iloc[-1]
 
             # 当前走势位置
             config_position = get_config('position')
@@ -134,15 +192,15 @@ class Analyzer(object):
                 days = config_position[0][0]
                 ratio = config_position[0][1]
                 if stock.hist_len >= days:
-                    min_close = qfq_data.close[:days].min()
-                    hratio = (qfq_data.close[0]-min_close)/min_close
+                    min_close = stock.last(days, qfq_close).min()
+                    hratio = (close-min_close)/min_close
                     if hratio > ratio:
                         raise BadStockException('current price is higher than %d days min %.2f %.2f%%' % (days, min_close, hratio*100))
                 days = config_position[1][0]
                 ratio = config_position[1][1]
                 if stock.hist_len >= days:
-                    max_close = qfq_data.close[:min(days, stock.hist_len)].max()
-                    hratio = (max_close - qfq_data.close[0]) / qfq_data.close[0]
+                    max_close = stock.last(days, qfq_close).max()
+                    hratio = (max_close - close) / close
                     if hratio < ratio:
                         raise BadStockException('%d days max %.2f is only higher than current %.2f%%' % (days, max_close, hratio*100))
 
@@ -155,8 +213,8 @@ class Analyzer(object):
                     high = item[2]
                     if days > stock.hist_len:
                         continue
-                    min_close = qfq_data.close[:days].min()
-                    max_close = qfq_data.close[:days].max()
+                    min_close = stock.last(days, qfq_close).min()
+                    max_close = stock.last(days, qfq_close).max()
                     amp = (max_close - min_close)/min_close
                     if amp < low or amp > high:
                         raise BadStockException('%d day amplitude %.2f%% is not in range [%.2f%%, %.2f%%]' %
@@ -169,9 +227,10 @@ class Analyzer(object):
                     days = item[0]
                     low = item[1]
                     high = item[2]
-                    if days > stock.hist_len:
-                        continue
-                    change = (qfq_data.close[0] - qfq_data.close[days]) / qfq_data.close[days]
+                    if days >= stock.hist_len:
+                        continue  # no day before the period
+                    base = qfq_close.iloc[-days - 1]
+                    change = (close - base) / base
                     if change < low or change > high:
                         raise BadStockException('%d day change percent %.2f%% is not in range [%.2f%%, %.2f%%]' %
                                                 (days, change * 100, low * 100, high * 100))
@@ -185,7 +244,7 @@ class Analyzer(object):
                     if days > stock.hist_len:
                         continue
 
-                    count = hist_data[:days][abs(hist_data['p_change']) > change].index.size
+                    count = (stock.last(days).p_change.abs() > change).sum()
                     if count < min_count:
                         raise BadStockException('%d days data only have %d days change percent larger than %.2f%%'
                                                 % (days, count, change))
@@ -204,8 +263,10 @@ class Analyzer(object):
                              }
                     if ma_a not in ma_map or ma_b not in ma_map:
                         raise ValueError('not a valid ma')
+                    # latest days first
+                    a, b = ma_map[ma_a].values[::-1], ma_map[ma_b].values[::-1]
                     for i in range(min_count):
-                        if ma_map[ma_a][i] < ma_map[ma_b][i]:
+                        if a[i] < b[i]:
                             raise BadStockException('ma%d only larger than ma%d for %d days from now' % (ma_a, ma_b, i))
 
             logging.debug('%s: good' % stock)
@@ -227,17 +288,24 @@ class Analyzer(object):
         finally:
             pass
 
-    def generate_report(self, out_dir, only_plot_good=True):
+    def generate_report(self, out_dir, only_plot_good=True, processes=0, plot_cache=None, charts='png'):
+        """
+        write the html report to out_dir. charts of stocks are plotted to images if charts is 'png', by a pool
+        of processes if processes > 1 and taken from and added to plot_cache, a PlotCache, if given. They are
+        drawn in browser from data files of stocks if charts is 'js'.
+        """
         env = Environment(loader=FileSystemLoader('templates'))
         template = env.get_template('report.jinja2')
-        output = template.render({
+        # written while rendered, bad stocks are not in the page but loaded from bad_stocks.js when shown
+        with open(os.path.join(out_dir, 'index.html'), "w+", encoding='utf-8') as f:
+            f.writelines(template.generate({
                     'config': self._config,
                     'good_stocks': self.good_stocks,
                     'bad_stocks': self.bad_stocks,
                     'global_status': self.global_status,
-                    'date': datetime.date.today()})
-        with open(os.path.join(out_dir, 'index.html'), "w+") as f:
-            f.write(output)
+                    'charts': charts,
+                    'date': datetime.date.today()}))
+        self._save_bad_stocks(os.path.join(out_dir, 'bad_stocks.js'))
 
         # copy resources
         def _copy_res(src):
@@ -253,17 +321,84 @@ class Analyzer(object):
         _copy_res('templates/js')
         _copy_res('templates/images')
 
-        # plot history
-        img_dir = os.path.join(out_dir, 'images')
+        results = self.good_stocks + (self.bad_stocks if not only_plot_good else [])
+        if charts == 'js':
+            shutil.copy('templates/chart.html', out_dir)
+            self._save_charts(os.path.join(out_dir, 'data'), results)
+        else:
+            self._plot_stocks(os.path.join(out_dir, 'images'), results, processes, plot_cache)
+
+    def _save_bad_stocks(self, path):
+        """
+        save bad stocks as DataTables data, rows are the columns of the table in the report after its sequence
+        number. It is a script calling rufengReport.loaded(), a row a line.
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('rufengReport.loaded("bad_stocks", {"data": [\n')
+            separator = ''
+            for result in self.bad_stocks:
+                stock = result.stock
+                if not stock.hist_len:
+                    logging.warning('%s: no hist_data, not listed in bad stocks' % stock)
+                    continue
+                row = [stock.code, stock.name, stock.price, stock.pe,
+                       round(stock.nmc / 10000 if stock.nmc is not None else 0.0, 2),
+                       round(stock.mktcap / 10000 if stock.mktcap is not None else 0.0, 2),
+                       round(float(stock.get_turnover_avg(5)), 2), round(float(stock.get_turnover_avg(30)), 2),
+                       stock.area, stock.industry, result.status, result.log]
+                f.write('%s%s' % (separator, json.dumps(row, ensure_ascii=False)))
+                separator = ',\n'
+            f.write('\n]});\n')
+
+    def _save_charts(self, data_dir, results):
+        """save data of charts drawn by js/chart.js, a few tens of KB a stock"""
+        os.makedirs(data_dir, exist_ok=True)
+        index = self.indexs['000001']
+        pbar = tqdm(results)
+        for result in pbar:
+            stock = result.stock
+            pbar.set_description("Saving %s" % (stock.code))
+            StockPlot.save_chart(StockPlot.data_of(stock, index), os.path.join(data_dir, '%s.js' % stock.code))
+        pbar.close()
+
+    def _plot_stocks(self, img_dir, results, processes=0, plot_cache=None):
         os.makedirs(img_dir, exist_ok=True)
+        index = self.indexs['000001']
 
-        plot = StockPlot()
-        pbar = tqdm(self.good_stocks + (self.bad_stocks if not only_plot_good else []))
-        for result in pbar:
+        # data of a plot is built once, when looking it up in cache or else when it is plotted
+        plots = []
+        keys = {}
+        for result in results:
             stock = result.stock
-            pbar.set_description("Plotting %s" % (stock.code))
             path = os.path.join(img_dir, '%s.png' % stock.code)
-            if os.path.exists(path):
-                continue  # skip existed plots
-            plot.plot_hist(stock, self.indexs['000001'], path=os.path.join(img_dir, '%s.png' % stock.code))
-        pbar.close()
+            data = None
+            if plot_cache is not None:
+                data = StockPlot.data_of(stock, index)
+                key = keys[path] = StockPlot().key_of(data)
+                if plot_cache.fetch(key, path):
+                    continue
+            plots.append((stock, path, data))
+        logging.info('plotting %d stocks, %d plots cached' % (len(plots), len(results) - len(plots)))
+
+        if processes > 1:
+            # workers get arrays of the plots only, they are built while earlier plots are drawn
+            tasks = ((StockPlot.data_of(stock, index) if data is None else data, path) for stock, path, data in plots)
+            with multiprocessing.Pool(processes, initializer=_init_plot_worker) as pool:
+                pbar = tqdm(pool.imap_unordered(_plot_worker, tasks), total=len(plots))
+                for path in pbar:
+                    pbar.set_description("Plotted %s" % os.path.basename(path))
+                    if plot_cache is not None:
+                        plot_cache.put(keys[path], path)
+                pbar.close()
+        else:
+            plot = StockPlot()
+            pbar = tqdm(plots)
+            for stock, path, data in pbar:
+                pbar.set_description("Plotting %s" % (stock.code))
+                plot.plot(StockPlot.data_of(stock, index) if data is None else data, path)
+                if plot_cache is not None:
+                    plot_cache.put(keys[path], path)
+            pbar.close()
+
+        if plot_cache is not None:
+            plot_cache.prune()
@@ -0,0 +1,230 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+"""
+benchmark the download -> load -> analyze -> report pipeline on a synthetic market, run from src:
+    python -m benchmark -n 500 -d 750
+every run is appended to a JSON history and compared with the last run of the same parameters.
+"""
+
+import sys
+sys.path.insert(0, 'tushare')
+
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import resource
+import tempfile
+import subprocess
+import yaml
+
+from dm import DataManager
+from benchmark.server import FakeTushareServer
+from benchmark.replay import ReplayServer
+
+STAGES = ('download', 'load', 'analyze', 'report')
+
+
+def peak_rss_mb():
+    """peak resident memory of this process so far"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024) if sys.platform == 'darwin' else rss / 1024.0
+
+
+def mongomock_db(name):
+    """
+    mongomock database usable by dm. mongomock cannot return raw BSON documents which
+    LocalDataManager.iter_stock reads, and older mongomock does not take the sort argument
+    newer pymongo passes to bulk operations.
+    """
+    import bson
+    import mongomock
+    from bson.raw_bson import RawBSONDocument
+    from mongomock.collection import Collection, BulkOperationBuilder
+
+    class RawCollection(object):
+        def __init__(self, collection):
+            self._collection = collection
+
+        def find(self, *args, batch_size=None, **kwargs):
+            for doc in self._collection.find(*args, **kwargs):
+                yield RawBSONDocument(bson.encode(doc))
+
+    with_options = Collection.with_options
+
+    def raw_with_options(self, codec_options=None, **kwargs):
+        if codec_options is not None and codec_options.document_class is RawBSONDocument:
+            return RawCollection(self)
+        return with_options(self, codec_options=codec_options, **kwargs)
+    Collection.with_options = raw_with_options
+
+    def drop_sort(func):
+        return lambda self, *args, sort=None, **kwargs: func(self, *args, **kwargs)
+    for op in ('add_replace', 'add_update', 'add_delete'):
+        setattr(BulkOperationBuilder, op, drop_sort(getattr(BulkOperationBuilder, op)))
+
+    return mongomock.MongoClient()[name]
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark(object):
+    def __init__(self, options):
+        self.options = options
+        self.result = {'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                       'version': git_version(),
+                       'params': {'stocks': options.stocks, 'days': options.days, 'seed': options.seed,
+                                  'hist_store': options.hist_store, 'mongo': options.mongo,
+                                  'threads': options.threads, 'processes': options.processes, 'charts': options.charts,
+                                  'latency': options.latency, 'error_rate': options.error_rate,
+                                  'pause': options.pause, 'replay': options.replay},
+                       'stages': {}}
+
+    def _stage(self, name, func, rows):
+        """run func as stage name, rows(result) is the number of data rows it processed"""
+        logging.info('benchmark stage %s' % name)
+        t_start = time.time()
+        value = func()
+        seconds = time.time() - t_start
+        count = rows(value)
+        self.result['stages'][name] = {'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss_mb(), 1),
+                                       'rows': count, 'rows_per_s': round(count / max(seconds, 1e-6), 1)}
+        logging.info('%s: %.2f seconds, %d rows, %.0f rows/s' % (name, seconds, count, count / max(seconds, 1e-6)))
+        return value
+
+    @staticmethod
+    def _hist_rows(dm):
+        return sum(s.hist_len for s in list(dm.stocks.values()) + list(dm.indexes.values()))
+
+    def _open_db(self):
+        name = 'rufeng_benchmark'
+        if self.options.mongo == 'mock':
+            return mongomock_db(name)
+        from pymongo import MongoClient
+        db = MongoClient(self.options.mongo)[name]
+        db.client.drop_database(name)
+        return db
+
+    def run(self):
+        options = self.options
+        work_dir = tempfile.mkdtemp(prefix='rufeng-benchmark-')
+        data_dir = os.path.join(work_dir, 'data')
+        db = self._open_db()
+        if options.replay:
+            server = ReplayServer(options.replay, options.record, options.latency, options.error_rate,
+                                  seed=options.seed)
+        else:
+            server = FakeTushareServer(options.stocks, options.days, options.seed, options.latency,
+                                       options.error_rate)
+        try:
+            with server:
+                dm = DataManager(options.hist_store, data_dir, db)
+                self._stage('download', lambda: dm.pick_data(options.threads, options.pause),
+                            lambda _: self._hist_rows(dm))
+
+            if 'load' in options.stages:
+                dm = DataManager(options.hist_store, data_dir, db)
+                self._stage('load', lambda: dm.load_from_db(), lambda _: self._hist_rows(dm))
+
+            if 'analyze' in options.stages or 'report' in options.stages:
+                from analyzer import Analyzer
+                with open(options.config) as f:
+                    schemes = yaml.safe_load(f)['analyzing']['schemes']
+                config = list(schemes.values())[0]['config']
+                analyzer = Analyzer(dm.stocks, dm.indexes, config, panel=dm.panel)
+                self._stage('analyze', lambda: analyzer.analyze(options.threads, options.processes),
+                            lambda _: self._hist_rows(dm))
+
+                if 'report' in options.stages:
+                    out_dir = os.path.join(work_dir, 'report')
+                    os.makedirs(out_dir)
+                    self._stage('report', lambda: analyzer.generate_report(out_dir, processes=options.processes,
+                                                                           charts=options.charts),
+                                lambda _: len(analyzer.good_stocks) + len(analyzer.bad_stocks))
+        finally:
+            if options.mongo != 'mock':
+                db.client.drop_database(db.name)
+            if options.keep:
+                logging.info('data kept in %s' % work_dir)
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        return self.result
+
+    def save(self, path):
+        """append result to history file, return the last result of same parameters before it"""
+        history = []
+        if os.path.exists(path):
+            with open(path) as f:
+                history = json.load(f)
+        last = None
+        for result in history:
+            if result['params'] == self.result['params']:
+                last = result
+        history.append(self.result)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(history, f, indent=2)
+        return last
+
+    def report(self, last):
+        print('%-10s %10s %10s %12s %12s' % ('stage', 'seconds', 'peak MB', 'rows/s', 'vs last'))
+        for name in STAGES:
+            stage = self.result['stages'].get(name)
+            if stage is None:
+                continue
+            change = ''
+            if last is not None and name in last['stages'] and last['stages'][name]['seconds']:
+                change = '%+.1f%%' % ((stage['seconds'] / last['stages'][name]['seconds'] - 1) * 100)
+            print('%-10s %10.2f %10.1f %12.0f %12s' % (name, stage['seconds'], stage['peak_rss_mb'],
+                                                      stage['rows_per_s'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark',
+                                     description='benchmark the data pipeline on a synthetic market')
+    parser.add_argument('-n', '--stocks', type=int, default=300, help='number of stocks')
+    parser.add_argument('-d', '--days', type=int, default=750, help='trading days of history')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic market')
+    parser.add_argument('-s', '--stages', default=','.join(STAGES),
+                        help='comma separated stages to run after download [default all]')
+    parser.add_argument('--hist-store', dest='hist_store', choices=('npy', 'mongo'), default='npy',
+                        help='history store')
+    parser.add_argument('--mongo', default='mock',
+                        help='mongodb uri, or mock to use mongomock [default mock]')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='threads to download and analyze')
+    parser.add_argument('-p', '--processes', type=int, default=0, help='processes to analyze and plot report')
+    parser.add_argument('--charts', choices=('png', 'js'), default='png',
+                        help='plot report charts to images or save their data for the browser')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every http response')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0,
+                        help='fraction of http requests answered with an error')
+    parser.add_argument('--pause', type=float, default=0.0, help='pause before retrying a failed request')
+    parser.add_argument('--replay', metavar='DIR', default=None,
+                        help='download responses recorded in DIR instead of the synthetic market')
+    parser.add_argument('--record', action='store_true', default=False,
+                        help='with --replay, fetch and record responses not recorded yet')
+    parser.add_argument('--config', default='configs/default.yaml', help='config file, first scheme is used')
+    parser.add_argument('--history', default='data/benchmark.json', help='JSON history of results')
+    parser.add_argument('--keep', action='store_true', default=False, help='keep downloaded data and report')
+    options = parser.parse_args()
+    options.stages = options.stages.split(',')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logging.getLogger('root').setLevel(logging.INFO)
+    benchmark = Benchmark(options)
+    benchmark.run()
+    benchmark.report(benchmark.save(options.history))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import datetime
+import numpy as np
+import pandas as pd
+from tushare.stock import cons as ct
+from stock import StockCalendar
+
+
+class SyntheticMarket(object):
+    """
+    a repeatable fake market of n stocks over the last 'days' trading days. It has what makes real data
+    expensive or tricky to handle: stocks listed inside the period, suspensions, ex-rights events (factor
+    steps with price gaps), ST names, GEM codes and full-width characters in names.
+    hist[code] is the daily data of a stock in ascending order with unadjusted prices and the hfq factor.
+    """
+    words = ('中国', '平安', '银行', '科技', '电子', '医药', '能源', '股份', '汽车', '地产', '通信', '材料')
+    industries = ('银行', '电子信息', '生物制药', '汽车制造', '房地产', '通讯行业', '化工行业', '机械行业')
+    areas = ('北京', '上海', '深圳', '浙江', '江苏', '广东', '四川', '山东')
+    report_kinds = {'mainindex': ct.REPORT_COLS + ['detail'], 'profit': ct.PROFIT_COLS,
+                    'operation': ct.OPERATION_COLS, 'grow': ct.GROWTH_COLS,
+                    'debtpaying': ct.DEBTPAYING_COLS, 'cashflow': ct.CASHFLOW_COLS}
+
+    def __init__(self, n=300, days=750, seed=0):
+        self.n = n
+        self.days = days
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        last_day = StockCalendar().last_completed_trade_day()
+        self.dates = np.array(pd.bdate_range(end=last_day, periods=days).strftime('%Y-%m-%d'))
+        self.codes = self._make_codes(rng, n)
+        self.hist = {code: self._make_hist(rng) for code in self.codes}
+        self.basics = self._make_basics(rng)
+        self.index_hist = {symbol: self._make_index(rng) for symbol in ct.INDEX_LIST.values()}
+
+        last_quarter = datetime.date(last_day.year, (last_day.month - 1) // 3 * 3 + 1, 1) - datetime.timedelta(days=1)
+        self.report_year, self.report_quarter = last_quarter.year, (last_quarter.month - 1) // 3 + 1
+        self.reports = {kind: self._make_report(rng, cols) for kind, cols in self.report_kinds.items()}
+
+    @property
+    def rows(self):
+        """days of history data of all stocks"""
+        return sum(df.index.size for df in self.hist.values())
+
+    @staticmethod
+    def symbol(code):
+        return ('sh' if code[0] in '569' else 'sz') + code
+
+    @staticmethod
+    def _make_codes(rng, n):
+        pool = ['60%04d' % i for i in range(4000)] + ['000%03d' % i for i in range(1, 1000)] + \
+               ['002%03d' % i for i in range(1, 1000)] + ['300%03d' % i for i in range(1, 1000)]
+        if n > len(pool):
+            raise ValueError('at most %d stocks' % len(pool))
+        return sorted(pool[i] for i in rng.choice(len(pool), n, replace=False))
+
+    def _make_hist(self, rng):
+        days = self.dates.size
+        start = rng.randint(days // 2, max(days - 20, days // 2 + 1)) if rng.rand() < 0.15 else 0  # listed inside
+        n = days - start
+
+        hfq = rng.uniform(5, 50) * np.exp(np.cumsum(rng.normal(0.0003, 0.025, n).clip(-0.1, 0.1)))
+        factor = np.full(n, rng.uniform(1, 8))
+        for _ in range(rng.poisson(n / 250.0)):  # ex-rights, about once a year
+            factor[rng.randint(1, n):] *= rng.uniform(1.05, 2.0)
+        factor = factor.round(3)
+        trading = np.ones(n, dtype=bool)
+        for _ in range(rng.poisson(n / 400.0)):  # suspensions up to three months
+            day = rng.randint(1, n)
+            trading[day:day + rng.randint(1, 60)] = False
+        hfq, factor = hfq[trading], factor[trading]
+
+        close = (hfq / factor).round(2)
+        prev_close = np.r_[close[0], close[:-1] * factor[:-1] / factor[1:]]  # adjusted to the ex-rights day
+        open_price = (prev_close * (1 + rng.normal(0, 0.01, close.size))).round(2)
+        high = (np.maximum(open_price, close) * (1 + rng.uniform(0, 0.02, close.size))).round(2)
+        low = (np.minimum(open_price, close) * (1 - rng.uniform(0, 0.02, close.size))).round(2)
+        volume = rng.uniform(1e4, 1e6, close.size).round(2)
+        df = pd.DataFrame({'open': open_price, 'high': high, 'close': close, 'low': low, 'volume': volume,
+                           'price_change': (close - prev_close).round(2),
+                           'p_change': ((close / prev_close - 1) * 100).round(2)},
+                          index=self.dates[start:][trading])
+        for window in (5, 10, 20):
+            df['ma%d' % window] = df.close.rolling(window, min_periods=1).mean().round(3)
+        for window in (5, 10, 20):
+            df['v_ma%d' % window] = df.volume.rolling(window, min_periods=1).mean().round(2)
+        df['turnover'] = rng.uniform(0.1, 10, close.size).round(2)
+        df['factor'] = factor
+        return df
+
+    def _make_index(self, rng):
+        close = rng.uniform(1000, 10000) * np.exp(np.cumsum(rng.normal(0.0002, 0.015, self.dates.size)))
+        prev_close = np.r_[close[0], close[:-1]]
+        df = pd.DataFrame({'open': prev_close, 'high': np.maximum(prev_close, close) * 1.005, 'close': close,
+                           'low': np.minimum(prev_close, close) * 0.995,
+                           'volume': rng.uniform(1e7, 1e8, close.size),
+                           'price_change': close - prev_close, 'p_change': (close / prev_close - 1) * 100},
+                          index=self.dates).round(2)
+        for window in (5, 10, 20):
+            df['ma%d' % window] = df.close.rolling(window, min_periods=1).mean().round(3)
+        for window in (5, 10, 20):
+            df['v_ma%d' % window] = df.volume.rolling(window, min_periods=1).mean().round(2)
+        return df
+
+    def _make_name(self, rng):
+        name = ''.join(self.words[i] for i in rng.choice(len(self.words), 2, replace=False))
+        if rng.rand() < 0.1:
+            name += rng.choice(['Ａ', 'Ｂ', '　Ａ'])  # full-width characters used by sina
+        if rng.rand() < 0.05:
+            name = rng.choice(['ST', '*ST', 'S*ST']) + name
+        return name
+
+    def _make_basics(self, rng):
+        rows = []
+        for code in self.codes:
+            hist = self.hist[code]
+            listed = hist.index[0] if hist.index[0] != self.dates[0] else \
+                '%04d-%02d-%02d' % (rng.randint(1991, int(self.dates[0][:4])), rng.randint(1, 13), rng.randint(1, 29))
+            outstanding = rng.uniform(0.5, 50)  # 100M shares
+            totals = outstanding * rng.uniform(1, 2)
+            eps = rng.normal(0.3, 0.4)
+            bvps = rng.uniform(1, 10)
+            price = hist.close.iloc[-1]
+            rows.append({'code': code, 'name': self._make_name(rng),
+                         'industry': rng.choice(self.industries), 'area': rng.choice(self.areas),
+                         'pe': round(price / eps, 2) if eps > 0 else 0.0,
+                         'outstanding': round(outstanding, 2), 'totals': round(totals, 2),
+                         'totalAssets': round(totals * rng.uniform(1, 20) * 1e4, 2),
+                         'liquidAssets': round(totals * rng.uniform(1, 10) * 1e4, 2),
+                         'fixedAssets': round(totals * rng.uniform(1, 10) * 1e4, 2),
+                         'reserved': round(totals * rng.uniform(0.1, 3) * 1e4, 2),
+                         'reservedPerShare': round(rng.uniform(0.1, 3), 2),
+                         'esp': round(eps, 3), 'bvps': round(bvps, 2), 'pb': round(price / bvps, 2),
+                         'timeToMarket': int(listed.replace('-', ''))})
+        return pd.DataFrame(rows).set_index('code')
+
+    def _make_report(self, rng, cols):
+        codes = [code for code in self.codes if rng.rand() < 0.95]
+        df = pd.DataFrame({'code': codes, 'name': self.basics['name'][codes].values})
+        for col in cols[2:]:
+            if col == 'distrib':
+                df[col] = ['10派%.1f' % v if v > 0 else '' for v in rng.normal(0, 2, len(codes))]
+            elif col == 'report_date':
+                df[col] = ['%02d-%02d' % (m, d) for m, d in zip(rng.randint(1, 13, len(codes)),
+                                                                 rng.randint(1, 29, len(codes)))]
+            elif col == 'detail':
+                df[col] = '明细'
+            else:
+                df[col] = rng.normal(10, 20, len(codes)).round(2)
+        return df
+
+    def today_all(self):
+        """latest quotes of all stocks in the order of sina, trade is 0 if suspended on the last day"""
+        rows = []
+        for code in self.codes:
+            hist, basics = self.hist[code], self.basics.loc[code]
+            last = hist.iloc[-1]
+            trading = hist.index[-1] == self.dates[-1]
+            trade = last.close if trading else 0.0
+            rows.append({'symbol': self.symbol(code), 'code': code, 'name': basics['name'],
+                         'changepercent': last.p_change if trading else 0.0, 'trade': trade,
+                         'open': last.open if trading else 0.0, 'high': last.high if trading else 0.0,
+                         'low': last.low if trading else 0.0, 'settlement': last.close,
+                         'volume': round(last.volume * 100) if trading else 0, 'turnoverratio': last.turnover,
+                         'amount': round(last.volume * 100 * last.close, 2),
+                         'per': basics.pe, 'pb': basics.pb,
+                         'mktcap': round(last.close * basics.totals * 1e4, 4),
+                         'nmc': round(last.close * basics.outstanding * 1e4, 4)})
+        return pd.DataFrame(rows, columns=['symbol'] + [col for col in ct.DAY_TRADING_COLUMNS if col != 'symbol'])
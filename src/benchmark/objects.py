@@ -0,0 +1,117 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+"""
+memory and attribute access of stock objects over the whole market, run from src:
+    python -m benchmark.objects -n 4000
+compares slotted Stock objects attached to one Fundamentals table with objects keeping every field
+in their own __dict__ as Stock did before.
+"""
+
+import sys
+sys.path.insert(0, 'tushare')
+
+import gc
+import timeit
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from stock import Stock
+from fundamentals import Fundamentals
+from screen import ScreenEngine
+
+
+class DictStock(object):
+    """stock with all fields in __dict__, the layout before slots and the fundamentals table"""
+    def __init__(self, code=None, name=None):
+        self.code = code
+        self.name = name
+        self.last_update = None
+        self.hist_data = None
+        self._indicators = {}
+        self._partial = False
+        for field, _ in Fundamentals.FIELDS:
+            setattr(self, field, None)
+        self._qfq = None
+
+
+def make_fundamentals(n, seed=0):
+    """fundamentals of n stocks, a DataFrame indexed by code"""
+    rng = np.random.RandomState(seed)
+    codes = ['%06d' % i for i in range(n)]
+    columns = {}
+    for field, dtype in Fundamentals.FIELDS:
+        if dtype == 'O':
+            columns[field] = ['%s%d' % (field, i) for i in rng.randint(0, 50, n)]
+        elif dtype == 'i8':
+            columns[field] = rng.randint(19900101, 20200101, n)
+        else:
+            columns[field] = rng.normal(10, 20, n).round(2)
+    return pd.DataFrame(columns, index=codes)
+
+
+def build_dict_stocks(df):
+    stocks = {}
+    for code, row in zip(df.index, df.to_dict('records')):
+        stock = stocks[code] = DictStock(code, 'name%s' % code)
+        for field, value in row.items():
+            setattr(stock, field, value)
+    return stocks
+
+
+def build_slotted_stocks(df):
+    table = Fundamentals()
+    table.update(df)
+    stocks = {}
+    for code in df.index:
+        stock = stocks[code] = Stock(code, 'name%s' % code)
+        stock.attach_fundamentals(table)
+    return stocks
+
+
+def measure(build, df):
+    """(objects, bytes allocated by build)"""
+    gc.collect()
+    tracemalloc.start()
+    objects = build(df)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return objects, size
+
+
+def read_fields(stocks):
+    """what the per stock analyzer reads of every stock"""
+    total = 0.0
+    for stock in stocks.values():
+        if stock.code.startswith('300') or stock.name.startswith('ST'):
+            continue
+        for value in (stock.price, stock.nmc, stock.mktcap, stock.pe):
+            if value is not None:
+                total += value
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark.objects',
+                                     description='benchmark memory and attribute access of stock objects')
+    parser.add_argument('-n', '--stocks', type=int, default=4000, help='number of stocks')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='best of repeat runs')
+    options = parser.parse_args()
+
+    df = make_fundamentals(options.stocks)
+    codes = list(df.index)
+    print('%d stocks x %d fields, best of %d' % (options.stocks, len(Fundamentals.FIELDS), options.repeat))
+    print('%-10s %12s %12s %14s %14s' % ('layout', 'total MB', 'bytes/stock', 'read fields ms', 'basics_of ms'))
+    for name, build in (('__dict__', build_dict_stocks), ('slots', build_slotted_stocks)):
+        stocks, size = measure(build, df)
+        read = min(timeit.repeat(lambda: read_fields(stocks), number=1, repeat=options.repeat))
+        basics = min(timeit.repeat(lambda: ScreenEngine.basics_of(stocks, codes), number=1, repeat=options.repeat))
+        print('%-10s %12.2f %12.0f %14.2f %14.2f' % (name, size / 1e6, size / float(options.stocks),
+                                                     read * 1000, basics * 1000))
+        del stocks
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+"""
+micro-benchmark of full-width to half-width normalization of stock names, industries and areas:
+    python -m benchmark.q2b -n 3000
+"""
+
+import sys
+sys.path.insert(0, 'tushare')
+
+import timeit
+import argparse
+import numpy as np
+import pandas as pd
+
+import util
+from benchmark.market import SyntheticMarket
+
+
+def loop_strQ2B(ustring):
+    """the character by character conversion util.strQ2B used to do, as the baseline"""
+    rstring = ""
+    for uchar in ustring:
+        inside_code = ord(uchar)
+        if inside_code == 0x3000:
+            inside_code = 0x20
+        elif 0xFF01 <= inside_code <= 0xFF5E:
+            inside_code -= 0xfee0
+        rstring += chr(inside_code)
+    return rstring
+
+
+def make_column(n, seed=0):
+    """n values like a stock basics column, names mostly unique and industries/areas repeated"""
+    rng = np.random.RandomState(seed)
+    market = SyntheticMarket.__new__(SyntheticMarket)
+    names = [market._make_name(rng) for _ in range(n)]
+    industries = list(rng.choice(SyntheticMarket.industries, n))
+    areas = list(rng.choice(SyntheticMarket.areas, n))
+    return pd.Series(names + industries + areas, dtype=object)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark.q2b',
+                                     description='benchmark full-width to half-width normalization')
+    parser.add_argument('-n', '--stocks', type=int, default=3000, help='number of stocks')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='best of repeat runs')
+    options = parser.parse_args()
+
+    column = make_column(options.stocks)
+    values = column.tolist()
+    cases = (
+        ('loop per value', lambda: [loop_strQ2B(v).replace(' ', '') for v in values]),
+        ('strQ2B per value', lambda: [util.strQ2B(v).replace(' ', '') for v in values]),
+        ('normalize per value', lambda: [util.normalize(v) for v in values]),
+        ('normalize series', lambda: util.normalize(column)),
+    )
+    expected = cases[0][1]()
+    for name, func in cases:
+        assert list(func()) == expected, name
+
+    print('%d values of %d stocks, best of %d' % (len(values), options.stocks, options.repeat))
+    baseline = None
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=1, repeat=options.repeat))
+        baseline = baseline or seconds
+        print('%-20s %10.2f ms %8.1fx' % (name, seconds * 1000, baseline / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+"""
+record tushare responses once, then replay them offline with configurable latency and errors:
+    python -m benchmark.replay data/cassette --record --port 8000
+    python rufeng_finance.py download --server http://127.0.0.1:8000
+"""
+
+import sys
+sys.path.insert(0, 'tushare')
+
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+from threading import Lock
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from urllib.request import Request, build_opener, ProxyHandler
+from urllib.error import HTTPError, URLError
+from socket import timeout
+from tushare.stock import cons as ct
+from benchmark.server import TushareServer
+
+
+class Cassette(object):
+    """
+    responses recorded by url in a directory. Bodies are files named by sha1 of the url, index.jsonl maps
+    urls to status and file and is appended as responses are recorded, so a killed recorder loses nothing.
+    """
+    volatile_params = ('_', 'rn')  # cache busters, not part of the key
+
+    def __init__(self, path):
+        self.path = path
+        self._index = {}
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        index_file = os.path.join(path, 'index.jsonl')
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._index[entry['url']] = entry
+
+    def __len__(self):
+        return len(self._index)
+
+    @classmethod
+    def key(cls, url):
+        parts = urlsplit(url)
+        query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in cls.volatile_params]
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+    def get(self, url):
+        """return (status, body) recorded for url, or None"""
+        entry = self._index.get(self.key(url))
+        if entry is None:
+            return None
+        with open(os.path.join(self.path, entry['file']), 'rb') as f:
+            return entry['status'], f.read()
+
+    def put(self, url, status, body):
+        key = self.key(url)
+        entry = {'url': key, 'status': status, 'file': hashlib.sha1(key.encode('utf-8')).hexdigest()}
+        with open(os.path.join(self.path, entry['file']), 'wb') as f:
+            f.write(body)
+        with self._lock:
+            with open(os.path.join(self.path, 'index.jsonl'), 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+            self._index[key] = entry
+
+
+class ReplayResponder(object):
+    """answer from a cassette, 404 for anything not recorded"""
+    def __init__(self, path):
+        self.cassette = Cassette(path)
+
+    def respond(self, url):
+        response = self.cassette.get(url)
+        if response is None:
+            logging.warning('not recorded: %s' % url)
+            return 404, b''
+        return response
+
+
+class RecordResponder(ReplayResponder):
+    """answer from a cassette, fetch and record what is not in it yet"""
+    user_agent = 'Mozilla/5.0 (Windows NT 6.1; rv:37.0) Gecko/20100101 Firefox/37.0'
+
+    def __init__(self, path):
+        super(RecordResponder, self).__init__(path)
+        self._opener = build_opener(ProxyHandler({}))  # never through ourselves
+
+    def respond(self, url):
+        response = self.cassette.get(url)
+        if response is not None:
+            return response
+        try:
+            resp = self._opener.open(Request(url, headers={'User-Agent': self.user_agent}), timeout=ct.DEFAULT_TIMEOUT)
+            status, body = resp.getcode(), resp.read()
+        except HTTPError as e:
+            status, body = e.code, e.read()
+        except (URLError, timeout) as e:
+            logging.error('cannot fetch %s: %s' % (url, str(e)))
+            return 502, b''  # not recorded, the client will retry
+        self.cassette.put(url, status, body)
+        return status, body
+
+
+class ReplayServer(TushareServer):
+    """serve the responses recorded in directory path, record missing ones from the real sites if record"""
+    def __init__(self, path, record=False, latency=0.0, error_rate=0.0, error_status=503, seed=0, port=0):
+        super(ReplayServer, self).__init__(RecordResponder if record else ReplayResponder, (path, ), latency,
+                                           error_rate, error_status, seed, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark.replay',
+                                     description='serve recorded tushare responses')
+    parser.add_argument('path', help='directory of recorded responses')
+    parser.add_argument('-r', '--record', action='store_true', default=False,
+                        help='fetch and record responses not recorded yet')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0,
+                        help='fraction of requests answered with an error')
+    parser.add_argument('--error-status', dest='error_status', type=int, default=503,
+                        help='http status of injected errors')
+    parser.add_argument('--seed', type=int, default=0, help='seed of error injection')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    server = ReplayServer(options.path, options.record, options.latency, options.error_rate,
+                          options.error_status, options.seed, options.port)
+    server.start()
+    logging.info('%s %d responses of %s at %s, use it by tushare.set_server(\'%s\')' % (
+                 'recording' if options.record else 'replaying', len(Cassette(options.path)), options.path,
+                 server.url, server.url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import re
+import gzip
+import json
+import time
+import zlib
+import multiprocessing
+from queue import Empty
+from threading import Lock
+from urllib.parse import urlparse, parse_qs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import tushare as ts
+from tushare.stock import cons as ct
+from benchmark.market import SyntheticMarket
+
+
+class MarketResponder(object):
+    """render the pages tushare downloads from with data of a SyntheticMarket"""
+    def __init__(self, market):
+        self.market = market
+        self._stocks = {market.symbol(code): code for code in market.codes}
+        self._today_all = market.today_all()
+        self._cache = {}
+        self._routes = [
+            (re.compile(r'^/tsdata/all\.csv$'), self.stock_basics),
+            (re.compile(r'^/akdaily/$'), self.hist_data),
+            (re.compile(r'^/quotes_service/api/json_v2\.php/Market_Center\.getHQNodeData$'), self.today_all),
+            (re.compile(r'^/q/go\.php/vFinanceAnalyze/kind/(\w+)/index\.phtml$'), self.report),
+            (re.compile(r'^/corp/go\.php/vMS_FuQuanMarketHistory/stockid/(\d+)\.phtml$'), self.fq_factor),
+        ]
+
+    def respond(self, url):
+        """return (status, body) of url, pages are rendered once as the market never changes"""
+        response = self._cache.get(url)
+        if response is None:
+            response = self._cache[url] = self._render(url)
+        return response
+
+    def _render(self, url):
+        url = urlparse(url)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        for pattern, func in self._routes:
+            m = pattern.match(url.path)
+            if m:
+                return 200, func(query, *m.groups())
+        return 404, b''
+
+    def stock_basics(self, query):
+        return self.market.basics.to_csv().encode('GBK')
+
+    def hist_data(self, query):
+        symbol = query.get('code')
+        if symbol in self.market.index_hist:
+            df = self.market.index_hist[symbol][ct.INX_DAY_PRICE_COLUMNS[1:]]
+        elif symbol in self._stocks:
+            df = self.market.hist[self._stocks[symbol]][ct.DAY_PRICE_COLUMNS[1:]]
+        else:
+            return b'{}'
+        volumes = [i for i, col in enumerate(df.columns) if 'volume' in col or col.startswith('v_ma')]
+        records = []
+        for date, row in zip(df.index, df.values.tolist()):
+            record = ['{:,.2f}'.format(v) if i in volumes else '%.2f' % v for i, v in enumerate(row)]
+            records.append([date] + record)
+        return json.dumps({'record': records}).encode('utf-8')
+
+    def today_all(self, query):
+        num, page = int(query.get('num', 80)), int(query.get('page', 1))
+        df = self._today_all[(page - 1) * num:page * num]
+        if df.empty:
+            return b'null'
+        items = []
+        for row in df.to_dict('records'):
+            items.append('{%s}' % ','.join('%s:%s' % (k, json.dumps(v, ensure_ascii=False)) for k, v in row.items()))
+        return ('[%s]' % ','.join(items)).encode('GBK')
+
+    def report(self, query, kind):
+        if 'reportdate' not in query:
+            return self._report_period()
+        df = self.market.reports.get(kind)
+        if df is None:
+            return b''
+        num, page = int(query.get('num', 60)), int(query.get('p', 1))
+        rows = df[(page - 1) * num:page * num]
+        html = ['<html><body><table class="list_table" id="dataTable">']
+        for row in rows.values.tolist():
+            html.append('<tr>%s</tr>' % ''.join('<td>%s</td>' % v for v in row))
+        html.append('</table><div class="pages">')
+        if page * num < df.index.size:
+            html.append('<a onclick="set_page_num(\'%d\')">下一页</a>' % (page + 1))
+        html.append('</div></body></html>')
+        return ''.join(html).encode('GBK')
+
+    def _report_period(self):
+        years = ''.join('<option value="%d"%s>%d</option>' % (
+                        y, ' selected="selected"' if y == self.market.report_year else '', y)
+                        for y in range(self.market.report_year, self.market.report_year - 3, -1))
+        quarters = ''.join('<option value="%d"%s>%d</option>' % (
+                           q, ' selected="selected"' if q == self.market.report_quarter else '', q)
+                           for q in range(1, 5))
+        return ('<html><body><form><select name="reportdate">%s</select><select name="quarter">%s</select>'
+                '</form></body></html>' % (years, quarters)).encode('GBK')
+
+    def fq_factor(self, query, code):
+        hist = self.market.hist.get(code)
+        year, quarter = query.get('year'), int(query.get('jidu', 1))
+        if hist is None or year is None:
+            return b''
+        first = '%s-%02d-01' % (year, quarter * 3 - 2)
+        last = '%s-%02d-31' % (year, quarter * 3)
+        df = hist[(hist.index >= first) & (hist.index <= last)].sort_index(ascending=False)
+        if df.empty:
+            return '<html><body>没有数据</body></html>'.encode('GBK')  # not listed yet or suspended
+        html = ['<html><body><table id="FundHoldSharesTable">',
+                '<tr><td colspan="8">%s复权历史交易</td></tr>' % code,
+                '<tr><td>日期</td><td>开盘价</td><td>最高价</td><td>收盘价</td><td>最低价</td>'
+                '<td>交易量(股)</td><td>交易金额(元)</td><td>复权因子</td></tr>']
+        for date, row in zip(df.index, df[['open', 'high', 'close', 'low', 'volume', 'factor']].values.tolist()):
+            open_price, high, close, low, volume, factor = row
+            html.append('<tr><td><div><a>%s</a></div></td>%s</tr>' % (date, ''.join(
+                        '<td><div>%s</div></td>' % v for v in (
+                            '%.3f' % (open_price * factor), '%.3f' % (high * factor), '%.3f' % (close * factor),
+                            '%.3f' % (low * factor), '%d' % (volume * 100), '%d' % (volume * 100 * close),
+                            '%.3f' % factor))))
+        html.append('</table></body></html>')
+        return ''.join(html).encode('GBK')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def should_fail(self, url):
+        """
+        error injection, decided by url and how many times it was requested so a run fails the same
+        requests whatever the order requests arrive in
+        """
+        if not self.error_rate:
+            return False
+        with self.lock:
+            attempt = self.attempts[url] = self.attempts.get(url, 0) + 1
+        return zlib.crc32(('%d#%s#%d' % (self.seed, url, attempt)).encode('utf-8')) / 2.0 ** 32 < self.error_rate
+
+    def gzip(self, url, body):
+        """compressed body, kept so the server does not become the bottleneck of keep-alive gzip clients"""
+        compressed = self.gzipped.get(url)
+        if compressed is None:
+            compressed = self.gzipped[url] = gzip.compress(body, 1)
+        return compressed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are sent apart, keep-alive clients would wait for acks
+
+    def do_GET(self):
+        # requests sent through a proxy carry the full url
+        url = self.path if self.path.startswith('http') else 'http://%s%s' % (self.headers['Host'], self.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail(url):
+            status, body = self.server.error_status, b''
+        else:
+            status, body = self.server.responder.respond(url)
+        self.send_response(status)
+        if body and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = self.server.gzip(url, body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(make_responder, args, latency, error_rate, error_status, seed, port, port_queue):
+    httpd = _ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    httpd.responder = make_responder(*args)
+    httpd.latency = latency
+    httpd.error_rate = error_rate
+    httpd.error_status = error_status
+    httpd.seed = seed
+    httpd.attempts = {}
+    httpd.gzipped = {}
+    httpd.lock = Lock()
+    port_queue.put(httpd.server_address[1])
+    httpd.serve_forever()
+
+
+def _market_responder(n, days, seed):
+    return MarketResponder(SyntheticMarket(n, days, seed))
+
+
+class TushareServer(object):
+    """
+    serve what make_responder(*args) returns, an object with respond(url) -> (status, body), over HTTP
+    from a child process, so serving takes no CPU time of the process being measured. install() makes
+    tushare send all requests through it as a proxy (tushare.set_server), tushare keeps its real URLs.
+    latency seconds are added to every response, and error_rate of requests are answered error_status
+    with no body instead. It listens on a free port unless port is given.
+    """
+    def __init__(self, make_responder, args=(), latency=0.0, error_rate=0.0, error_status=503, seed=0, port=0):
+        self.make_responder = make_responder
+        self.args = args
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.seed = seed
+        self.port = port
+        self._process = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.port
+
+    def start(self):
+        port_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve, args=(
+            self.make_responder, self.args, self.latency, self.error_rate, self.error_status, self.seed, self.port,
+            port_queue))
+        self._process.daemon = True
+        self._process.start()
+        port = None
+        while port is None:  # building the market may take a while
+            try:
+                port = self.port = port_queue.get(timeout=1)
+            except Empty:
+                if not self._process.is_alive():
+                    raise RuntimeError('tushare server exited with %s' % self._process.exitcode)
+
+    def stop(self):
+        self.uninstall()
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def install(self):
+        ts.set_server(self.url)
+
+    @staticmethod
+    def uninstall():
+        ts.set_server(None)
+
+    def __enter__(self):
+        self.start()
+        self.install()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class FakeTushareServer(TushareServer):
+    """serve a SyntheticMarket of n stocks over the last 'days' trading days"""
+    def __init__(self, n=300, days=750, seed=0, latency=0.0, error_rate=0.0, error_status=503):
+        super(FakeTushareServer, self).__init__(_market_responder, (n, days, seed), latency, error_rate,
+                                                error_status, seed)
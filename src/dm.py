@@ -2,118 +2,313 @@
 __author__ = 'Du, Changbin <changbin.du@gmail.com>'
 
 
+import os
 import math
 import datetime, time
-from queue import Queue
-from threading import Thread
-from pymongo import MongoClient
+from queue import Queue, Empty, Full
+from threading import Thread, Event, Lock
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, ReplaceOne
 from pymongo import errors as mongo_errors
+import bson
+from bson.raw_bson import RawBSONDocument
+from bson.codec_options import CodecOptions
 import numpy as np
-from pandas import DataFrame
+from pandas import DataFrame, concat
 import tushare as ts
 import logging
 from tqdm import tqdm
 
 import util
-from stock import Stock, Index, StockCalendar
+from stock import StockBase, Stock, Index, StockCalendar
+from fundamentals import Fundamentals
+from store import create_history_store
+from panel import MarketPanel
 
 
 class LocalDataManager(object):
-    """we use mongodb to cache data"""
-    def __init__(self):
-        client = MongoClient('localhost', 27017)
-        self.db = client.rufeng_finance
+    """
+    we use mongodb to cache data, history data goes to a columnar history store.
+    find functions take these optional arguments:
+      fields: only load these fields of stock documents, others keep default values
+      lazy_hist: do not load hist_data until it is accessed the first time
+      last_n: only load the last last_n days of hist_data, data derived from it is not loaded
+    stocks loaded with fields or last_n are partial and cannot be saved back.
+    fundamentals of stocks are not in stock documents, stocks are attached to the fundamentals table instead.
+    """
+    def __init__(self, hist_store='npy', data_dir='data', db=None):
+        self.db = MongoClient('localhost', 27017).rufeng_finance if db is None else db
         self.stock_collection = self.db.stocks
         self.indexes_collection = self.db.indexes
+        self.fundamentals_collection = self.db.fundamentals
+        self.hist_store = create_history_store(hist_store, db=self.db, data_dir=data_dir)
+        self._fundamentals = None
+        self._fundamentals_lock = Lock()
 
-    def find_one_stock(self, code):
-        dstock = self.stock_collection.find_one({'code': code})
+    @property
+    def fundamentals(self):
+        """fundamentals table last saved, loaded on first use"""
+        with self._fundamentals_lock:
+            if self._fundamentals is None:
+                self._fundamentals = self.load_fundamentals() or Fundamentals()
+            return self._fundamentals
+
+    def load_fundamentals(self, period=None):
+        """fundamentals table of report period (year, quarter), the last saved one if not given"""
+        if period is None:
+            docs = list(self.fundamentals_collection.find().sort('updated', -1).limit(1))
+            doc = docs[0] if docs else None
+        else:
+            doc = self.fundamentals_collection.find_one({'period': '%d-%d' % period})
+        return Fundamentals.from_document(doc) if doc is not None else None
+
+    def save_fundamentals(self, table):
+        doc = table.to_document()
+        return self.fundamentals_collection.replace_one({'period': doc['period']}, doc, True)
+
+    def find_one_stock(self, code, fields=None, lazy_hist=False, last_n=None):
+        dstock = self.stock_collection.find_one({'code': code}, self.__projection(fields))
         if dstock is None:
             return None
-        stock = self.__from_dict(dstock, False)
-        stock.sanitize()
-        return stock
+        return self.__from_dict(dstock, False, fields, lazy_hist, last_n)
 
-    def find_stock(self, filter=None, show_process=False):
+    def find_stock(self, filter=None, show_process=False, fields=None, lazy_hist=False, last_n=None):
         slist = []
-        cursor = self.stock_collection.find(filter)
-        with tqdm(total=cursor.count()) as pbar:
+        cursor = self.stock_collection.find(filter, self.__projection(fields))
+        with tqdm(total=self.stock_collection.count_documents(filter or {}), disable=not show_process) as pbar:
             for dstock in cursor:
-                stock = self.__from_dict(dstock, False)
-                stock.sanitize()
-                slist.append(stock)
-                show_process and pbar.update()
-        pbar.close()
+                slist.append(self.__from_dict(dstock, False, fields, lazy_hist, last_n))
+                pbar.update()
         return slist
 
+    def iter_stock(self, filter=None, fields=None, lazy_hist=False, last_n=None, workers=4, batch_size=100):
+        """
+        stream stocks out of database. The code space is split into workers ranges, each range is read
+        by its own cursor in batches of batch_size raw documents which are decoded by the worker thread of
+        that range, so reading and decoding are pipelined. Stocks are yielded as soon as they are ready,
+        at most batch_size stocks are buffered.
+        """
+        codes = sorted(self.stock_collection.distinct('code', filter))
+        if not codes:
+            return
+        workers = max(min(workers, len(codes)), 1)
+        bounds = [codes[len(codes) * i // workers] for i in range(workers)] + [None]
+        collection = self.stock_collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+        projection = self.__projection(fields)
+        out = Queue(maxsize=batch_size)
+        stop = Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def read(low, high):
+            code_range = {'$gte': low} if high is None else {'$gte': low, '$lt': high}
+            range_filter = {'$and': [filter, {'code': code_range}]} if filter else {'code': code_range}
+            try:
+                for raw in collection.find(range_filter, projection, batch_size=batch_size):
+                    stock = self.__from_dict(bson.decode(raw.raw), False, fields, lazy_hist, last_n)
+                    size = len(raw.raw)
+                    if stock.hist_loaded and stock.hist_data is not None:
+                        size += stock.hist_data.memory_usage(index=True).sum()
+                    if not put((stock, size)):
+                        return
+            except Exception as e:
+                put((e, 0))
+            finally:
+                put(None)
+
+        threads = [Thread(name='LoadingThread%d' % i, target=read, args=(bounds[i], bounds[i + 1]))
+                   for i in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        t_start = time.time()
+        docs = size = 0
+        running = workers
+        try:
+            while running:
+                item = out.get()
+                if item is None:
+                    running -= 1
+                    continue
+                stock, n = item
+                if isinstance(stock, Exception):
+                    raise stock
+                docs += 1
+                size += n
+                yield stock
+        finally:
+            stop.set()
+        elapsed = max(time.time() - t_start, 1e-6)
+        logging.info('loaded %d stocks (%.1f MB) in %.2f seconds by %d threads, %.0f docs/s, %.1f MB/s' % (
+                     docs, size / 1e6, elapsed, workers, docs / elapsed, size / 1e6 / elapsed))
+
+    def save_modified_fundamentals(self, stocks):
+        """
+        save fundamentals tables stocks are attached to if they are modified, fields of stocks are only
+        saved to their table, e.g. the ones moved from legacy stock documents.
+        """
+        tables = set(stock.fundamentals for stock in stocks if isinstance(stock, Stock))
+        for table in tables:
+            if table is not None and table.modified:
+                self.save_fundamentals(table)
+
     def save_stock(self, stock, fields=None):
+        self.save_modified_fundamentals([stock])
         if fields is None:
+            self.__save_hist(stock, False)
             sdict = self.__to_dict(stock)
             result = self.stock_collection.replace_one({'code': stock.code}, sdict, True)
             return result
         else:
             update = {}
             for k in fields:
-                v = stock[k]
-                if isinstance(v, DataFrame):
-                    v = v.to_dict(orient='index')
-                update[k] = v
+                if k == 'hist_data':
+                    self.__save_hist(stock, False)
+                    continue
+                update[k] = stock[k]
             result = self.stock_collection.update_one({'code': stock.code}, {'$set': update})
             return result
 
     def drop_stock(self, code):
+        self.hist_store.drop('stocks', code)
         if code:
             result = self.stock_collection.delete_one({'code': code})
             return result.deleted_count
         else:
             self.stock_collection.drop()
+            self.fundamentals_collection.drop()
+            with self._fundamentals_lock:
+                self._fundamentals = None
+
+    def hist_dates(self, code, is_index=False):
+        """(days, first date, last date) of saved hist_data of code without loading it, None if nothing saved"""
+        return self.hist_store.date_range(is_index and 'indexes' or 'stocks', code)
+
+    def __save_hist(self, stock, is_index):
+        self.hist_store.write(self.__hist_ops(stock, is_index))
+
+    def __hist_ops(self, stock, is_index, since=None):
+        """
+        history store writes of stock. since is the last day already saved if only new days are
+        appended after it, then only days after it are written to frames already saved.
+        """
+        if stock._partial:
+            raise ValueError('%s is partially loaded, cannot be saved' % stock)
+        collection = is_index and 'indexes' or 'stocks'
+        frames = stock.cached_frames
+        if stock.hist_data is not None:
+            frames['hist'] = stock.hist_data
+        saved = set(self.hist_store.frames(collection, stock.code)) if since is not None else ()
+        ops = []
+        for frame, df in frames.items():
+            if since is not None and frame in saved and df.index.size == stock.hist_len:
+                delta = df[df.index > since]
+                if delta.index.size:
+                    ops.append(('append', collection, stock.code, delta, frame))
+            else:
+                ops.append(('save', collection, stock.code, df, frame))
+        # cached data invalidated since last save
+        ops.append(('retain', collection, stock.code, list(frames.keys()) + ['hist']))
+        return ops
+
+    def write_batch(self, items):
+        """
+        save a batch of (stock, is_index, since) at once, see __hist_ops for since. history goes
+        to history store first, then stock documents are written with one bulk_write per collection.
+        """
+        hist_ops = []
+        requests = {False: [], True: []}
+        for stock, is_index, since in items:
+            hist_ops += self.__hist_ops(stock, is_index, since)
+            requests[is_index].append(ReplaceOne({'code': stock.code}, self.__to_dict(stock), upsert=True))
+        self.hist_store.write(hist_ops)
+        self.save_modified_fundamentals(stock for stock, is_index, since in items)
+        if requests[False]:
+            self.stock_collection.bulk_write(requests[False], ordered=False)
+        if requests[True]:
+            self.indexes_collection.bulk_write(requests[True], ordered=False)
+
+    def __load_hist(self, stock, is_index, last_n=None):
+        collection = is_index and 'indexes' or 'stocks'
+        if stock.hist_data is None:
+            stock.hist_data = self.hist_store.load(collection, stock.code, last_n=last_n)
+        if last_n is not None:
+            return  # derived data of the whole history
+        for frame in self.hist_store.frames(collection, stock.code):
+            if frame != 'hist':
+                stock.set_cached_frame(frame, self.hist_store.load(collection, stock.code, frame))
 
     @staticmethod
-    def __from_dict(data, is_index):
+    def __projection(fields):
+        if fields is None:
+            return None
+        projection = {'_id': False, 'code': True}
+        for field in fields:
+            projection[field] = True
+        return projection
+
+    def __from_dict(self, data, is_index, fields=None, lazy_hist=False, last_n=None):
         stock = Index() if is_index else Stock()
         for k, v in data.items():
             if k == '_id':
                 continue
-            elif data[k] is not None and k in ('hist_data'):
-                stock.hist_data = DataFrame.from_dict(data[k], orient='index')
+            elif k == 'hist_data':
+                # legacy layout, history embedded as {date: row} documents
+                if v is not None:
+                    stock.hist_data = DataFrame.from_dict(v, orient='index')
             else:
                 stock[k] = v
+        if not is_index:
+            stock.attach_fundamentals(self.fundamentals)
+        stock._partial = fields is not None or last_n is not None
+        if lazy_hist and stock.hist_data is None:
+            def load(stock):
+                self.__load_hist(stock, is_index, last_n)
+                stock.sanitize()
+            stock.set_hist_loader(load)
+        else:
+            self.__load_hist(stock, is_index, last_n)
+            stock.sanitize()
         return stock
 
     @staticmethod
     def __to_dict(stock):
-        tmp = {}
-        for k in stock.__dict__:
-            v = stock.__getattribute__(k)
-            if v is not None and k in ('hist_data'):
-                tmp[k] = v.to_dict(orient='index')
-            else:
-                tmp[k] = v
+        if stock._partial:
+            raise ValueError('%s is partially loaded, cannot be saved' % stock)
+        tmp = {k: getattr(stock, k) for k in stock.FIELDS}
+        if isinstance(stock, Stock) and stock.fundamentals is None:
+            tmp.update(stock._values)  # not attached to any fundamentals table to be saved
         return tmp
 
-    def find_one_index(self, code):
-        dindex = self.indexes_collection.find_one({'code': code})
+    def find_one_index(self, code, fields=None, lazy_hist=False, last_n=None):
+        dindex = self.indexes_collection.find_one({'code': code}, self.__projection(fields))
         if dindex is None:
             return None
-        index = self.__from_dict(dindex, True)
-        index.sanitize()
-        return index
+        return self.__from_dict(dindex, True, fields, lazy_hist, last_n)
 
-    def find_index(self, filter=None):
+    def find_index(self, filter=None, fields=None, lazy_hist=False, last_n=None):
         ilist = []
-        cursor = self.indexes_collection.find(filter)
+        cursor = self.indexes_collection.find(filter, self.__projection(fields))
         for dindex in cursor:
-            index = self.__from_dict(dindex, True)
-            index.sanitize()
-            ilist.append(index)
+            ilist.append(self.__from_dict(dindex, True, fields, lazy_hist, last_n))
         return ilist
 
     def save_index(self, index):
+        self.__save_hist(index, True)
         idict = self.__to_dict(index)
         result = self.indexes_collection.replace_one({'code': index.code}, idict, True)
         return result
 
     def drop_index(self, code):
+        self.hist_store.drop('indexes', code)
         if code:
             result = self.indexes_collection.delete_one({'code': code})
             return result.deleted_count
@@ -121,14 +316,83 @@ class LocalDataManager(object):
             self.indexes_collection.drop()
 
 
+class BulkWriter(object):
+    """
+    save stocks from one dedicated writer thread, stocks are buffered and written by
+    LocalDataManager.write_batch every batch_size stocks, or when no new stock comes in flush_interval.
+    if ready (an Event) is given, stocks are only buffered until it is set.
+    """
+    def __init__(self, local_dm, batch_size=100, flush_interval=1.0, ready=None):
+        self.local_dm = local_dm
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.ready = ready
+        self.written = 0
+        self.failed = False
+        self._queue = Queue(maxsize=self.batch_size * 2)
+        self._thread = Thread(name='BulkWriterThread', target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save_stock(self, stock, since=None):
+        self._queue.put((stock, False, since))
+
+    def save_index(self, index, since=None):
+        self._queue.put((index, True, since))
+
+    def close(self):
+        """flush and stop the writer thread, return False if any batch failed"""
+        self._queue.put(None)
+        self._thread.join()
+        return not self.failed
+
+    def _write_loop(self):
+        batch = []
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except Empty:
+                item = ()
+            if item is None:
+                stop = True
+                if self.ready is not None:
+                    self.ready.wait()
+            elif item:
+                batch.append(item)
+            if batch and (not item or len(batch) >= self.batch_size) and \
+               (self.ready is None or self.ready.is_set()):
+                for i in range(0, len(batch), self.batch_size):
+                    self._flush(batch[i:i + self.batch_size])
+                batch = []
+
+    def _flush(self, batch):
+        try:
+            self.local_dm.write_batch(batch)
+        except Exception as e:
+            logging.error('failed to save %d stocks/indexes from %s: %s' % (len(batch), batch[0][0], str(e)))
+            self.failed = True
+        else:
+            self.written += len(batch)
+            logging.debug('saved %d stocks/indexes, %d totally' % (len(batch), self.written))
+
+
 class DataManager(object):
-    def __init__(self):
+    def __init__(self, hist_store='npy', data_dir='data', db=None):
         self.stocks = {}
         self.indexes = {}
-        self.local_dm = LocalDataManager()
+        self.panel = None
+        self.local_dm = LocalDataManager(hist_store, data_dir, db)
+        self._panel_path = os.path.join(data_dir, 'panel')
+        self.write_batch_size = 100  # stocks saved by one bulk write
 
         self._data_period_y = 3  # years
 
+    @property
+    def fundamentals(self):
+        """fundamentals table all stocks are attached to"""
+        return self.local_dm.fundamentals
+
     @property
     def data_period_y(self):
         return self._data_period_y
@@ -140,9 +404,10 @@ class DataManager(object):
             value = 1
         self._data_period_y = value
 
-    def pick_data(self, max_num_threads = 20, pause = 0):
+    def pick_data(self, max_num_threads = 20, pause = 0, fetcher=None):
         """
         pick all necessary data from local database and from internet for loaded stocks. This function will take a while.
+        history data is downloaded by threads, or by fetcher (AsyncHistFetcher) if given.
         """
         logging.info('getting basics from tushare')
         self._init_stock_objs()
@@ -151,49 +416,26 @@ class DataManager(object):
         # self.stocks = {key: self.stocks[key] for key in ['600233', '600130']}
         logging.info('totally there are %d listed companies' % len(self.stocks))
 
-        logging.info('get indexes from tushare')
-        self._get_indexes()
-
-        # self._pick_hist_data_and_save(self.stocks, False, self.indexes['000001'].hist_start_date, max_num_threads)
-
-        logging.info('getting last stock trading data')
-        df = ts.get_today_all()
-        self._extract_from_dataframe(df,
-                    ignore=('changepercent', 'open', 'high', 'low', 'settlement', 'volume', 'turnoverratio', 'amount'),
-                    remap={'trade': 'price', 'per': 'pe'})
-
-        # calculate the report quarter
-        report_year, report_quarter = ts.get_last_report_period()
-
-        logging.info('getting last report (%d quarter %d) from tushare' % (report_year, report_quarter))
-        df = ts.get_report_data(report_year, report_quarter)
-        self._extract_from_dataframe(df)
-
-        logging.info('getting last profit data from tushare')
-        df = ts.get_profit_data(report_year, report_quarter)
-        self._extract_from_dataframe(df, ignore=('net_profits', 'roe', 'eps'))
-
-        logging.info('getting last operation data from tushare')
-        df = ts.get_operation_data(report_year, report_quarter)
-        self._extract_from_dataframe(df)
-
-        logging.info('getting last growth data from tushare')
-        df = ts.get_growth_data(report_year, report_quarter)
-        self._extract_from_dataframe(df)
-
-        logging.info('getting last debtpaying data from tushare')
-        df = ts.get_debtpaying_data(report_year, report_quarter)
-        self._extract_from_dataframe(df)
-
-        logging.info('getting last cashflow data from tushare')
-        df = ts.get_cashflow_data(report_year, report_quarter)
-        self._extract_from_dataframe(df)
-
-        logging.info('getting history trading data from tushare')
-        start_from = self.indexes['000001'].hist_start_date
-        data_full = self._pick_hist_data_and_save(self.stocks, False, start_from, max_num_threads, pause)  # anything that pulling data must before here
+        # quotes and reports are downloaded and merged while indexes and history data are downloading,
+        # stocks are not saved before they are merged
+        fundamentals_ready = Event()
+        stage = ThreadPoolExecutor(max_workers=1)
+        fundamentals = stage.submit(self._pick_fundamentals, fundamentals_ready)
+        try:
+            logging.info('get indexes from tushare')
+            self._get_indexes()
+
+            logging.info('getting history trading data from tushare')
+            start_from = self.indexes['000001'].hist_start_date
+            data_full = self._pick_hist_data_and_save(self.stocks, False, start_from, max_num_threads, pause,
+                                                      fetcher, ready=fundamentals_ready)
+        finally:
+            fundamentals_ready.set()  # do not keep the writer waiting if we failed
+            stage.shutdown()
+        fundamentals.result()  # anything that pulling data must before here
 
         self._remove_unavailable_stocks()
+        self.build_panel()
 
         '''
         # calculate qianfuquan data
@@ -216,28 +458,152 @@ class DataManager(object):
         logging.info('getting stock list from tushare')
         df = ts.get_stock_basics()
         logging.info('tushare listed %d stocks' % df.index.size)
-        for index, row in df.iterrows():
-            stock = self.stocks[index] if index in self.stocks else Stock(code=index)
-            for col_name in df.columns:
-                # we only trust these data
-                if not col_name in ('name', 'industry', 'area', 'timeToMarket'):
+        for code in df.index:
+            if code not in self.stocks:
+                self.stocks[code] = Stock(code=code)
+                self.stocks[code].attach_fundamentals(self.fundamentals)
+        # we only trust these data
+        self._extract_from_dataframe(df.reset_index(), ignore=[col for col in df.columns if col not in (
+                                     'name', 'industry', 'area', 'timeToMarket')])
+
+    # quotes and last reports merged into stocks: (name, tushare function, needs report period, ignore, remap)
+    fundamental_sources = (
+        ('trading', ts.get_today_all, False,
+         ('changepercent', 'open', 'high', 'low', 'settlement', 'volume', 'turnoverratio', 'amount'),
+         {'trade': 'price', 'per': 'pe'}),
+        ('report', ts.get_report_data, True, (), {}),
+        ('profit', ts.get_profit_data, True, ('net_profits', 'roe', 'eps'), {}),
+        ('operation', ts.get_operation_data, True, (), {}),
+        ('growth', ts.get_growth_data, True, (), {}),
+        ('debtpaying', ts.get_debtpaying_data, True, (), {}),
+        ('cashflow', ts.get_cashflow_data, True, (), {}),
+    )
+
+    def _pick_fundamentals(self, ready=None):
+        """
+        download quotes and last reports all at the same time, join them on code and merge into stocks,
+        a field of a later source overrides the same field of an earlier one. ready is set when done.
+        """
+        try:
+            t_start = time.time()
+            futures = {}
+            with ThreadPoolExecutor(max_workers=len(self.fundamental_sources)) as executor:
+                for name, func, by_period, ignore, remap in self.fundamental_sources:
+                    if not by_period:
+                        futures[name] = executor.submit(func)
+                report_year, report_quarter = ts.get_last_report_period()
+                logging.info('getting last trading data and reports (%d quarter %d) from tushare' % (
+                             report_year, report_quarter))
+                for name, func, by_period, ignore, remap in self.fundamental_sources:
+                    if by_period:
+                        futures[name] = executor.submit(func, report_year, report_quarter)
+                frames = {name: future.result() for name, future in futures.items()}
+
+            cleaned = []
+            for name, func, by_period, ignore, remap in self.fundamental_sources:
+                df = frames[name]
+                if df is None or not isinstance(df, DataFrame) or 'code' not in df.columns:
+                    logging.error('cannot get %s data or wrong data -> %s!' % (name, df))
                     continue
-                if not hasattr(stock, col_name):
-                    logging.warning('Stock obj has no attribute %s, skip' % col_name)
+                cleaned.append(self._prepare_dataframe(df, ignore, remap))
+            joined, present = self._join_dataframes(cleaned)
+            self._merge_dataframe(self._normalize_dataframe(joined), present)
+            self.fundamentals.period = (report_year, report_quarter)
+            self.local_dm.save_fundamentals(self.fundamentals)
+            logging.info('got last trading data and reports of %d stocks in %.2f seconds' % (
+                         joined.index.size, time.time() - t_start))
+        finally:
+            if ready is not None:
+                ready.set()
+
+    @staticmethod
+    def _join_dataframes(frames):
+        """
+        join frames indexed by code into one, a field of a code in a later frame overrides the earlier one even
+        if it is NaN. also return a mask of the same shape telling which fields are given by any frame.
+        """
+        codes = frames[0].index.append([df.index for df in frames[1:]]).unique() if frames else []
+        joined = DataFrame(index=codes)
+        present = DataFrame(index=codes)
+        for df in frames:
+            mask = codes.isin(df.index)
+            df = df.reindex(codes)
+            for col_name in df.columns:
+                if col_name in joined.columns:
+                    joined[col_name] = df[col_name].where(mask, joined[col_name])
+                    present[col_name] |= mask
                 else:
-                    value = row[col_name]
-                    value = util.strQ2B(value).replace(' ', '') if isinstance(value, str) else value
-                    stock.__setattr__(col_name, value)
-            self.stocks[stock.code] = stock
+                    joined[col_name] = df[col_name]
+                    present[col_name] = mask
+        return joined, present
+
+    @staticmethod
+    def _prepare_dataframe(df, ignore=(), remap={}):
+        """drop ignored columns, rename columns by remap and index by code, the last row of a code wins"""
+        df = df.drop([col for col in ignore if col in df.columns], axis=1).rename(columns=remap)
+        return df.drop_duplicates('code', keep='last').set_index('code')
 
-    def load_from_db(self, remove_invalid=True):
-        """load stocks from local database only"""
+    @staticmethod
+    def _normalize_dataframe(df):
+        """
+        normalize whole columns at once: full-width characters in strings to half-width and spaces removed,
+        floats rounded to 2 decimals. values which are not strings in a string column are kept as they are.
+        """
+        df = df.round(2)
+        for col_name in df.columns[(df.dtypes == object).values]:
+            df[col_name] = util.normalize(df[col_name])
+        return df
+
+    def _merge_dataframe(self, df, present=None):
+        """
+        assign df indexed by code to stocks, only fields in mask present if given. fields in Fundamentals go
+        to the fundamentals table column by column, other fields of Stock.FIELDS are assigned stock by stock.
+        """
+        missed = df.index.difference(list(self.stocks.keys()))
+        if len(missed):
+            logging.warning('stocks %s missed?' % ', '.join(missed[:10]) + (' ...' if len(missed) > 10 else ''))
+        if not len(self.stocks):
+            return
+        columns = []
+        for col_name in df.columns:
+            if col_name in Fundamentals.TYPES or col_name in Stock.FIELDS:
+                columns.append(col_name)
+            else:
+                logging.warning('stock obj has no attribute %s, skip' % col_name)
+        known = df.index.isin(list(self.stocks.keys()))
+        stocks = [self.stocks[code] for code in df.index[known]]
+        table = self.fundamentals
+        for stock in stocks:
+            if stock.fundamentals is not table:
+                stock.attach_fundamentals(table)
+
+        fields = [col for col in columns if col in Fundamentals.TYPES]
+        table.update(df.loc[known, fields], None if present is None else present.loc[known, fields])
+
+        columns = [col for col in columns if col not in Fundamentals.TYPES]
+        if not columns:
+            return
+        rows = df.loc[known, columns].astype(object).values.tolist()
+        if present is None:
+            given = None
+        else:
+            given = present.loc[known, columns].values
+            given = None if given.all() else given.tolist()
+        for i, (stock, row) in enumerate(zip(stocks, rows)):
+            for j, (col, value) in enumerate(zip(columns, row)):
+                if given is None or given[i][j]:
+                    setattr(stock, col, value)
+
+    def load_from_db(self, remove_invalid=True, lazy_hist=False, workers=4):
+        """load stocks from local database only, hist_data of stocks is loaded on first access if lazy_hist"""
         logging.info('try to load stock data from local database')
         count = 0
         try:
-            for stock in self.local_dm.find_stock(show_process=True):
-                self.stocks[stock.code] = stock
-                count += 1
+            with tqdm(total=self.local_dm.stock_collection.count_documents({})) as pbar:
+                for stock in self.local_dm.iter_stock(lazy_hist=lazy_hist, workers=workers):
+                    self.stocks[stock.code] = stock
+                    count += 1
+                    pbar.update()
             logging.info('loaded %d stocks' % count)
 
             count = 0
@@ -252,46 +618,49 @@ class DataManager(object):
         except KeyError as e:
             logging.warning('%s, please try to drop database' % str(e))
             return
+        self.open_panel()
         if remove_invalid:
             self._remove_unavailable_stocks()
 
+    def open_panel(self):
+        """open the market panel on disk, rebuild it if it is out of date with loaded stocks"""
+        panel = MarketPanel.open(self._panel_path)
+        index = self.indexes.get('000001')
+        if panel is not None and index is not None and index.hist_data is not None and \
+           panel.last_date == index.hist_last_date and set(panel.codes) == set(self.stocks.keys()):
+            self.panel = panel
+        else:
+            self.build_panel()
+        return self.panel
+
+    def build_panel(self):
+        if '000001' not in self.indexes or self.indexes['000001'].hist_data is None:
+            logging.warning('no index 000001 loaded, cannot build market panel')
+            return None
+        logging.info('building market panel of %d stocks' % len(self.stocks))
+        self.panel = MarketPanel.build(self._panel_path, self.stocks, self.indexes['000001'])
+        logging.info('market panel %d stocks x %d days ready' % self.panel.shape)
+        return self.panel
+
     def invalid_loaded_stocks(self):
         self.stocks = {}
+        self.panel = None
 
-    def _extract_from_dataframe(self, df, ignore=(), remap={}, special_handler={}):
-        if df is None or not isinstance(df, DataFrame):
+    def _extract_from_dataframe(self, df, ignore=(), remap={}):
+        """merge df which has a code column into stocks, see _prepare_dataframe, _normalize_dataframe"""
+        if df is None or not isinstance(df, DataFrame) or 'code' not in df.columns:
             logging.error('cannot get data or wrong data -> %s!' % df)
             return
-        for index, row in df.iterrows():
-            code = row['code']
-            if not code in self.stocks:
-                logging.warning('stock %s missed?' % code)
-                continue
-            stock = self.stocks[code]
-            for col_name in df.columns:
-                if col_name == 'code' or col_name in ignore:
-                    continue
-                if col_name in special_handler:
-                    special_handler[col_name](stock, df, row[col_name])
-                    continue
-                real_field = col_name in remap and remap[col_name] or col_name
-                if not hasattr(stock, real_field):
-                    logging.warning('stock obj has no attribute %s, skip' % col_name)
-                else:
-                    old = stock.__getattribute__(real_field)
-                    new = isinstance(row[col_name], str) and util.strQ2B(row[col_name]).replace(' ', '') or row[col_name]
-                    new = isinstance(new, float) and round(new, 2) or new
-                    if old is not None and (isinstance(old, float) and not math.isnan(old)) and \
-                       new is not None and (isinstance(new, float) and not math.isnan(new)) and \
-                       old != new:
-                        #logging.debug('field %s changed: old(%s) -> new(%s), %s' % (col_name, str(old), str(new), stock))
-                        pass
-                    stock.__setattr__(real_field, new)
+        self._merge_dataframe(self._normalize_dataframe(self._prepare_dataframe(df, ignore, remap)))
 
     def _remove_unavailable_stocks(self):
         stocks_to_remove = list()
         for code, stock in self.stocks.items():
-            if stock.hist_data is None or stock.hist_data.index.size == 0:
+            if not stock.hist_loaded:
+                # lazy loaded, the panel tells if it has history without loading it
+                if self.panel is not None and code in self.panel and not self.panel.has_data(code):
+                    stocks_to_remove.append(stock)
+            elif stock.hist_data is None or stock.hist_data.index.size == 0:
                 stocks_to_remove.append(stock)
         for stock in stocks_to_remove:
             del self.stocks[stock.code]
@@ -307,7 +676,8 @@ class DataManager(object):
         start_from = datetime.date.today() - datetime.timedelta(days=365 * self._data_period_y)
         self._pick_hist_data_and_save(self.indexes, True, start_from)
 
-    def _pick_hist_data_and_save(self, stocks, is_index, start_from, max_num_threads=1, pause = 0):
+    def _pick_hist_data_and_save(self, stocks, is_index, start_from, max_num_threads=1, pause = 0, fetcher=None,
+                                 ready=None):
         threads = []
         squeue = Queue()
         update_to = StockCalendar().last_completed_trade_day()
@@ -324,25 +694,24 @@ class DataManager(object):
         if squeue.empty():
             logging.info('all are already up to date')
             return
+        writer = BulkWriter(self.local_dm, self.write_batch_size, ready=ready)
 
         def __pick_history():
-            nonlocal start_from, failed
+            nonlocal failed
 
             while not squeue.empty():
                 stock = squeue.get()
-                append = stock.hist_start_date <= start_from if stock.hist_data is not None else False
-                if append:
-                    start_from = stock.hist_last_date if append else start_from
+                append, start = self._hist_range(stock, start_from)
 
                 try:
                     logging.debug('[%d/%d] picking hist data (%s-%s) of %s' % (
                                    total_to_update - squeue.qsize(), total_to_update,
-                                start_from, update_to, stock))
+                                start, update_to, stock))
                     hist = ts.get_hist_data(stock.symbol if is_index else stock.code,
-                                            start=str(start_from), end=str(update_to), ktype='D',
+                                            start=str(start), end=str(update_to), ktype='D',
                                             retry_count=5, pause=pause)
                     if not is_index:
-                        fq_factor = ts.get_fq_factor(stock.code, start=str(start_from), end=str(update_to))  # 前复权数据
+                        fq_factor = ts.get_fq_factor(stock.code, start=str(start), end=str(update_to))  # 前复权数据
                     else:
                         fq_factor = DataFrame()
                 except IOError as e:
@@ -350,62 +719,50 @@ class DataManager(object):
                     logging.error('cannot get hist/qfq data of %s' % stock)
                     failed = True
                 else:
-                    if hist is None:
-                            logging.warning('%s has no history data%s' % (
-                                    stock, append and ' to append' or ''))
-                    elif fq_factor is None:
-                        logging.warning('%s has no fq data%s' % (
-                                stock, append and ' to append' or ''))
-                    else:
-                        if append:
-                            stock.hist_data = stock.hist_data.append(hist.join(fq_factor))
-                        else:
-                            stock.hist_data = hist.join(fq_factor)
-
-                        if not is_index:
-                            # WA: missing factor at some dates
-                            factor_nan_date = stock.hist_data[stock.hist_data.factor.isnull()].index
-                            for date in factor_nan_date:
-                                i = stock.hist_data.index.get_loc(date)
-
-                                if i == 0 and stock.hist_len > 1 and not math.isnan(stock.hist_data.factor[i + 1]):
-                                    stock.hist_data.factor[i] = stock.hist_data.factor[i + 1]
-                                    logging.debug('%s: fixed missing factor at %s' % (stock, str(date)))
-                                elif not math.isnan(stock.hist_data.factor[i - 1]):
-                                    stock.hist_data.factor[i] = stock.hist_data.factor[i - 1]
-                                    logging.debug('%s: fixed missing factor at %s' % (stock, str(date)))
-                                else:
-                                    logging.warning('%s: cannot fix missing factor at %s' % (stock, str(date)))
-
-                        stock.sanitize()
-                        logging.debug('%s: %d days trading data%s' % (
-                                stock, stock.hist_data.index.size,
-                                append and ', appended %d days'%hist.index.size or ''))
-                        stock.last_update = datetime.datetime.now()
-                        if is_index:
-                            self.local_dm.save_index(stock)
-                        else:
-                            self.local_dm.save_stock(stock)
+                    self._merge_hist_and_save(stock, is_index, append, hist, fq_factor, writer)
                 squeue.task_done()
 
-        num_threads = min(max_num_threads, int(squeue.qsize() / 2))
-        logging.info('getting history data of %d stocks/indexes using %d threads' % (squeue.qsize(), num_threads))
-        for i in range(0, num_threads):
-                thread = Thread(name = "PickingThread%d" % i, target=__pick_history)
-                thread.daemon = True
-                threads.append(thread)
-        for t in threads:
-            t.start()
-        '''
-        for t in threads:
-            t.join(timeout=None) # no need to block, because thread should complete at last
-            if t.is_alive():
-                logger.warning("Thread %s timeout" %t.name)
-        '''
         t_start = datetime.datetime.now()
-        #while squeue.unfinished_tasks:
-        #    time.sleep(1)
-        squeue.join()
+        if fetcher is not None:
+            done = 0
+            done_lock = Lock()
+
+            def __on_fetched(stock, hist, fq_factor, error):
+                nonlocal failed, done
+                with done_lock:  # called from worker threads of fetcher
+                    done += 1
+                    count = done
+                if error is not None:
+                    logging.error('exception: %s', str(error))
+                    logging.error('cannot get hist/qfq data of %s' % stock)
+                    failed = True
+                else:
+                    logging.debug('[%d/%d] picked hist data of %s' % (count, total_to_update, stock))
+                    self._merge_hist_and_save(stock, is_index, self._hist_range(stock, start_from)[0], hist, fq_factor,
+                                              writer)
+
+            jobs = []
+            while not squeue.empty():
+                stock = squeue.get()
+                jobs.append((stock, is_index, str(self._hist_range(stock, start_from)[1]), str(update_to)))
+            logging.info('getting history data of %d stocks/indexes using asyncio, %d requests in flight' % (
+                         len(jobs), fetcher.concurrency))
+            if fetcher.fetch(jobs, __on_fetched):
+                failed = True
+        else:
+            num_threads = max(min(max_num_threads, int(squeue.qsize() / 2)), 1)
+            logging.info('getting history data of %d stocks/indexes using %d threads' % (squeue.qsize(), num_threads))
+            for i in range(0, num_threads):
+                    thread = Thread(name = "PickingThread%d" % i, target=__pick_history)
+                    thread.daemon = True
+                    threads.append(thread)
+            for t in threads:
+                t.start()
+            #while squeue.unfinished_tasks:
+            #    time.sleep(1)
+            squeue.join()
+        if not writer.close():
+            failed = True
         t_delta = datetime.datetime.now() - t_start
         if (failed):
             logging.warning('failed to pick some stocks')
@@ -413,11 +770,83 @@ class DataManager(object):
             logging.info('done getting history data by %d seconds' % (t_delta.days*24*3600 + t_delta.seconds))
         return not failed
 
-    def find_one_stock_from_db(self, code):
-        return self.local_dm.find_one_stock(code)
+    @staticmethod
+    def _hist_range(stock, start_from):
+        """return (append, start), only pick days after local data if local data is long enough"""
+        append = stock.hist_start_date <= start_from if stock.hist_data is not None else False
+        return append, stock.hist_last_date if append else start_from
+
+    @staticmethod
+    def _appended_since(old, new):
+        """last day of old if new is old with some days appended, otherwise None"""
+        if old is None or not old.index.size or list(old.columns) != list(new.columns):
+            return None
+        since = old.index.max()
+        kept = new[new.index <= since]
+        if not kept.index.equals(old.index) or not np.array_equal(kept.values, old.values, equal_nan=True):
+            return None
+        return since
+
+    def _merge_hist_and_save(self, stock, is_index, append, hist, fq_factor, writer=None):
+        if hist is None:
+            logging.warning('%s has no history data%s' % (
+                    stock, append and ' to append' or ''))
+        elif fq_factor is None:
+            logging.warning('%s has no fq data%s' % (
+                    stock, append and ' to append' or ''))
+        else:
+            old_hist = stock.hist_data
+            hist = StockBase.canonical(hist.join(fq_factor))
+            if append:
+                # the last local day is picked again
+                old = stock.hist_data[~stock.hist_data.index.isin(hist.index)]
+                stock.hist_data = concat([old, hist])
+            else:
+                stock.hist_data = hist
+            stock.sanitize()
+
+            if not is_index:
+                # WA: missing factor at some dates, take the one of the day before the latest day, or the day
+                # after, fixed from the latest day backwards
+                factor = stock.hist_data.factor.values.copy()
+                missing = np.flatnonzero(np.isnan(factor))
+                for i in missing[::-1]:
+                    date = stock.hist_data.index[i]
+                    near = i - 1 if i == factor.size - 1 and factor.size > 1 else (i + 1) % factor.size
+                    if not math.isnan(factor[near]):
+                        factor[i] = factor[near]
+                        logging.debug('%s: fixed missing factor at %s' % (stock, str(date.date())))
+                    else:
+                        logging.warning('%s: cannot fix missing factor at %s' % (stock, str(date.date())))
+                if missing.size:
+                    stock.hist_data['factor'] = factor
+
+            if append:
+                # days from the first picked one replaced local days, cached rows of them are stale
+                stock.update_cache(hist.index[0])
+            else:
+                stock.invalidate_cache()
+            stock.calc_saved_indicators()
+            logging.debug('%s: %d days trading data%s' % (
+                    stock, stock.hist_data.index.size,
+                    append and ', appended %d days'%hist.index.size or ''))
+            stock.last_update = datetime.datetime.now()
+            if writer is not None:
+                since = self._appended_since(old_hist, stock.hist_data) if append else None
+                if is_index:
+                    writer.save_index(stock, since)
+                else:
+                    writer.save_stock(stock, since)
+            elif is_index:
+                self.local_dm.save_index(stock)
+            else:
+                self.local_dm.save_stock(stock)
+
+    def find_one_stock_from_db(self, code, fields=None, lazy_hist=False, last_n=None):
+        return self.local_dm.find_one_stock(code, fields, lazy_hist, last_n)
 
-    def find_one_index_from_db(self, code):
-        return self.local_dm.find_one_index(code)
+    def find_one_index_from_db(self, code, fields=None, lazy_hist=False, last_n=None):
+        return self.local_dm.find_one_index(code, fields, lazy_hist, last_n)
 
     def drop_local_data(self, code):
         self.local_dm.drop_index(code)
@@ -0,0 +1,130 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import time
+import asyncio
+import logging
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from pandas import DataFrame
+from tushare.stock import trading
+from tushare.stock import cons as ct
+
+
+class _RateLimiter(object):
+    """at most 'rate' requests per second to one host"""
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self._interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AsyncHistFetcher(object):
+    """
+    download hist data and fq factor of many stocks with asyncio. All requests share one pool of
+    keep-alive connections, the hist request and all quarter pages of fq factor of a stock are sent
+    at the same time, and requests to one host can be rate limited. Requests go through the server set
+    by tushare.set_server() like all other tushare requests.
+    a stock takes about 13 requests (hist data and a page of fq factor per quarter), so a rate limit
+    bounds a download to rate / 13 stocks a second. By default only concurrency limits it, 20 requests
+    in flight put the same load on hosts as 20 downloading threads do.
+    """
+    def __init__(self, concurrency=20, rate=0, retry_count=5, pause=0.1, timeout=10, workers=4):
+        self.concurrency = concurrency  # max requests in flight
+        self.rate = rate  # max requests per second per host, 0 means no limit
+        self.retry_count = retry_count
+        self.pause = pause
+        self.timeout = timeout
+        self.workers = workers  # threads to parse and save downloaded data
+        self._limiters = {}
+
+    def fetch(self, jobs, callback):
+        """
+        jobs: list of (stock, is_index, start, end)
+        callback(stock, hist, fq_factor, error) is called from worker threads when a stock is done,
+        so parsing and saving never block downloading.
+        return stocks failed in callback, they are logged and do not stop other stocks.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(self._fetch_all(jobs, callback))
+        finally:
+            loop.close()
+        failed = []
+        for (stock, is_index, start, end), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                logging.error('%s: failed to fetch history data: %s' % (stock, str(result)))
+                failed.append(stock)
+            elif not result:
+                failed.append(stock)
+        return failed
+
+    async def _fetch_all(self, jobs, callback):
+        self._limiters = {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                return await asyncio.gather(*[self._fetch_one(session, semaphore, executor, callback, *job)
+                                              for job in jobs], return_exceptions=True)
+
+    async def _get(self, session, semaphore, url):
+        limiter = self._limiters.setdefault(urlparse(url).netloc, _RateLimiter(self.rate))
+        for _ in range(self.retry_count):
+            async with semaphore:
+                await limiter.wait()
+                try:
+                    async with session.get(url, proxy=ct.SERVER) as response:
+                        response.raise_for_status()
+                        return await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.debug('%s: %s, retry' % (url, str(e) or type(e).__name__))
+            await asyncio.sleep(self.pause)
+        raise IOError(ct.NETWORK_URL_ERROR_MSG + ': ' + url)
+
+    async def _fetch_one(self, session, semaphore, executor, callback, stock, is_index, start, end):
+        code = stock.symbol if is_index else stock.code
+        requests = [self._get(session, semaphore, trading._hist_data_url(code))]
+        if not is_index:
+            requests += [self._get(session, semaphore, url) for url in trading._fq_factor_urls(code, start, end)]
+        try:
+            pages = await asyncio.gather(*requests)
+        except IOError as e:
+            pages, error = None, e
+        else:
+            error = None
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, self._parse, callback, stock, is_index, code, start, end, pages, error)
+
+    @staticmethod
+    def _parse(callback, stock, is_index, code, start, end, pages, error):
+        """return False if callback failed"""
+        hist = fq_factor = None
+        if error is None:
+            try:
+                hist = trading._parse_hist_data(pages[0], code, start=start, end=end)
+                if is_index:
+                    fq_factor = DataFrame()
+                else:
+                    fq_factor = trading._merge_fq_factor([trading._parse_fq_text(p, False) for p in pages[1:]],
+                                                         start, end)
+            except Exception as e:
+                error = e
+        try:
+            callback(stock, hist, fq_factor, error)
+        except Exception as e:
+            logging.error('%s: failed to handle downloaded history data: %s' % (stock, str(e)))
+            return False
+        return True
@@ -0,0 +1,195 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import datetime
+from threading import RLock
+import numpy as np
+import pandas as pd
+from bson.binary import Binary
+
+
+class Fundamentals(object):
+    """
+    fundamentals of all stocks as one table indexed by code, every field is a typed column. Stock objects
+    attached to the table read and write these fields through it, screens read whole columns of it.
+    missing numbers are NaN (timeToMarket 0), missing strings None. Saved as one document per report period,
+    modified is set when the table is changed after its document was taken.
+    """
+    FIELDS = (
+        ('industry', 'O'),  # 所属行业
+        ('area', 'O'),  # 地区
+        ('price', 'f8'),  # 最新价
+        ('pe', 'f8'),  # 市盈率
+        ('outstanding', 'f8'),  # 流通股本
+        ('nmc', 'f8'),  # 流通市值(万元)
+        ('totals', 'f8'),  # 总股本(万)
+        ('mktcap', 'f8'),  # 总市值(万元)
+        ('totalAssets', 'f8'),  # 总资产(万)
+        ('liquidAssets', 'f8'),  # 流动资产
+        ('fixedAssets', 'f8'),  # 固定资产
+        ('reserved', 'f8'),  # 公积金
+        ('reservedPerShare', 'f8'),  # 每股公积金
+        ('eps', 'f8'),  # 每股收益
+        ('eps_yoy', 'f8'),  # 每股收益同比( %)
+        ('bvps', 'f8'),  # 每股净资
+        ('pb', 'f8'),  # 市净率
+        ('timeToMarket', 'i8'),  # 上市日期
+        ('roe', 'f8'),  # 净资产收益率( %)
+        ('epcf', 'f8'),  # 每股现金流量(元)
+        ('net_profits', 'f8'),  # 净利润(万元)
+        ('profits_yoy', 'f8'),  # 净利润同比( %)
+        ('net_profit_ratio', 'f8'),  # 净利率( %)
+        ('gross_profit_rate', 'f8'),  # 毛利率( %)
+        ('business_income', 'f8'),  # 营业收入(百万元)
+        ('bips', 'f8'),  # 每股主营业务收入(元)
+        ('distrib', 'O'),  # 分配方案
+        ('report_date', 'O'),  # 发布日期
+        ('arturnover', 'f8'),  # 应收账款周转率(次)
+        ('arturndays', 'f8'),  # 应收账款周转天数(天)
+        ('inventory_turnover', 'f8'),  # 存货周转率(次)
+        ('inventory_days', 'f8'),  # 存货周转天数(天)
+        ('currentasset_turnover', 'f8'),  # 流动资产周转率(次)
+        ('currentasset_days', 'f8'),  # 流动资产周转天数(天)
+        ('mbrg', 'f8'),  # 主营业务收入增长率( %)
+        ('nprg', 'f8'),  # 净利润增长率( %)
+        ('nav', 'f8'),  # 净资产增长率
+        ('targ', 'f8'),  # 总资产增长率
+        ('epsg', 'f8'),  # 每股收益增长率
+        ('seg', 'f8'),  # 股东权益增长率
+        ('currentratio', 'f8'),  # 流动比率
+        ('quickratio', 'f8'),  # 速动比率
+        ('cashratio', 'f8'),  # 现金比率
+        ('icratio', 'f8'),  # 利息支付倍数
+        ('sheqratio', 'f8'),  # 股东权益比率
+        ('adratio', 'f8'),  # 股东权益增长率
+        ('cf_sales', 'f8'),  # 经营现金净流量对销售收入比率
+        ('rateofreturn', 'f8'),  # 资产的经营现金流量回报率
+        ('cf_nm', 'f8'),  # 经营现金净流量与净利润的比率
+        ('cf_liabilities', 'f8'),  # 经营现金净流量对负债比率
+        ('cashflowratio', 'f8'),  # 现金流量比率
+    )
+    TYPES = dict(FIELDS)
+    DEFAULTS = {'O': None, 'f8': float('NaN'), 'i8': 0}
+
+    def __init__(self, period=None):
+        self.period = period  # (year, quarter) of the reports
+        self._lock = RLock()
+        self._codes = []
+        self._rows = {}
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in self.FIELDS}
+        self.modified = False
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __contains__(self, code):
+        return code in self._rows
+
+    @property
+    def codes(self):
+        return list(self._codes)
+
+    @classmethod
+    def default(cls, field):
+        return cls.DEFAULTS[cls.TYPES[field]]
+
+    def get(self, code, field):
+        row = self._rows.get(code)
+        if row is None:
+            return self.DEFAULTS[self.TYPES[field]]
+        return self._columns[field].item(row)
+
+    def set(self, code, field, value):
+        with self._lock:
+            rows = self._add([code])
+            self._columns[field][rows[0]] = self._coerce(field, [value])[0]
+            self.modified = True
+
+    def values(self, field, codes=None):
+        """column of field as an array aligned with codes, all codes if not given"""
+        if codes is None:
+            return self._columns[field][:len(self._codes)].copy()
+        rows = np.array([self._rows.get(code, -1) for code in codes], dtype=np.int64)
+        values = np.full(rows.size, self.default(field), dtype=self.TYPES[field])
+        found = rows >= 0
+        values[found] = self._columns[field][rows[found]]
+        return values
+
+    def update(self, df, present=None):
+        """
+        assign columns of df indexed by code to the table column by column, new codes are added.
+        only fields in the boolean mask present of the same shape are assigned if given.
+        """
+        with self._lock:
+            rows = self._add(df.index)
+            for field in df.columns:
+                values = self._coerce(field, df[field].values)
+                if present is None:
+                    self._columns[field][rows] = values
+                else:
+                    mask = present[field].values.astype(bool)
+                    self._columns[field][rows[mask]] = values[mask]
+            self.modified = True
+
+    def to_frame(self):
+        n = len(self._codes)
+        return pd.DataFrame({name: self._columns[name][:n] for name, _ in self.FIELDS},
+                            index=pd.Index(self._codes, name='code'))
+
+    def _coerce(self, field, values):
+        dtype = self.TYPES[field]
+        if dtype == 'O':
+            return np.array(values, dtype=object)
+        values = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce')
+        if dtype == 'i8':
+            values = values.fillna(0)
+        return values.values.astype(dtype)
+
+    def _add(self, codes):
+        """rows of codes, codes not in the table yet are added"""
+        new = [code for code in dict.fromkeys(codes) if code not in self._rows]
+        if new:
+            size = len(self._codes) + len(new)
+            capacity = self._columns[self.FIELDS[0][0]].size
+            if size > capacity:
+                capacity = max(size, capacity * 2, 64)
+                for name, dtype in self.FIELDS:
+                    column = np.empty(capacity, dtype=dtype)
+                    column[:len(self._codes)] = self._columns[name][:len(self._codes)]
+                    column[len(self._codes):] = self.DEFAULTS[dtype]
+                    self._columns[name] = column
+            for code in new:
+                self._rows[code] = len(self._codes)
+                self._codes.append(code)
+        return np.array([self._rows[code] for code in codes], dtype=np.int64)
+
+    def attach(self, stocks):
+        """make stocks read and write their fields through this table"""
+        for stock in stocks:
+            stock.attach_fundamentals(self)
+
+    def to_document(self):
+        """mongodb document, numbers as array blobs. the table is not modified since then"""
+        with self._lock:
+            n = len(self._codes)
+            columns = {}
+            for name, dtype in self.FIELDS:
+                column = self._columns[name][:n]
+                columns[name] = column.tolist() if dtype == 'O' else Binary(np.ascontiguousarray(column).tobytes())
+            self.modified = False
+        return {'period': '%d-%d' % self.period if self.period else None, 'updated': datetime.datetime.now(),
+                'codes': list(self._codes), 'columns': columns}
+
+    @classmethod
+    def from_document(cls, doc):
+        period = tuple(int(v) for v in doc['period'].split('-')) if doc.get('period') else None
+        table = cls(period)
+        codes = doc['codes']
+        rows = table._add(codes)
+        for name, dtype in cls.FIELDS:
+            column = doc['columns'].get(name)
+            if column is None:
+                continue
+            values = np.array(column, dtype=object) if dtype == 'O' else np.frombuffer(column, dtype=dtype)
+            table._columns[name][rows] = values
+        return table
@@ -48,9 +48,9 @@ class StockMonitor(object):
     def _get_stock_names(self):
         logging.info('getting stock basics from tushare')
         df = ts.get_stock_basics()
-        for index, row in df.iterrows():
-            if index in self.stocks:
-                self.stocks[index].name = util.strQ2B(row['name']).replace(' ', '')
+        names = util.normalize(df['name'])
+        for code in names.index.intersection(list(self.stocks.keys())):
+            self.stocks[code].name = names[code]
 
 
     def _monitor_func(self):
@@ -0,0 +1,115 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import json
+import shutil
+import logging
+import numpy as np
+
+
+class MarketPanel(object):
+    """
+    whole market history packed as 2-D (stock x trading day) float32 arrays. All stocks share one
+    trading day axis taken from index 000001, days a stock has no data (suspended, not IPO yet) are NaN.
+    Every field is a memory-mapped file, so the panel opens in milliseconds and can be shared between
+    processes without copying.
+    """
+    FIELDS = ('open', 'close', 'high', 'low', 'volume', 'turnover', 'p_change', 'factor', 'ma5', 'ma10', 'ma20')
+
+    def __init__(self, path, codes, dates, arrays):
+        self.path = path
+        self.codes = codes
+        self.dates = dates
+        self._arrays = arrays
+        self._rows = {code: i for i, code in enumerate(codes)}
+
+    def __getitem__(self, field):
+        return self._arrays[field]
+
+    def __contains__(self, code):
+        return code in self._rows
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def shape(self):
+        return len(self.codes), self.dates.size
+
+    @property
+    def last_date(self):
+        return self.dates[-1] if self.dates.size else None
+
+    def row(self, code):
+        return self._rows[code]
+
+    def series(self, code, field):
+        return self._arrays[field][self._rows[code]]
+
+    def has_data(self, code):
+        """if code has any trading day in the panel"""
+        return not np.isnan(self.series(code, 'close')).all()
+
+    @staticmethod
+    def _field_file(path, field):
+        return os.path.join(path, '%s.f32' % field)
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        meta_file = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_file):
+            return None
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if tuple(meta['fields']) != cls.FIELDS:
+            logging.debug('market panel %s has fields %s, need to be rebuilt' % (path, meta['fields']))
+            return None
+        dates = np.array(meta['dates'], dtype='datetime64[D]')
+        shape = (len(meta['codes']), dates.size)
+        arrays = {}
+        for field in meta['fields']:
+            arrays[field] = np.memmap(cls._field_file(path, field), dtype=np.float32, mode=mode, shape=shape)
+        return cls(path, meta['codes'], dates, arrays)
+
+    @classmethod
+    def build(cls, path, stocks, index):
+        """pack hist_data of all stocks onto the trading days of index"""
+        dates = index.hist_data.index.values.astype('datetime64[D]')  # ascending, see StockBase
+        codes = sorted(stocks.keys())
+        shape = (len(codes), dates.size)
+
+        tmp_path, old_path = path + '.tmp', path + '.old'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        arrays = {}
+        for field in cls.FIELDS:
+            arrays[field] = np.memmap(cls._field_file(tmp_path, field), dtype=np.float32, mode='w+', shape=shape)
+            arrays[field][:] = np.nan
+
+        for i, code in enumerate(codes):
+            hist_data = stocks[code].hist_data
+            if hist_data is None or hist_data.index.size == 0:
+                continue
+            stock_dates = hist_data.index.values.astype('datetime64[D]')
+            loc = dates.searchsorted(stock_dates)
+            valid = (loc < dates.size)
+            valid[valid] = dates[loc[valid]] == stock_dates[valid]
+            if not valid.all():
+                logging.debug('%s: %d days not in index calendar' % (stocks[code], (~valid).sum()))
+            for field in cls.FIELDS:
+                if field in hist_data.columns:
+                    arrays[field][i, loc[valid]] = hist_data[field].values[valid]
+
+        for field in cls.FIELDS:
+            arrays[field].flush()
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'codes': codes, 'dates': [str(d) for d in dates], 'fields': cls.FIELDS}, f)
+        del arrays
+
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return cls.open(path)
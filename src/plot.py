@@ -2,32 +2,175 @@
 __author__ = 'Du, Changbin <changbin.du@gmail.com>'
 
 from  pylab import mpl
+import os
+import json
+import time
+import shutil
+import hashlib
 import logging
+import numpy as np
 from matplotlib.font_manager import FontProperties
 from matplotlib import pyplot as plt
-from matplotlib.dates import DateFormatter, DayLocator
 from matplotlib import gridspec
-from matplotlib.dates import num2date, IndexDateFormatter
-from matplotlib.ticker import  IndexLocator, FuncFormatter
-from matplotlib.finance import candlestick2_ochl, volume_overlay
-import matplotlib.ticker as mticker
-import matplotlib.dates as mdates
-from pandas import DataFrame
+from matplotlib.ticker import FuncFormatter
+from matplotlib.colors import to_rgba
+from matplotlib.collections import LineCollection, PolyCollection
 
 # mpl.rcParams['font.sans-serif'] = ['FangSong']
 mpl.rcParams['axes.unicode_minus'] = False
 
+def _bars(lefts, rights, bottoms, tops):
+    """vertices of rectangles for a PolyCollection"""
+    return np.stack([np.stack([lefts, bottoms], -1), np.stack([lefts, tops], -1),
+                     np.stack([rights, tops], -1), np.stack([rights, bottoms], -1)], 1)
+
+
+def candlestick(ax, opens, highs, lows, closes, width=4, colorup='k', colordown='r', alpha=0.75):
+    """
+    candles of day i at x=i, drawn as one LineCollection of high-low ranges and one PolyCollection of
+    open-close bars, like candlestick2_ochl of the removed matplotlib.finance
+    """
+    opens, highs, lows, closes = (np.asarray(v, dtype=float) for v in (opens, highs, lows, closes))
+    x = np.arange(opens.size, dtype=float)
+    delta = width / 2.
+    colors = np.where((opens < closes)[:, None], to_rgba(colorup, alpha), to_rgba(colordown, alpha))
+
+    ranges = LineCollection(np.stack([np.stack([x, lows], -1), np.stack([x, highs], -1)], 1),
+                            colors=colors, linewidths=0.5, antialiaseds=(0,))
+    bars = PolyCollection(_bars(x - delta, x + delta, opens, closes),
+                          facecolors=colors, edgecolors=((0, 0, 0, 1),), antialiaseds=(0,), linewidths=0.5)
+    ax.update_datalim([(0, np.nanmin(lows)), (x.size, np.nanmax(highs))])
+    ax.autoscale_view()
+    ax.add_collection(ranges)
+    ax.add_collection(bars)
+    return ranges, bars
+
+
+def volume_bars(ax, opens, closes, volumes, width=4, colorup='k', colordown='r', alpha=1.0):
+    """volume bars of day i at x=i as one PolyCollection, like volume_overlay of the removed matplotlib.finance"""
+    opens, closes, volumes = (np.asarray(v, dtype=float) for v in (opens, closes, volumes))
+    x = np.arange(volumes.size, dtype=float)
+    delta = width / 2.
+    colors = np.where((opens < closes)[:, None], to_rgba(colorup, alpha), to_rgba(colordown, alpha))
+
+    bars = PolyCollection(_bars(x - delta, x + delta, np.zeros_like(volumes), volumes),
+                          facecolors=colors, edgecolors=((0, 0, 0, 1),), antialiaseds=(0,), linewidths=0.5)
+    ax.update_datalim([(0, 0), (x.size, np.nanmax(volumes))])
+    ax.autoscale_view()
+    ax.add_collection(bars)
+    return bars
+
+
+def _js_deltas(values, decimals=0):
+    """
+    values rounded to decimals as integer differences to the previous value for a javascript array, missing
+    values are None. js/chart.js sums them up again, it is a few characters a value for prices and dates.
+    """
+    values = np.asarray(values, dtype=float) * 10 ** decimals
+    present = np.isfinite(values)
+    deltas = np.full(values.size, None, dtype=object)
+    deltas[present] = np.diff(np.round(values[present]).astype(np.int64), prepend=0).tolist()
+    return deltas.tolist()
+
+
 class StockPlot(object):
     """ref: https://gist.github.com/ithurricane/240b4aa954e09915b24697ca5f2aa1db"""
+    VERSION = 2  # bump when plots are drawn differently, so cached plots of older versions are not used
+    # series drawn by js/chart.js and their decimals
+    CHART_SERIES = (('open', 2), ('high', 2), ('low', 2), ('close', 2), ('volume', 0), ('turnover', 2),
+                    ('ma5', 2), ('ma10', 2), ('ma20', 2), ('ma30', 2), ('v_ma5', 0), ('v_ma10', 0), ('v_ma20', 0))
+
     def __init__(self):
         self.display_size = (5, 5)
         self.save_size = (40, 20)
 
-    def __plot(self, stock, figsize, qfq, index, index_overlay=False):
+    @staticmethod
+    def use_backend(backend):
+        """switch matplotlib backend, e.g. 'Agg' in processes which only save figures to files"""
+        plt.switch_backend(backend)
+
+    @staticmethod
+    def data_of(stock, index, qfq=False, index_overlay=False):
+        """
+        what a plot of stock needs as plain arrays and numbers, it is all sent to a plotting process
+        instead of the stock object. dates are datetime64 in ascending order.
+        """
         stock_data = stock.qfq_data if qfq else stock.hist_data
-        stock_data = stock_data.sort_index(ascending=True, inplace=False)
-        index_data = index.hist_data.sort_index(ascending=True)
+        index_data = index.hist_data
+        data = {'stock': str(stock), 'code': stock.code, 'qfq': qfq, 'index_name': index.name,
+                'title': '%s-%s,%s,%s' % (stock.code, stock.name, stock.area, stock.industry),
+                'pe': stock.pe, 'nmc': stock.nmc, 'mktcap': stock.mktcap,
+                'dates': stock_data.index.values.astype('datetime64[D]'),
+                'index_dates': index_data.index.values.astype('datetime64[D]')}
+        columns = ['open', 'high', 'low', 'close', 'volume', 'turnover', 'factor']
+        if not qfq:
+            columns += ['ma5', 'ma10', 'ma20', 'v_ma5', 'v_ma10', 'v_ma20']
+            data['ma30'] = stock.ma30.close.values
+        for column in columns:
+            data[column] = stock_data[column].values
+        if index_overlay:
+            common_data = index_data[index_data.index.isin(stock_data.index)]
+            for column in ('open', 'high', 'low', 'close'):
+                data['index_' + column] = common_data[column].values
+        return data
+
+    def key_of(self, data):
+        """hash of data_of() a saved plot is drawn from, it changes whenever the plot would be different"""
+        sha1 = hashlib.sha1(repr((self.VERSION, self.save_size)).encode('utf-8'))
+        for name in sorted(data):
+            value = data[name]
+            if isinstance(value, np.ndarray) and value.dtype.kind != 'O':
+                sha1.update(('%s:%s%s' % (name, value.dtype.str, value.shape)).encode('utf-8'))
+                sha1.update(np.ascontiguousarray(value).tobytes())
+            else:
+                sha1.update(('%s=%r' % (name, list(value) if isinstance(value, np.ndarray) else value)).encode('utf-8'))
+        return sha1.hexdigest()
+
+    @staticmethod
+    def events_of(data):
+        """
+        (days factor changed, [(day, trading days suspended until next day)], if a date is not in index) of
+        data, suspensions are found by locations of trading days in index calendar
+        """
+        factor = data['factor'].round(2)
+        changes = np.flatnonzero(factor[1:] != factor[:-1]) + 1
+
+        dates, index_dates = data['dates'], data['index_dates']
+        index_locs = np.searchsorted(index_dates, dates).clip(0, index_dates.size - 1)
+        found = index_dates[index_locs] == dates
+        pairs = dates.size - 1  # days checked with their next day
         data_err_found = False
+        if pairs > 0 and not found.all():
+            pairs = max(np.argmin(found) - 1, 0)
+            logging.warning('%s: data date %s or %s is not in index %s, probably additional wrong data'
+                            % (data['stock'], dates[pairs], dates[pairs+1], data['index_name']))
+            data_err_found = True
+        gaps = np.diff(index_locs[:pairs + 1])
+        suspends = [(i, gaps[i]) for i in np.flatnonzero(gaps > 1)]
+        return changes, suspends, data_err_found
+
+    @classmethod
+    def save_chart(cls, data, path):
+        """
+        save what data_of() returns as a javascript file for js/chart.js to draw the plot in browser. It calls
+        rufengChart.loaded() when loaded by a script tag, which also works for reports opened from local files.
+        """
+        changes, suspends, data_err_found = cls.events_of(data)
+        dates = data['dates']
+        chart = {'code': data['code'], 'title': data['title'], 'qfq': data['qfq'], 'index_name': data['index_name'],
+                 'pe': data['pe'], 'nmc': data['nmc'], 'mktcap': data['mktcap'], 'start': str(dates[0]),
+                 'factors': [[int(i), round(float(data['factor'][i]), 3)] for i in changes],
+                 'suspends': [[int(i), int(days)] for i, days in suspends], 'error': data_err_found,
+                 'decimals': {name: decimals for name, decimals in cls.CHART_SERIES if name in data}}
+        chart['days'] = _js_deltas((dates - dates[0]).astype(np.int64))
+        for name, decimals in chart['decimals'].items():
+            chart[name] = _js_deltas(data[name], decimals)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('rufengChart.loaded(%s);\n' % json.dumps(chart, ensure_ascii=False, separators=(',', ':')))
+
+    def __plot(self, data, figsize):
+        qfq = data['qfq']
+        dates = np.datetime_as_string(data['dates'])
 
         fp = FontProperties(fname='simsun.ttc')
         fig = plt.figure(figsize=figsize, dpi=100)
@@ -36,68 +179,52 @@ class StockPlot(object):
 
         # draw hist price diagram
         ax_price = plt.subplot(gs[0])
-        candlestick2_ochl(ax_price, stock_data.open, stock_data.high, stock_data.low, stock_data.close,
-                          width=.75, colorup='g', colordown='r', alpha=0.75)
-
-        for i, factor in enumerate(stock_data.factor):
-            if i != 0 and round(factor, 2) != round(stock_data.factor[i-1], 2):
-                ax_price.annotate('Q(f=%.3f)' % factor,
-                    xy=(i, stock_data.open[i]), xycoords='data',
-                    xytext=(0, stock_data.high.max()/10), textcoords='offset points', ha='center', va='bottom',
-                    bbox=dict(boxstyle='round,pad=0.2', fc='blue', alpha=0.3),
-                    arrowprops=dict(arrowstyle="->", connectionstyle="arc3,rad=.2"),
-                    fontsize=10, color='c')
-
-        for i, date in enumerate(stock_data.index):
-            if i == stock_data.index.size -1:
-                break
-
-            next_date = stock_data.index[i + 1]
-            if date not in index_data.index or next_date not in index_data.index:
-                logging.warning('%s: data date %s or %s is not in index %s, probably additional wrong data'
-                                % (stock, date, next_date, index.name))
-                data_err_found = True
-                break
-
-            index_loc = index_data.index.get_loc(date)
-            if index_data.index[index_loc+1] != stock_data.index[i+1]:
-                suspended_days = index_data.index.get_loc(next_date) - index_loc
-                ax_price.annotate('suspend %ddays [%s - %s]' % (suspended_days, date, stock_data.index[i+1]),
-                                  xy=(i, stock_data.open[i]), xycoords='data',
-                                  xytext=(0, stock_data.high.max()/10), textcoords='offset points', ha='center', va='bottom',
-                                  bbox=dict(boxstyle='round,pad=0.2', fc='yellow', alpha=0.3),
-                                  arrowprops=dict(arrowstyle="->", connectionstyle="arc3,rad=.2"),
-                                  fontsize=10, color='y')
+        candlestick(ax_price, data['open'], data['high'], data['low'], data['close'],
+                    width=.75, colorup='g', colordown='r', alpha=0.75)
+
+        changes, suspends, data_err_found = self.events_of(data)
+        for i in changes:
+            ax_price.annotate('Q(f=%.3f)' % data['factor'][i],
+                xy=(i, data['open'][i]), xycoords='data',
+                xytext=(0, data['high'].max()/10), textcoords='offset points', ha='center', va='bottom',
+                bbox=dict(boxstyle='round,pad=0.2', fc='blue', alpha=0.3),
+                arrowprops=dict(arrowstyle="->", connectionstyle="arc3,rad=.2"),
+                fontsize=10, color='c')
+
+        for i, suspended_days in suspends:
+            ax_price.annotate('suspend %ddays [%s - %s]' % (suspended_days, dates[i], dates[i+1]),
+                              xy=(i, data['open'][i]), xycoords='data',
+                              xytext=(0, data['high'].max()/10), textcoords='offset points', ha='center', va='bottom',
+                              bbox=dict(boxstyle='round,pad=0.2', fc='yellow', alpha=0.3),
+                              arrowprops=dict(arrowstyle="->", connectionstyle="arc3,rad=.2"),
+                              fontsize=10, color='y')
 
         left, height, top = 0.025, 0.03, 0.9
-        t1 = ax_price.text(left, top, '%s-%s,%s,%s' % (stock.code, stock.name, stock.area, stock.industry),
-                           fontproperties=fp, fontsize=8, transform=ax_price.transAxes)
-        ax_price.text(left, top - height, 'pe=%.2f' % (stock.pe if stock.pe else 0.0), fontsize=8, transform=ax_price.transAxes)
-        ax_price.text(left, top - 2*height, 'nmc=%.2f亿' % (stock.nmc/10000 if stock.nmc else 0.0), fontproperties=fp, fontsize=8, transform=ax_price.transAxes)
-        ax_price.text(left, top - 3*height, 'mktcap=%.2f亿' % (stock.mktcap/10000 if stock.mktcap else 0.0), fontproperties=fp, fontsize=8, transform=ax_price.transAxes)
+        t1 = ax_price.text(left, top, data['title'], fontproperties=fp, fontsize=8, transform=ax_price.transAxes)
+        ax_price.text(left, top - height, 'pe=%.2f' % (data['pe'] if data['pe'] else 0.0), fontsize=8, transform=ax_price.transAxes)
+        ax_price.text(left, top - 2*height, 'nmc=%.2f亿' % (data['nmc']/10000 if data['nmc'] else 0.0), fontproperties=fp, fontsize=8, transform=ax_price.transAxes)
+        ax_price.text(left, top - 3*height, 'mktcap=%.2f亿' % (data['mktcap']/10000 if data['mktcap'] else 0.0), fontproperties=fp, fontsize=8, transform=ax_price.transAxes)
 
         if not qfq:
             ax_price.text(left, top - 4*height, 'EMA(5)', color='b', fontsize=8, transform=ax_price.transAxes)
             ax_price.text(left, top - 5*height, 'EMA(10)', color='y', fontsize=8, transform=ax_price.transAxes)
             ax_price.text(left, top - 6*height, 'EMA(20)', color='g', fontsize=8, transform=ax_price.transAxes)
             ax_price.text(left, top - 7*height, 'EMA(30)', color='r', fontsize=8, transform=ax_price.transAxes)
-            ax_price.plot(stock_data.ma5.values, color='b', lw=1)
-            ax_price.plot(stock_data.ma10.values, color='y', lw=1)
-            ax_price.plot(stock_data.ma20.values, color='g', lw=1)
-            ax_price.plot(stock.ma30.sort_index(ascending=True).close.values, color='r', lw=1)
-            #ax_price.plot(stock.ma60.sort_index(ascending=True).close.values, color='r', lw=1)
-            #ax_price.plot(stock.ma120.sort_index(ascending=True).close.values, color='r', lw=1)
+            ax_price.plot(data['ma5'], color='b', lw=1)
+            ax_price.plot(data['ma10'], color='y', lw=1)
+            ax_price.plot(data['ma20'], color='g', lw=1)
+            ax_price.plot(data['ma30'], color='r', lw=1)
 
 
         s = '%s O:%1.2f H:%1.2f L:%1.2f C:%1.2f, V:%1.1fM Chg:%+1.2f' % (
-            stock_data.index[-1],
-            stock_data.open[-1], stock_data.high[-1], stock_data.low[-1], stock_data.close[-1],
-            stock_data.volume[-1] * 1e-6,
-            stock_data.close[-1] - stock_data.open[-1])
+            dates[-1],
+            data['open'][-1], data['high'][-1], data['low'][-1], data['close'][-1],
+            data['volume'][-1] * 1e-6,
+            data['close'][-1] - data['open'][-1])
         ax_price.text(0.5, top, s, fontsize=8, transform=ax_price.transAxes)
 
         plt.ylabel('Price')
-        plt.ylim(ymin=stock_data.low.min()-stock_data.low.min()/30, ymax=stock_data.high.max()+stock_data.high.max()/30)
+        plt.ylim(ymin=data['low'].min()-data['low'].min()/30, ymax=data['high'].max()+data['high'].max()/30)
         ax_price.grid(True)
 
         if qfq:
@@ -105,32 +232,29 @@ class StockPlot(object):
         else:
             plt.title('History Price')
 
-        xrange = range(0, stock_data.index.size, max(int(stock_data.index.size / 5), 5))
-        plt.xticks(xrange, [stock_data.index[loc] for loc in xrange])
+        xrange = range(0, dates.size, max(int(dates.size / 5), 5))
+        plt.xticks(xrange, [dates[loc] for loc in xrange])
         plt.setp(ax_price.get_xticklabels(), visible=False)
 
         # draw index overlay
-        if index_overlay:
-            common_index = index_data.index.intersection(stock_data.index)
-            common_data = index_data.join(DataFrame(index=common_index), how='inner')
-            common_data.sort_index(ascending=True, inplace=True)
+        if 'index_open' in data:
             ax_index = ax_price.twinx()
-            candlestick2_ochl(ax_index, common_data.open, common_data.high, common_data.low, common_data.close,
-                              width=.75, colorup='g', colordown='r', alpha=0.35)
-            ax_index.set_ylabel('Index(%s)' % index.name, fontproperties=fp)
-            ax_index.set_ylim(ymin=common_data.low.min(), ymax=common_data.high.max())
+            candlestick(ax_index, data['index_open'], data['index_high'], data['index_low'], data['index_close'],
+                        width=.75, colorup='g', colordown='r', alpha=0.35)
+            ax_index.set_ylabel('Index(%s)' % data['index_name'], fontproperties=fp)
+            ax_index.set_ylim(ymin=data['index_low'].min(), ymax=data['index_high'].max())
 
         # draw hist volume diagram
         ax_volume = plt.subplot(gs[1], sharex=ax_price)
-        volume_overlay(ax_volume, stock_data.open, stock_data.close, stock_data.volume,
-                       width=.75, colorup='g', colordown='r', alpha=0.75)
+        volume_bars(ax_volume, data['open'], data['close'], data['volume'],
+                    width=.75, colorup='g', colordown='r', alpha=0.75)
         ax_volume.yaxis.set_major_formatter(FuncFormatter(lambda x, pos: '%1.1fM' % (x*1e-6)
-                       if stock_data.volume.max()>1e6 else '%1.1fK' % (x*1e-3)))
+                       if data['volume'].max()>1e6 else '%1.1fK' % (x*1e-3)))
 
         if not qfq:
-            ax_volume.plot(stock_data.v_ma5.values, color='b', lw=1)
-            ax_volume.plot(stock_data.v_ma10.values, color='y', lw=1)
-            ax_volume.plot(stock_data.v_ma20.values, color='r', lw=1)
+            ax_volume.plot(data['v_ma5'], color='b', lw=1)
+            ax_volume.plot(data['v_ma10'], color='y', lw=1)
+            ax_volume.plot(data['v_ma20'], color='r', lw=1)
         plt.setp(ax_volume.get_xticklabels(), visible=False)
         ax_volume.yaxis.set_ticks_position('both')
         ax_volume.set_ylabel('Volume')
@@ -138,9 +262,9 @@ class StockPlot(object):
 
         # draw hist turnover diagram
         ax_turnover = plt.subplot(gs[2], sharex=ax_price)
-        volume_overlay(ax_turnover, stock_data.open, stock_data.close, stock_data.turnover,
-                       width=.75, colorup='g', colordown='r', alpha=0.75)
-        ax_turnover.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: '%s' % (stock_data.index[x])))
+        volume_bars(ax_turnover, data['open'], data['close'], data['turnover'],
+                    width=.75, colorup='g', colordown='r', alpha=0.75)
+        ax_turnover.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: '%s' % (dates[int(x)] if 0 <= x < dates.size else '')))
         ax_turnover.yaxis.set_major_formatter(FuncFormatter(lambda x, pos: '%.2f%%' % (x)))
         for label in ax_turnover.xaxis.get_ticklabels():
             label.set_rotation(0)
@@ -158,20 +282,25 @@ class StockPlot(object):
         self._ax_volume = ax_volume
         self._ax_turnover = ax_turnover
 
-    def _plot(self, stock, qfq, index, index_overlay=False, path=None):
+    def plot(self, data, path=None):
+        """plot what data_of() returns, show it or save it to path"""
         if path is None:
-            self.__plot(stock, self.display_size, qfq, index, index_overlay)
+            self.__plot(data, self.display_size)
             plt.show()
         else:
-            self.__plot(stock, self.save_size, qfq, index, index_overlay)
-            plt.savefig(path)
+            self.__plot(data, self.save_size)
+            # path may be a hard link to a cached plot, replace it instead of writing through it
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            ext = os.path.splitext(path)[1][1:]
+            plt.gcf().savefig(tmp, format=ext or None)  # pyplot.savefig() would draw the figure once more after saving
+            os.replace(tmp, path)
         plt.close()
 
     def plot_hist(self, stock, index, index_overlay=False, path=None):
-        self._plot(stock, False,index, index_overlay, path)
+        self.plot(self.data_of(stock, index, False, index_overlay), path)
 
     def plot_qfq(self, stock, index=None, index_overlay=False, path=None):
-        self._plot(stock, True, index, index_overlay, path)
+        self.plot(self.data_of(stock, index, True, index_overlay), path)
 
     @property
     def ax_price(self):
@@ -183,4 +312,50 @@ class StockPlot(object):
 
     @property
     def ax_turnover(self):
-        return self._ax_turnover
\ No newline at end of file
+        return self._ax_turnover
+
+
+class PlotCache(object):
+    """
+    saved plots shared by reports, named by StockPlot.key_of() so a cached plot is never stale. reports
+    hard link the cached images, or copy them if the report is on another file system. plots not used
+    for max_age_days are removed by prune().
+    """
+    def __init__(self, cache_dir, max_age_days=7):
+        self.cache_dir = cache_dir
+        self.max_age_days = max_age_days
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, '%s.png' % key)
+
+    def fetch(self, key, dest):
+        """link cached plot of key to dest, return False if it is not cached"""
+        src = self.path(key)
+        if not os.path.exists(src):
+            return False
+        os.utime(src)  # used, keep it
+        self._link(src, dest)
+        return True
+
+    def put(self, key, src):
+        """cache plot saved to src as key"""
+        self._link(src, self.path(key))
+
+    def prune(self):
+        expire = time.time() - self.max_age_days * 24 * 3600
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.png') and entry.stat().st_mtime < expire:
+                os.remove(entry.path)
+
+    @staticmethod
+    def _link(src, dest):
+        # replace dest at once, other reports may read or link it meanwhile
+        if os.path.exists(dest) and os.path.samefile(src, dest):
+            return  # renaming a link onto another link of the same file does nothing
+        tmp = '%s.%d.tmp' % (dest, os.getpid())
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
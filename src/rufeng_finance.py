@@ -17,11 +17,12 @@ from pandas import DataFrame
 from tqdm import tqdm
 import yaml
 import cmd
+import tushare as ts
 
 from analyzer import Analyzer
 from dm import DataManager
 from monitor import StockMonitor
-from plot import StockPlot
+from plot import StockPlot, PlotCache
 import util
 
 
@@ -66,7 +67,7 @@ class RufengFinanceCommandLine(cmd.Cmd):
         if self.loaded and len(self.dm.stocks):
             print('already loaded')
         else:
-            self.dm.load_from_db()
+            self.dm.load_from_db(lazy_hist=True)
             self.loaded = True
 
     def help_load(self):
@@ -83,31 +84,58 @@ class RufengFinanceCommandLine(cmd.Cmd):
         parser.add_argument("-p", "--pause",
                             type=float, dest="pause", default=0.1,
                             help="pause duration during network retry")
+        parser.add_argument("--async",
+                            action="store_true", dest="use_async", default=False,
+                            help="download history data with asyncio instead of threads")
+        parser.add_argument("-c", "--concurrency",
+                            type=int, dest="concurrency", default=20,
+                            help="max requests in flight when downloading with asyncio")
+        parser.add_argument("-r", "--rate",
+                            type=float, dest="rate", default=0,
+                            help="max requests per second to one host when downloading with asyncio, 0 for no limit "
+                                 "(default). a stock takes about 13 requests, so it limits to rate/13 stocks a second")
+        parser.add_argument("-b", "--batch-size",
+                            type=int, dest="batch_size", default=100,
+                            help="stocks saved to database by one bulk write")
+        parser.add_argument("-s", "--server",
+                            metavar="URL", dest="server", default=None,
+                            help="send all requests to a tushare record/replay server, see benchmark/replay.py")
         options = self._parse_arg(parser, args_str)
         if not options:
             return
 
+        fetcher = None
+        if options.use_async:
+            from fetcher import AsyncHistFetcher
+            fetcher = AsyncHistFetcher(concurrency=options.concurrency, rate=options.rate, pause=options.pause)
+
         self.dm.data_period_y = self.config['core']['data_period']
+        self.dm.write_batch_size = options.batch_size
         if options.force_update and self.loaded:
             self.dm.invalid_loaded_stocks()
             self.loaded = False
         elif not self.loaded:
             self.do_load()
 
+        if options.server:
+            ts.set_server(options.server)
         try:
-            data_full = self.dm.pick_data(options.threads)
+            data_full = self.dm.pick_data(options.threads, fetcher=fetcher)
         except IOError as e:
             print(e)
             traceback.print_exc()
         else:
             if not data_full:
                 logging.warning('not all data successfully picked')
+        finally:
+            if options.server:
+                ts.set_server(None)
 
     def help_download(self):
         print('\n'.join(['download stock data from internet (years)', ]))
 
     def complete_download(self, text, line, begidx, endidx):
-        candidate = ['-f', '--force_update']
+        candidate = ['-f', '--force_update', '--async']
 
         if not text:
             completions = candidate[:]
@@ -123,13 +151,15 @@ class RufengFinanceCommandLine(cmd.Cmd):
             return
 
         if not len(options.codes):
-            if not self.loaded:
-                self.do_load()
-            stocks = self.dm.stocks
+            if self.loaded:
+                stocks = self.dm.stocks
+            else:
+                stocks = {stock.code: stock for stock in
+                          self.dm.local_dm.find_stock(fields=('name',), lazy_hist=True)}
         else:
             stocks = {}
             for code in options.codes:
-                stock = self.dm.find_one_stock_from_db(code)
+                stock = self.dm.find_one_stock_from_db(code, fields=('name',))
                 if stock is None:
                     logging.error('unknown stock %s', code)
                 else:
@@ -178,14 +208,17 @@ class RufengFinanceCommandLine(cmd.Cmd):
         if not options:
             return
 
+        fields = ('name', 'price', 'last_update')
         if not len(options.codes):
-            if not self.loaded:
-                self.do_load()
-            stocks = self.dm.stocks
+            if self.loaded:
+                stocks = self.dm.stocks
+            else:
+                stocks = {stock.code: stock for stock in
+                          self.dm.local_dm.find_stock(fields=fields, lazy_hist=True)}
         else:
             stocks = {}
             for code in options.codes:
-                stock = self.dm.find_one_stock_from_db(code)
+                stock = self.dm.find_one_stock_from_db(code, fields=fields, lazy_hist=True)
                 if stock is None:
                     logging.error('unknown stock %s', code)
                 else:
@@ -196,15 +229,18 @@ class RufengFinanceCommandLine(cmd.Cmd):
             return
 
         list = []
-        for code, stock in self.dm.stocks.items():
+        for code, stock in stocks.items():
+            if stock.hist_loaded:
+                hist = stock.hist_len and (stock.hist_len, stock.hist_start_date, stock.hist_last_date)
+            else:
+                hist = self.dm.local_dm.hist_dates(code)  # from the date index only, hist_data is not loaded
             list.append({'code': code, 'name': stock.name, 'price': stock.price,
-                         'hist_data': '%4d[%s - %s]' % (
-                             stock.hist_data.index.size, stock.hist_data.tail(1).index[0], stock.hist_data.index[0]),
+                         'hist_data': '%4d[%s - %s]' % hist if hist else '   0[]',
                          'update': stock.last_update.strftime("%Y-%m-%d %H:%M:%S")
                          })
         df = DataFrame(list)
 
-        logging.info('all %d available stocks can be analyzed' % len(self.dm.stocks))
+        logging.info('all %d available stocks can be analyzed' % len(stocks))
         print(df.to_string(columns=('code', 'name', 'price', 'hist_data', 'update')))
 
         if options.output:
@@ -268,9 +304,21 @@ class RufengFinanceCommandLine(cmd.Cmd):
         parser.add_argument("-t", "--threads",
                             type=int, dest="threads", default=multiprocessing.cpu_count(),
                             help="threads number to work [default equal cpu count]")
+        parser.add_argument("-p", "--processes",
+                            type=int, dest="processes", default=0,
+                            help="processes number to screen market panel and plot report, 0 to do it in this process")
+        parser.add_argument("--per-stock",
+                            action="store_true", dest="per_stock", default=False,
+                            help="analyze stocks one by one instead of screening market panel")
         parser.add_argument("--plot-all",
                             action="store_true", dest="plot_all", default=False,
                             help="plot all stocks, not only good ones")
+        parser.add_argument("--charts",
+                            choices=('png', 'js'), dest="charts", default='png',
+                            help="plot charts of stocks to images, or save their data to draw them in browser")
+        parser.add_argument("--plot-cache",
+                            metavar="DIR", dest="plot_cache", default=os.path.join('data', 'plots'),
+                            help="plots shared by reports, empty to plot every stock again [default data/plots]")
         parser.add_argument('codes', nargs='*')
         options = self._parse_arg(parser, args_str)
         if not options:
@@ -302,10 +350,10 @@ class RufengFinanceCommandLine(cmd.Cmd):
             logging.error('no stocks found in local database, please run \'load\' command first')
             return
 
-        analyzer = Analyzer(stocks, self.dm.indexes, config)
+        analyzer = Analyzer(stocks, self.dm.indexes, config, panel=None if options.per_stock else self.dm.panel)
         logging.info('all %d available stocks will be analyzed' % len(analyzer.stocks))
         logging.info('-----------invoking data analyzer module-------------')
-        analyzer.analyze(threads=options.threads)
+        analyzer.analyze(threads=options.threads, processes=options.processes)
         logging.info('-------------------analyze done----------------------')
 
         list = []
@@ -331,7 +379,9 @@ class RufengFinanceCommandLine(cmd.Cmd):
         if options.output:
             logging.info('generating html report...')
             os.makedirs(options.output, exist_ok=True)
-            analyzer.generate_report(options.output, only_plot_good=not options.plot_all)
+            plot_cache = PlotCache(options.plot_cache) if options.plot_cache else None
+            analyzer.generate_report(options.output, only_plot_good=not options.plot_all,
+                                     processes=options.processes, plot_cache=plot_cache, charts=options.charts)
             logging.info('done')
 
     def help_analyze(self):
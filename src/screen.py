@@ -0,0 +1,258 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import warnings
+import numpy as np
+from stock import Stock
+
+
+class ScreenResult(object):
+    """
+    outcome of screening a set of stocks. reasons[i] is 0 if codes[i] is good, otherwise the
+    1-based number of the first rule it failed, use message(i) to get the readable reason.
+    """
+    def __init__(self, codes, reasons, rules, values):
+        self.codes = codes
+        self.reasons = reasons
+        self._rules = rules
+        self._values = values
+
+    def is_good(self, i):
+        return self.reasons[i] == 0
+
+    def messages(self):
+        return [self.message(i) for i in range(len(self.codes))]
+
+    def message(self, i):
+        reason = self.reasons[i]
+        if reason == 0:
+            return ''
+        rule = self._rules[reason - 1]
+        return rule.message % tuple(v[i] for v in self._values[reason - 1])
+
+
+class _Rule(object):
+    def __init__(self, message, func):
+        self.message = message
+        self.func = func
+
+
+class _Context(object):
+    """
+    market data of screened stocks, right aligned per stock: the last column is the latest trading day
+    of each stock and suspended days are squeezed out, so [:, -days:] is the last 'days' days of data
+    just like hist_data[-days:] of a single stock.
+    """
+    def __init__(self, panel, rows, basics):
+        self.basics = basics
+        close = panel['close'][rows]
+        valid = ~np.isnan(close)
+        self._order = np.argsort(valid, axis=1, kind='stable')
+        self.hist_len = valid.sum(axis=1)
+        self.close = self._compact(close)
+        self._panel = panel
+        self._rows = rows
+        self._cache = {}
+
+    def _compact(self, array):
+        return np.take_along_axis(np.asarray(array, dtype=np.float64), self._order, axis=1)
+
+    def field(self, name):
+        if name not in self._cache:
+            self._cache[name] = self._compact(self._panel[name][self._rows])
+        return self._cache[name]
+
+    @property
+    def qfq_close(self):
+        if 'qfq_close' not in self._cache:
+            factor = self.field('factor')
+            self._cache['qfq_close'] = self.close * factor / factor[:, -1:]
+        return self._cache['qfq_close']
+
+    def ma(self, window):
+        """
+        moving average of close for all days. ma5, ma10 and ma20 are the downloaded columns like the
+        per-stock path uses, other windows are calculated from close.
+        """
+        key = 'ma%d' % window
+        if key in self._panel.FIELDS:
+            return self.field(key)
+        if key not in self._cache:
+            close = np.nan_to_num(self.close)
+            cs = np.cumsum(close, axis=1)
+            ma = np.full(close.shape, np.nan)
+            ma[:, window - 1:] = cs[:, window - 1:]
+            ma[:, window:] -= cs[:, :-window]
+            ma /= window
+            # not enough history for this window
+            first = close.shape[1] - self.hist_len
+            ma[np.arange(close.shape[1]) < (first + window - 1)[:, None]] = np.nan
+            self._cache[key] = ma
+        return self._cache[key]
+
+    @staticmethod
+    def last(array, days):
+        return array[:, -days:]
+
+
+class ScreenEngine(object):
+    """
+    compile the config of an analyzing scheme into vectorized rules, and evaluate every rule over the
+    whole market panel at once with numpy. Rules are evaluated in the same order and with the same
+    meaning as Analyzer._analyze_single_stock.
+    values are compared in float64 but the panel keeps them as float32, and ma30 and longer are summed
+    in another order than pandas rolling does, so a value exactly on a limit, or two moving averages
+    within a rounding error of each other, may get another verdict than the per-stock path.
+    """
+    valid_ma = (5, 10, 20, 30, 60, 120)
+
+    def __init__(self, config):
+        self._config = config
+        self.rules = []
+        self._compile()
+
+    def _get_config(self, name):
+        return self._config[name] if name in self._config else None
+
+    def _add(self, message, func):
+        self.rules.append(_Rule(message, func))
+
+    def _compile(self):
+        add = self._add
+        nan = np.nan
+
+        if self._get_config('exclude_gem'):
+            add('in Growth Enterprise Market',
+                lambda c: (np.char.startswith(c.basics['code'], '300'), ()))
+
+        if self._get_config('exclude_suspension'):
+            add('suspending',
+                lambda c: ((np.isnan(c.basics['price']) | (c.basics['price'] == 0.0)), ()))
+
+        if self._get_config('exclude_st') is not None:
+            def st(c):
+                mask = np.zeros(c.hist_len.size, dtype=bool)
+                for p in Stock.st_prefix:
+                    mask |= np.char.startswith(c.basics['name'], p)
+                return mask, ()
+            add('Special Treatment (ST)', st)
+
+        config = self._get_config('min_hist_data')
+        if config is not None:
+            days = max(config, 10)
+            add('only %d days history data', lambda c, days=days: (c.hist_len < days, (c.hist_len,)))
+
+        config = self._get_config('max_price')
+        if config is not None:
+            add('price is too high, %d RMB', lambda c, limit=config: (c.close[:, -1] > limit, (c.close[:, -1],)))
+
+        for name, desc in (('nmc', 'circulated market value is too high, %dY RMB'),
+                           ('mktcap', 'total market cap value is too high, %dY RMB')):
+            config = self._get_config('max_%s' % name)
+            if config is not None:
+                def cap(c, name=name, limit=config):
+                    value = c.basics[name] / 10000
+                    return value > limit, (value,)
+                add(desc, cap)
+
+        config = self._get_config('max_pe')
+        if config is not None:
+            add('PE is too high, %d', lambda c, limit=config: (c.basics['pe'] > limit, (c.basics['pe'],)))
+
+        for days, min_avg in self._get_config('min_turnover_avg') or ():
+            def turnover(c, days=days, min_avg=min_avg):
+                avg = np.nanmean(c.last(c.field('turnover'), days), axis=1)
+                return (c.hist_len >= days) & (avg < min_avg), (avg,)
+            add('%d days average turnover is too low, %%.2f%%%% < %.2f%%%%' % (days, min_avg), turnover)
+
+        config = self._get_config('position')
+        if config is not None:
+            (low_days, low_ratio), (high_days, high_ratio) = config[0], config[1]
+
+            def position_low(c):
+                min_close = np.nanmin(c.last(c.qfq_close, low_days), axis=1)
+                ratio = (c.qfq_close[:, -1] - min_close) / min_close
+                return (c.hist_len >= low_days) & (ratio > low_ratio), (min_close, ratio * 100)
+            add('current price is higher than %d days min %%.2f %%.2f%%%%' % low_days, position_low)
+
+            def position_high(c):
+                max_close = np.nanmax(c.last(c.qfq_close, high_days), axis=1)
+                ratio = (max_close - c.qfq_close[:, -1]) / c.qfq_close[:, -1]
+                return (c.hist_len >= high_days) & (ratio < high_ratio), (max_close, ratio * 100)
+            add('%d days max %%.2f is only higher than current %%.2f%%%%' % high_days, position_high)
+
+        for days, low, high in self._get_config('amp_scope') or ():
+            def amp_scope(c, days=days, low=low, high=high):
+                window = c.last(c.qfq_close, days)
+                min_close, max_close = np.nanmin(window, axis=1), np.nanmax(window, axis=1)
+                amp = (max_close - min_close) / min_close
+                return (c.hist_len >= days) & ((amp < low) | (amp > high)), (amp * 100,)
+            add('%d day amplitude %%.2f%%%% is not in range [%.2f%%%%, %.2f%%%%]' % (days, low * 100, high * 100),
+                amp_scope)
+
+        for days, low, high in self._get_config('raise_drop_scope') or ():
+            def raise_drop_scope(c, days=days, low=low, high=high):
+                base = c.qfq_close[:, -days - 1] if days < c.close.shape[1] else np.full(c.hist_len.size, nan)
+                change = (c.qfq_close[:, -1] - base) / base
+                return (c.hist_len > days) & ((change < low) | (change > high)), (change * 100,)
+            add('%d day change percent %%.2f%%%% is not in range [%.2f%%%%, %.2f%%%%]' % (days, low * 100, high * 100),
+                raise_drop_scope)
+
+        for days, change, min_count in self._get_config('min_change_count') or ():
+            def change_count(c, days=days, change=change, min_count=min_count):
+                with np.errstate(invalid='ignore'):
+                    count = (np.abs(c.last(c.field('p_change'), days)) > change).sum(axis=1)
+                return (c.hist_len >= days) & (count < min_count), (count,)
+            add('%d days data only have %%d days change percent larger than %.2f%%%%' % (days, change),
+                change_count)
+
+        for ma_a, ma_b, min_count in self._get_config('ma') or ():
+            if ma_a not in self.valid_ma or ma_b not in self.valid_ma:
+                raise ValueError('not a valid ma')
+
+            def ma(c, ma_a=ma_a, ma_b=ma_b, min_count=min_count):
+                with np.errstate(invalid='ignore'):
+                    below = c.last(c.ma(ma_a), min_count) < c.last(c.ma(ma_b), min_count)
+                # days from now until ma_a is lower than ma_b the first time
+                days = np.where(below.any(axis=1), np.argmax(below[:, ::-1], axis=1), min_count)
+                return (c.hist_len >= max(ma_a, ma_b)) & (days < min_count), (days,)
+            add('ma%d only larger than ma%d for %%d days from now' % (ma_a, ma_b), ma)
+
+    def screen(self, panel, basics, rows=None):
+        """
+        basics: dict of arrays aligned with rows, contains code, name, price, nmc, mktcap and pe
+        rows: panel rows to be screened, default all
+        """
+        rows = np.arange(len(panel)) if rows is None else np.asarray(rows)
+        ctx = _Context(panel, rows, basics)
+
+        reasons = np.zeros(rows.size, dtype=np.uint8)
+        values = []
+        with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN windows of short history
+            for i, rule in enumerate(self.rules):
+                bad, value = rule.func(ctx)
+                reasons[(reasons == 0) & bad] = i + 1
+                values.append(value)
+        return ScreenResult(basics['code'], reasons, self.rules, values)
+
+    @staticmethod
+    def basics_of(stocks, codes):
+        """
+        collect fundamentals used by rules aligned with codes, as whole columns of the fundamentals table
+        if all stocks are attached to the same one, otherwise from Stock objects one by one
+        """
+        tables = set(getattr(stocks[code], 'fundamentals', None) for code in codes)
+        basics = {'code': np.array(codes, dtype=str),
+                  'name': np.array([stocks[code].name or '' for code in codes], dtype=str)}
+        if len(tables) == 1 and None not in tables:
+            table = tables.pop()
+            for field in ('price', 'nmc', 'mktcap', 'pe'):
+                basics[field] = table.values(field, codes)
+            return basics
+
+        def number(v):
+            return float('nan') if v is None else float(v)
+        for field in ('price', 'nmc', 'mktcap', 'pe'):
+            basics[field] = np.array([number(getattr(stocks[code], field)) for code in codes])
+        return basics
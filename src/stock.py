@@ -1,14 +1,25 @@
 # coding=utf-8
 __author__ = 'Du, Changbin <changbin.du@gmail.com>'
 
+import re
 import json
 import datetime
 import logging
 from collections import MutableMapping
 import numpy as np
-from pandas import DataFrame
+from pandas import DataFrame, DatetimeIndex, to_datetime, concat
+from fundamentals import Fundamentals
 
 class StockBase(object):
+    """
+    attributes are slots, FIELDS are the ones saved in documents and accessible as items,
+    hist_data is saved apart to history store.
+    hist_data and all data derived from it are indexed by dates in ascending order (see canonical),
+    the latest day is the last row and last(days) is the latest 'days' days.
+    """
+    FIELDS = ('code', 'name', 'last_update')
+    __slots__ = FIELDS + ('hist_data', '_indicators', '_partial', '_hist_loader')
+
     def __init__(self, code=None, name=None):
         # Basic info
         self.code = code  # 代码
@@ -18,6 +29,31 @@ class StockBase(object):
         self.last_update = None
         self.hist_data = None # DataFrame
 
+        self._indicators = {} # (indicator, window) -> DataFrame, valid until last date of it
+        self._partial = False # only some fields or days are loaded, must not be saved back
+        self._hist_loader = None
+
+    def __getattr__(self, name):
+        # only called for missing attributes, hist_data is missing until lazy loaded
+        if name == 'hist_data' and self._hist_loader is not None:
+            loader, self._hist_loader = self._hist_loader, None
+            self.hist_data = None
+            loader(self)
+            return self.hist_data
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    def set_hist_loader(self, loader):
+        """hist_data will be loaded by loader(stock) on first access"""
+        try:
+            del self.hist_data
+        except AttributeError:
+            pass
+        self._hist_loader = loader
+
+    @property
+    def hist_loaded(self):
+        return self._hist_loader is None
+
     def __str__(self):
         ''' convert to string '''
         return json.dumps({"code": self.code,
@@ -25,36 +61,49 @@ class StockBase(object):
                           }, ensure_ascii = False)
 
     def __getitem__(self, key):
-        if key not in self.__dict__:
-            raise KeyError
-        return self.__getattribute__(key)
+        if key not in self.FIELDS and key != 'hist_data':
+            raise KeyError(key)
+        return getattr(self, key)
 
     def __setitem__(self, key, value):
-        if key not in self.__dict__:
+        if key not in self.FIELDS and key != 'hist_data':
             raise KeyError('key %s is invalid' % key)
-        return self.__setattr__(key, value)
+        return setattr(self, key, value)
 
     def __delitem__(self, key):
         raise NotImplementedError
 
     def __len__(self):
-        return len(self.__dict__)
+        return len(self.FIELDS)
 
     def __iter__(self):
-        return self.__dict__.__iter__()
+        return iter(self.FIELDS)
+
+    @staticmethod
+    def canonical(df):
+        """df indexed by dates in ascending order, nothing is copied if it is already"""
+        if not isinstance(df.index, DatetimeIndex):
+            df = df.copy(deep=False)
+            df.index = to_datetime(df.index.map(str))
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index(ascending=True)
+        return df
 
     def sanitize(self):
         if self.hist_data is not None:
-            # self.hist_data.index = self.hist_data.index.map(np.datetime64)
-            self.hist_data.index = self.hist_data.index.map(str)
-            self.hist_data.sort_index(ascending=False, inplace=True)
+            self.hist_data = self.canonical(self.hist_data)
+
+    def last(self, days, df=None):
+        """view of the latest 'days' days of df, hist_data by default"""
+        df = self.hist_data if df is None else df
+        return df.iloc[-days:] if days > 0 else df.iloc[:0]
 
     def check(self):
         pass
 
     @property
     def hist_len(self):
-        return self.hist_data is None and 0 or self.hist_data.index.size
+        return 0 if self.hist_data is None else self.hist_data.index.size
 
     @property
     def hist_max(self):
@@ -66,11 +115,11 @@ class StockBase(object):
 
     @property
     def hist_start_date(self):
-        return np.datetime64(self.hist_data.index[-1], 'D')
+        return self.hist_data.index.values[0].astype('datetime64[D]')
 
     @property
     def hist_last_date(self):
-        return np.datetime64(self.hist_data.index[0], 'D')
+        return self.hist_data.index.values[-1].astype('datetime64[D]')
 
     @property
     def ma30(self):
@@ -89,94 +138,192 @@ class StockBase(object):
         return self._get_ma(240)
 
     def _get_ma(self, window):
-        df = self.hist_data[['open', 'close', 'low', 'high', 'volume', 'turnover']].sort_index(ascending=True)
-        r = df.rolling(window=window)
-        df = r.mean()
-        df.sort_index(ascending=False, inplace=True)
+        return self._get_indicator('ma', window)
+
+    indicator_columns = ['open', 'close', 'low', 'high', 'volume', 'turnover']
+    indicator_funcs = {'ma': lambda df, window: df.rolling(window=window).mean()}
+    # (name, window) of indicators calculated whenever hist_data is picked, so they are saved with it
+    saved_indicators = ()
+
+    @property
+    def indicators(self):
+        return self._indicators
+
+    def set_indicator(self, name, window, df):
+        self._indicators[(name, window)] = self.canonical(df)
+
+    def invalidate_indicators(self):
+        self._indicators = {}
+
+    def update_indicators(self):
+        """bring all cached indicators up to date with hist_data"""
+        for name, window in list(self._indicators.keys()):
+            self._get_indicator(name, window)
+
+    def calc_saved_indicators(self):
+        for name, window in self.saved_indicators:
+            self._get_indicator(name, window)
+
+    @property
+    def cached_frames(self):
+        """data derived from hist_data which is saved along with it, frame name -> DataFrame"""
+        return {'%s%d' % key: df for key, df in self._indicators.items()}
+
+    def set_cached_frame(self, frame, df):
+        m = re.match(r'^([a-z]+)(\d+)$', frame)
+        if m:
+            self.set_indicator(m.group(1), int(m.group(2)), df)
+
+    def update_cache(self, start=None):
+        """
+        new days are appended to hist_data. If given, days from start on were picked again and may have
+        changed, cached rows of them are dropped and calculated again.
+        """
+        if start is not None:
+            self.truncate_cache(start)
+        self.update_indicators()
+
+    def truncate_cache(self, start):
+        """drop cached rows of days from start on"""
+        for key, df in list(self._indicators.items()):
+            self._indicators[key] = df.iloc[:df.index.searchsorted(start)]
+
+    def invalidate_cache(self):
+        """hist_data is replaced"""
+        self.invalidate_indicators()
+
+    def _get_indicator(self, name, window):
+        """
+        indicator is cached with the last date it was calculated to, when new days are appended to
+        hist_data only the new tail is calculated.
+        """
+        cached = self._indicators.get((name, window))
+        func = self.indicator_funcs[name]
+        columns = [c for c in self.indicator_columns if c in self.hist_data.columns]
+        if cached is not None and cached.index.size and cached.index[-1] in self.hist_data.index:
+            new_days = self.hist_len - 1 - self.hist_data.index.get_loc(cached.index[-1])
+            if new_days == 0 and cached.index.size == self.hist_len:
+                return cached
+            if new_days > 0 and cached.index.size + new_days == self.hist_len:
+                df = func(self.last(new_days + window - 1)[columns], window).iloc[-new_days:]
+                df = concat([cached, df])
+                self._indicators[(name, window)] = df
+                return df
+
+        df = func(self.hist_data[columns], window)
+        self._indicators[(name, window)] = df
         return df
 
     def get_hist_date(self, loc):
         return self.hist_data.index[loc]
 
     def get_turnover_avg(self, days):
-        return self.hist_data.turnover[0:days].mean()
+        return self.last(days).turnover.mean()
 
 
 class Stock(StockBase):
+    """fields in Fundamentals are also items of it, but saved to the fundamentals table instead"""
+    __slots__ = ('_fundamentals', '_values', '_qfq')
     st_prefix = ('*ST', 'ST', 'S*ST', 'SST')
+    saved_indicators = (('ma', 30), ('ma', 60), ('ma', 120))  # used by analyzing and plots
 
     ''' stock class'''
     def __init__(self, code=None, name=None):
         super(Stock, self).__init__(code=code, name=name)
-        # Basics
-        self.industry = None # 所属行业
-        self.area = None # 地区
-        self.pe = None # 市盈率
-        self.outstanding = None # 流通股本
-        self.nmc = None # 流通市值(万元)
-        self.totals = None # 总股本(万)
-        self.mktcap = None # 总市值(万元)
-        self.totalAssets = None # 总资产(万)
-        self.liquidAssets = None # 流动资产
-        self.fixedAssets = None # 固定资产
-        self.reserved = None # 公积金
-        self.reservedPerShare = None # 每股公积金
-        self.eps = None # 每股收益
-        self.eps_yoy = None # 每股收益同比( %)
-        self.bvps = None # 每股净资
-        self.pb = None # 市净率
-        self.timeToMarket = None # 上市日期
-        self.roe = None # 净资产收益率( %)
-        self.epcf = None # 每股现金流量(元)
-        self.net_profits = None # 净利润(万元)
-        self.profits_yoy = None # 净利润同比( %)
-        self.net_profit_ratio = None # 净利率( %)
-        self.gross_profit_rate = None # 毛利率( %)
-        self.business_income = None # 营业收入(百万元)
-        self.bips = None # 每股主营业务收入(元)
-        self.distrib = None # 分配方案
-        self.report_date = None # 发布日期
-        self.arturnover = None # 应收账款周转率(次)
-        self.arturndays = None # 应收账款周转天数(天)
-        self.inventory_turnover = None # 存货周转率(次)
-        self.inventory_days = None # 存货周转天数(天)
-        self.currentasset_turnover = None # 流动资产周转率(次)
-        self.currentasset_days = None # 流动资产周转天数(天)
-        self.mbrg = None # 主营业务收入增长率( %)
-        self.nprg = None # 净利润增长率( %)
-        self.nav = None # 净资产增长率
-        self.targ = None # 总资产增长率
-        self.epsg = None # 每股收益增长率
-        self.seg = None # 股东权益增长率
-        self.currentratio = None # 流动比率
-        self.quickratio = None # 速动比率
-        self.cashratio = None # 现金比率
-        self.icratio = None # 利息支付倍数
-        self.sheqratio = None # 股东权益比率
-        self.adratio = None # 股东权益增长率
-        self.cf_sales = None # 经营现金净流量对销售收入比率
-        self.rateofreturn = None # 资产的经营现金流量回报率
-        self.cf_nm = None # 经营现金净流量与净利润的比率
-        self.cf_liabilities = None # 经营现金净流量对负债比率
-        self.cashflowratio = None # 现金流量比率
-
-        self.price = float('NaN')
+        # fields in Fundamentals, kept by the table the stock is attached to, or by itself if not attached
+        self._fundamentals = None
+        self._values = {}
+
+        self._qfq = None # cached qfq_data, valid while latest factor is unchanged
+
+    @property
+    def fundamentals(self):
+        return self._fundamentals
+
+    def attach_fundamentals(self, table):
+        """read and write fields through table, fields set before are moved into it unless it has the stock"""
+        values, self._values = self._values, {}
+        if self.code not in table:
+            for name, value in values.items():
+                table.set(self.code, name, value)
+        self._fundamentals = table
+
+    def __getitem__(self, key):
+        if key in Fundamentals.TYPES:
+            return getattr(self, key)
+        return super(Stock, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        if key in Fundamentals.TYPES:
+            return setattr(self, key, value)
+        return super(Stock, self).__setitem__(key, value)
+
+    def __len__(self):
+        return len(self.FIELDS) + len(Fundamentals.FIELDS)
+
+    def __iter__(self):
+        return iter(self.FIELDS + tuple(Fundamentals.TYPES))
 
     def sanitize(self):
         super(Stock, self).sanitize()
 
     @property
     def qfq_data(self):
-        """warning: calculate qfq data is expensive"""
-        max_factor = self.hist_data.factor[0]
+        """forward adjusted data, cached and only recalculated when a new ex-rights event happens"""
+        cached = self._qfq
+        if cached is not None and cached.index.size == self.hist_len and \
+           cached.index[-1] == self.hist_data.index[-1] and cached.factor.iloc[-1] == self.hist_data.factor.iloc[-1]:
+            return cached
+        self._qfq = self._calc_qfq(self.hist_data)
+        return self._qfq
+
+    def _calc_qfq(self, hist_data):
+        max_factor = hist_data.factor.iloc[-1]
+
+        df = hist_data[['open', 'close', 'low', 'high']]
+        df = df.div(max_factor/hist_data.factor, axis='index')
+        df = df.join(hist_data[['volume', 'turnover', 'factor']])
+
+        assert df.index.size == hist_data.index.size
+        return df
 
-        df = self.hist_data[['open', 'close', 'low', 'high']]
-        df = df.div(max_factor/self.hist_data.factor, axis='index')
-        df = df.join(self.hist_data[['volume', 'turnover', 'factor']])
-        df.sort_index(ascending=False, inplace=True)
+    def update_qfq(self):
+        """calculate qfq data of appended days only, unless latest factor changed"""
+        cached = self._qfq
+        if cached is None or not cached.index.size or cached.index[-1] not in self.hist_data.index:
+            self._qfq = None
+            return
+        new_days = self.hist_len - 1 - self.hist_data.index.get_loc(cached.index[-1])
+        if cached.factor.iloc[-1] != self.hist_data.factor.iloc[-1] or cached.index.size + new_days != self.hist_len:
+            self._qfq = None  # ex-rights, all history needs to be adjusted again
+        elif new_days:
+            self._qfq = concat([cached, self._calc_qfq(self.last(new_days))])
 
-        assert df.index.size == self.hist_data.index.size
-        return df
+    @property
+    def cached_frames(self):
+        frames = super(Stock, self).cached_frames
+        if self._qfq is not None:
+            frames['qfq'] = self._qfq
+        return frames
+
+    def set_cached_frame(self, frame, df):
+        if frame == 'qfq':
+            self._qfq = self.canonical(df)
+        else:
+            super(Stock, self).set_cached_frame(frame, df)
+
+    def truncate_cache(self, start):
+        super(Stock, self).truncate_cache(start)
+        if self._qfq is not None:
+            self._qfq = self._qfq.iloc[:self._qfq.index.searchsorted(start)]
+
+    def update_cache(self, start=None):
+        super(Stock, self).update_cache(start)
+        self.update_qfq()
+
+    def invalidate_cache(self):
+        super(Stock, self).invalidate_cache()
+        self._qfq = None
 
     def get_hist_value(self, column, date):
         return self.hist_data[column][date]
@@ -196,6 +343,32 @@ class Stock(StockBase):
         return True
 
 
+class _FundamentalField(object):
+    """a field of Stock in Fundamentals, read and written through the table the stock is attached to"""
+    def __init__(self, name):
+        self.name = name
+        self.default = Fundamentals.default(name)
+
+    def __get__(self, stock, owner=None):
+        if stock is None:
+            return self
+        table = stock._fundamentals
+        if table is None:
+            return stock._values.get(self.name, self.default)
+        row = table._rows.get(stock.code)  # Fundamentals.get inlined, it is read in hot loops
+        return self.default if row is None else table._columns[self.name].item(row)
+
+    def __set__(self, stock, value):
+        if stock._fundamentals is None:
+            stock._values[self.name] = value
+        else:
+            stock._fundamentals.set(stock.code, self.name, value)
+
+
+for _name, _ in Fundamentals.FIELDS:
+    setattr(Stock, _name, _FundamentalField(_name))
+
+
 class Index(StockBase):
     index_name_map = {'000001': ('sh', '上证指数'),
                       '399001': ('sz', '深圳成指'),
@@ -205,6 +378,9 @@ class Index(StockBase):
                       '399005': ('cyb', '创业板')
                       }
 
+    FIELDS = StockBase.FIELDS + ('symbol', )
+    __slots__ = ('symbol', )
+
     def __init__(self, code=None, name=None, symbol=None):
         super(Index, self).__init__(code=code, name=name)
         self.symbol = symbol
@@ -0,0 +1,277 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import json
+import shutil
+import logging
+import numpy as np
+from pandas import DataFrame, DatetimeIndex, concat
+from bson.binary import Binary
+from pymongo import ReplaceOne, UpdateOne, DeleteMany
+
+
+class HistoryStore(object):
+    """
+    columnar storage of history DataFrames. Every column of a frame is kept as one contiguous typed array
+    in chronological order, the date index is kept as a datetime64[D] array.
+    frames are addressed by (collection, code, frame), collection is 'stocks' or 'indexes'.
+    """
+    def load(self, collection, code, frame='hist', last_n=None):
+        """load the whole frame, or only the last last_n days"""
+        raise NotImplementedError
+
+    def save(self, collection, code, df, frame='hist'):
+        raise NotImplementedError
+
+    def drop(self, collection, code=None, frame=None):
+        raise NotImplementedError
+
+    def frames(self, collection, code):
+        """names of all frames saved for code"""
+        raise NotImplementedError
+
+    def date_range(self, collection, code, frame='hist'):
+        """(days, first date, last date) of frame without loading its columns, None if it has no days"""
+        dates = self._dates(collection, code, frame)
+        if dates is None or not dates.size:
+            return None
+        return dates.size, dates[0], dates[-1]
+
+    def _dates(self, collection, code, frame):
+        df = self.load(collection, code, frame)
+        return None if df is None else df.index.values.astype('datetime64[D]')
+
+    def append(self, collection, code, df, frame='hist'):
+        """add days to frame, saved days from the first day of df on are replaced"""
+        old = self.load(collection, code, frame)
+        if old is None:
+            logging.warning('%s/%s: no %s saved to append to' % (collection, code, frame))
+            return
+        if df.index.size:
+            old = old[old.index < df.index.min()]
+        self.save(collection, code, concat([old, df]), frame)
+
+    def retain(self, collection, code, frames):
+        """drop all frames of code except frames"""
+        for frame in self.frames(collection, code):
+            if frame not in frames:
+                self.drop(collection, code, frame)
+
+    def write(self, ops):
+        """
+        apply a batch of writes, every op is ('save', collection, code, df, frame),
+        ('append', collection, code, df, frame) or ('retain', collection, code, frames)
+        """
+        for op in ops:
+            getattr(self, op[0])(*op[1:])
+
+    @staticmethod
+    def _to_arrays(df):
+        """split a DataFrame into (dates, {column: array}), ascending by date"""
+        df = df if df.index.is_monotonic_increasing else df.sort_index(ascending=True)
+        if isinstance(df.index, DatetimeIndex):
+            dates = df.index.values.astype('datetime64[D]')
+        else:
+            dates = np.array(df.index.map(str), dtype='datetime64[D]')  # legacy date strings
+        columns = {}
+        for col in df.columns:
+            if df[col].dtype.kind not in 'biuf':
+                logging.warning('column %s is not numeric, skip' % col)
+                continue
+            columns[col] = np.ascontiguousarray(df[col].values, dtype=np.float64)
+        return dates, columns
+
+    @staticmethod
+    def _last(dates, columns, last_n):
+        """the last last_n days of arrays, none for last_n 0"""
+        start = dates.size - min(max(last_n, 0), dates.size)
+        return dates[start:], {col: values[start:] for col, values in columns.items()}
+
+    @staticmethod
+    def _to_frame(dates, columns):
+        return DataFrame(columns, index=DatetimeIndex(dates), copy=False)
+
+
+class NpyHistoryStore(HistoryStore):
+    """one .npy file per column per stock, loaded memory-mapped"""
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, collection, code, frame):
+        return os.path.join(self.root, collection, code, frame)
+
+    def load(self, collection, code, frame='hist', last_n=None):
+        path = self._path(collection, code, frame)
+        meta_file = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_file):
+            return None
+        with open(meta_file) as f:
+            meta = json.load(f)
+        dates = np.load(os.path.join(path, 'index.npy'), mmap_mode='r')
+        columns = {}
+        for col in meta['columns']:
+            columns[col] = np.load(os.path.join(path, '%s.npy' % col), mmap_mode='r')
+            if columns[col].size != dates.size:
+                logging.warning('%s/%s: column %s is broken, drop it' % (collection, code, col))
+                return None
+        if last_n is not None:
+            # slices of memory-mapped arrays, days before are never read
+            dates, columns = self._last(dates, columns, last_n)
+        return self._to_frame(dates, columns)
+
+    def _dates(self, collection, code, frame):
+        path = os.path.join(self._path(collection, code, frame), 'index.npy')
+        return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+    def save(self, collection, code, df, frame='hist'):
+        path = self._path(collection, code, frame)
+        tmp_path, old_path = path + '.tmp', path + '.old'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        dates, columns = self._to_arrays(df)
+        np.save(os.path.join(tmp_path, 'index.npy'), dates)
+        for col, values in columns.items():
+            np.save(os.path.join(tmp_path, '%s.npy' % col), values)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'columns': list(columns.keys()), 'size': int(dates.size)}, f)
+
+        # swap directories, so readers never see a half written frame
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def drop(self, collection, code=None, frame=None):
+        if code and frame:
+            path = self._path(collection, code, frame)
+        else:
+            path = os.path.join(self.root, collection, code) if code else os.path.join(self.root, collection)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def frames(self, collection, code):
+        path = os.path.join(self.root, collection, code)
+        if not os.path.isdir(path):
+            return []
+        return [f for f in os.listdir(path) if not f.endswith('.tmp') and not f.endswith('.old')]
+
+
+class MongoHistoryStore(HistoryStore):
+    """
+    array blobs in mongodb, one document per frame. A frame is a list of chunks, appended days are
+    pushed as a new chunk instead of rewriting the whole frame, days of a chunk replace the same and
+    later days of chunks before it. Frames with too many chunks are merged again after appending.
+    """
+    max_chunks = 64
+
+    def __init__(self, db):
+        self.collection = db.hist
+        self.collection.create_index([('collection', 1), ('code', 1), ('frame', 1)], unique=True)
+
+    @staticmethod
+    def _key(collection, code, frame):
+        return {'collection': collection, 'code': code, 'frame': frame}
+
+    def _chunk(self, df):
+        dates, columns = self._to_arrays(df)
+        return {'index': Binary(dates.tobytes()),
+                'columns': {col: Binary(values.tobytes()) for col, values in columns.items()}}
+
+    def load(self, collection, code, frame='hist', last_n=None):
+        doc = self.collection.find_one(self._key(collection, code, frame))
+        if doc is None:
+            return None
+        chunks = doc['chunks'] if 'chunks' in doc else [doc]
+        chunk_dates = [np.frombuffer(c['index'], dtype='datetime64[D]') for c in chunks]
+        keep = self._kept(chunk_dates)
+
+        def merge(arrays):
+            return np.concatenate([a if k is None else a[k] for a, k in zip(arrays, keep)])
+
+        dates = merge(chunk_dates)
+        columns = {}
+        for col in chunks[0]['columns']:
+            if any(col not in c['columns'] for c in chunks):
+                logging.warning('%s/%s: column %s is broken, drop it' % (collection, code, col))
+                return None
+            columns[col] = merge([np.frombuffer(c['columns'][col], dtype=np.float64) for c in chunks])
+        if last_n is not None:
+            dates, columns = self._last(dates, columns, last_n)
+        return self._to_frame(dates, columns)
+
+    @staticmethod
+    def _kept(chunk_dates):
+        """
+        mask of days kept of every chunk, None for all. days from the first day of any later chunk on
+        were replaced.
+        """
+        keep, start = [None] * len(chunk_dates), None
+        for i in range(len(chunk_dates) - 1, -1, -1):
+            if start is not None:
+                keep[i] = chunk_dates[i] < start
+            if chunk_dates[i].size and (start is None or chunk_dates[i][0] < start):
+                start = chunk_dates[i][0]
+        return keep
+
+    def _dates(self, collection, code, frame):
+        doc = self.collection.find_one(self._key(collection, code, frame), {'index': 1, 'chunks.index': 1})
+        if doc is None:
+            return None
+        chunk_dates = [np.frombuffer(c['index'], dtype='datetime64[D]') for c in doc.get('chunks', [doc])]
+        return np.concatenate([d if k is None else d[k] for d, k in zip(chunk_dates, self._kept(chunk_dates))])
+
+    def _save_op(self, collection, code, df, frame):
+        doc = self._key(collection, code, frame)
+        doc['chunks'] = [self._chunk(df)]
+        return ReplaceOne(self._key(collection, code, frame), doc, upsert=True)
+
+    def _append_op(self, collection, code, df, frame):
+        return UpdateOne(self._key(collection, code, frame), {'$push': {'chunks': self._chunk(df)}})
+
+    def _retain_op(self, collection, code, frames):
+        return DeleteMany({'collection': collection, 'code': code, 'frame': {'$nin': list(frames)}})
+
+    def save(self, collection, code, df, frame='hist'):
+        self.write([('save', collection, code, df, frame)])
+
+    def append(self, collection, code, df, frame='hist'):
+        self.write([('append', collection, code, df, frame)])
+
+    def retain(self, collection, code, frames):
+        self.write([('retain', collection, code, frames)])
+
+    def write(self, ops):
+        requests = [getattr(self, '_%s_op' % op[0])(*op[1:]) for op in ops]
+        if requests:
+            self.collection.bulk_write(requests, ordered=True)
+        appended = [self._key(op[1], op[2], op[4]) for op in ops if op[0] == 'append']
+        if appended:
+            self._compact(appended)
+
+    def _compact(self, keys):
+        """merge chunks of frames in keys which have more than max_chunks"""
+        filter = {'$or': keys, 'chunks.%d' % self.max_chunks: {'$exists': True}}
+        for doc in self.collection.find(filter, {'collection': 1, 'code': 1, 'frame': 1}):
+            df = self.load(doc['collection'], doc['code'], doc['frame'])
+            if df is not None:
+                self.save(doc['collection'], doc['code'], df, doc['frame'])
+
+    def drop(self, collection, code=None, frame=None):
+        filter = {'collection': collection}
+        if code:
+            filter['code'] = code
+            if frame:
+                filter['frame'] = frame
+        self.collection.delete_many(filter)
+
+    def frames(self, collection, code):
+        return [doc['frame'] for doc in self.collection.find({'collection': collection, 'code': code}, {'frame': 1})]
+
+
+def create_history_store(kind, db=None, data_dir='data'):
+    if kind == 'npy':
+        return NpyHistoryStore(os.path.join(data_dir, 'hist'))
+    elif kind == 'mongo':
+        return MongoHistoryStore(db)
+    raise ValueError('unknown history store %s' % kind)
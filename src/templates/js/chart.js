@@ -0,0 +1,285 @@
+/*
+ * draw stock charts of the report in browser, the same as plots of plot.py. Data of a stock is written to
+ * data/<code>.js by StockPlot.save_chart(), and loaded by a script tag the first time the stock is shown.
+ */
+var rufengChart = (function () {
+    var UP = 'rgba(0, 128, 0, 0.75)', DOWN = 'rgba(255, 0, 0, 0.75)';
+    var charts = {};   // decoded data by code
+    var waiting = {};  // callbacks by code of data being loaded
+    var shown = null;  // code of the chart in #candlestick
+
+    /* values of a series saved as integer differences to the previous value, nulls are missing values */
+    function series(deltas, decimals, n) {
+        var values = new Float64Array(n), value = 0, scale = Math.pow(10, decimals);
+        for (var i = 0; i < n; i++) {
+            if (deltas[i] === null) {
+                values[i] = NaN;
+            } else {
+                value += deltas[i];
+                values[i] = value / scale;
+            }
+        }
+        return values;
+    }
+
+    function decode(chart) {
+        var n = chart.days.length, start = Date.parse(chart.start);
+        chart.size = n;
+        chart.dates = Array.prototype.map.call(series(chart.days, 0, n), function (day) {
+            return new Date(start + day * 86400000).toISOString().slice(0, 10);
+        });
+        for (var name in chart.decimals) {
+            if (chart[name]) {
+                chart[name] = series(chart[name], chart.decimals[name], n);
+            }
+        }
+        return chart;
+    }
+
+    function load(code, callback) {
+        if (charts[code]) {
+            return callback(charts[code]);
+        }
+        if (waiting[code]) {
+            return waiting[code].push(callback);
+        }
+        waiting[code] = [callback];
+        var script = document.createElement('script');
+        script.src = 'data/' + code + '.js';
+        script.charset = 'utf-8';
+        script.onerror = function () {
+            delete waiting[code];
+        };
+        document.head.appendChild(script);
+    }
+
+    /* called by data/<code>.js */
+    function loaded(chart) {
+        var callbacks = waiting[chart.code] || [];
+        charts[chart.code] = decode(chart);
+        delete waiting[chart.code];
+        callbacks.forEach(function (callback) {
+            callback(charts[chart.code]);
+        });
+    }
+
+    function extent(values) {
+        var min = Infinity, max = -Infinity;
+        for (var i = 0; i < values.length; i++) {
+            if (values[i] < min) min = values[i];
+            if (values[i] > max) max = values[i];
+        }
+        return [min, max];
+    }
+
+    function fixed(value, digits) {
+        return value === null || isNaN(value) ? 'nan' : value.toFixed(digits);
+    }
+
+    function draw(chart, width, height) {
+        var canvas = document.createElement('canvas'), ratio = window.devicePixelRatio || 1;
+        canvas.width = width * ratio;
+        canvas.height = height * ratio;
+        canvas.style.width = width + 'px';
+        canvas.style.height = height + 'px';
+        var ctx = canvas.getContext('2d');
+        ctx.scale(ratio, ratio);
+        ctx.fillStyle = 'white';
+        ctx.fillRect(0, 0, width, height);
+        ctx.font = '11px sans-serif';
+
+        var n = chart.size, left = 0.10 * width, right = 0.93 * width, top = 0.05 * height, bottom = 0.91 * height;
+        var unit = (right - left) / n, half = unit * 0.375, row = (bottom - top) / 6;
+        var ticks = [];
+        for (var t = 0; t < n; t += Math.max(Math.floor(n / 5), 5)) ticks.push(t);
+
+        function x(i) {
+            return left + (i + 0.5) * unit;
+        }
+
+        /* frame, grid and y ticks of a panel from y0 to y1 showing min to max, returns its y() */
+        function panel(y0, y1, min, max, format, label) {
+            var y = function (value) {
+                return y1 - (value - min) / (max - min || 1) * (y1 - y0);
+            };
+            ctx.strokeStyle = '#b0b0b0';
+            ctx.lineWidth = 0.5;
+            ctx.beginPath();
+            ticks.forEach(function (i) {
+                ctx.moveTo(x(i), y0);
+                ctx.lineTo(x(i), y1);
+            });
+            ctx.fillStyle = 'black';
+            ctx.textAlign = 'right';
+            ctx.textBaseline = 'middle';
+            for (var k = 1; k < 4; k++) {
+                var value = min + (max - min) * k / 4;
+                ctx.moveTo(left, y(value));
+                ctx.lineTo(right, y(value));
+                ctx.fillText(format(value), left - 4, y(value));
+            }
+            ctx.stroke();
+            ctx.strokeStyle = 'black';
+            ctx.strokeRect(left, y0, right - left, y1 - y0);
+            ctx.save();
+            ctx.translate(left - 0.06 * width, (y0 + y1) / 2);
+            ctx.rotate(-Math.PI / 2);
+            ctx.textAlign = 'center';
+            ctx.fillText(label, 0, 0);
+            ctx.restore();
+            return y;
+        }
+
+        function bars(y, bottoms, tops, opens, closes) {
+            for (var i = 0; i < n; i++) {
+                var y0 = y(bottoms[i]), y1 = y(tops[i]);
+                if (isNaN(y0) || isNaN(y1)) continue;
+                ctx.fillStyle = opens[i] < closes[i] ? UP : DOWN;
+                ctx.fillRect(x(i) - half, Math.min(y0, y1), 2 * half, Math.abs(y1 - y0) || 0.5);
+                ctx.strokeRect(x(i) - half, Math.min(y0, y1), 2 * half, Math.abs(y1 - y0));
+            }
+        }
+
+        function line(y, values, color) {
+            var drawing = false;
+            ctx.strokeStyle = color;
+            ctx.lineWidth = 1;
+            ctx.beginPath();
+            for (var i = 0; i < n; i++) {
+                if (isNaN(values[i])) {
+                    drawing = false;
+                } else if (drawing) {
+                    ctx.lineTo(x(i), y(values[i]));
+                } else {
+                    ctx.moveTo(x(i), y(values[i]));
+                    drawing = true;
+                }
+            }
+            ctx.stroke();
+        }
+
+        function annotate(text, i, y, color) {
+            var px = x(i), py = y(chart.open[i]), w = ctx.measureText(text).width + 6;
+            ctx.strokeStyle = 'black';
+            ctx.beginPath();
+            ctx.moveTo(px, py);
+            ctx.lineTo(px, py - 24);
+            ctx.stroke();
+            ctx.fillStyle = color;
+            ctx.fillRect(px - w / 2, py - 40, w, 16);
+            ctx.fillStyle = 'black';
+            ctx.textAlign = 'center';
+            ctx.textBaseline = 'middle';
+            ctx.fillText(text, px, py - 32);
+        }
+
+        // price, candles of high-low ranges and open-close bodies
+        var lows = extent(chart.low), highs = extent(chart.high);
+        var price = panel(top, top + 4 * row, lows[0] - lows[0] / 30, highs[1] + highs[1] / 30, function (v) {
+            return v.toFixed(2);
+        }, 'Price');
+        ctx.lineWidth = 0.5;
+        for (var i = 0; i < n; i++) {
+            ctx.strokeStyle = chart.open[i] < chart.close[i] ? UP : DOWN;
+            ctx.beginPath();
+            ctx.moveTo(x(i), price(chart.low[i]));
+            ctx.lineTo(x(i), price(chart.high[i]));
+            ctx.stroke();
+        }
+        ctx.strokeStyle = 'black';
+        bars(price, chart.open, chart.close, chart.open, chart.close);
+        [['ma5', 'blue'], ['ma10', '#bfbf00'], ['ma20', 'green'], ['ma30', 'red']].forEach(function (ma) {
+            if (chart[ma[0]]) line(price, chart[ma[0]], ma[1]);
+        });
+        chart.factors.forEach(function (factor) {
+            annotate('Q(f=' + factor[1].toFixed(3) + ')', factor[0], price, 'rgba(0, 0, 255, 0.3)');
+        });
+        chart.suspends.forEach(function (suspend) {
+            var i = suspend[0];
+            annotate('suspend ' + suspend[1] + 'days [' + chart.dates[i] + ' - ' + chart.dates[i + 1] + ']', i, price,
+                     'rgba(255, 255, 0, 0.3)');
+        });
+
+        var texts = [[chart.title, 'black'], ['pe=' + fixed(chart.pe || 0.0, 2), 'black'],
+                     ['nmc=' + fixed(chart.nmc ? chart.nmc / 10000 : 0.0, 2) + '亿', 'black'],
+                     ['mktcap=' + fixed(chart.mktcap ? chart.mktcap / 10000 : 0.0, 2) + '亿', 'black']];
+        if (!chart.qfq) {
+            texts.push(['EMA(5)', 'blue'], ['EMA(10)', '#bfbf00'], ['EMA(20)', 'green'], ['EMA(30)', 'red']);
+        }
+        ctx.textAlign = 'left';
+        ctx.textBaseline = 'top';
+        texts.forEach(function (text, k) {
+            ctx.fillStyle = text[1];
+            ctx.fillText(text[0], left + 0.025 * (right - left), top + (0.1 + k * 0.03) * 4 * row);
+        });
+        var last = n - 1;
+        ctx.fillStyle = 'black';
+        ctx.fillText(chart.dates[last] + ' O:' + fixed(chart.open[last], 2) + ' H:' + fixed(chart.high[last], 2) +
+                     ' L:' + fixed(chart.low[last], 2) + ' C:' + fixed(chart.close[last], 2) +
+                     ', V:' + fixed(chart.volume[last] * 1e-6, 1) + 'M Chg:' +
+                     (chart.close[last] >= chart.open[last] ? '+' : '') + fixed(chart.close[last] - chart.open[last], 2),
+                     (left + right) / 2, top + 0.1 * 4 * row);
+        if (chart.error) {
+            ctx.fillStyle = 'red';
+            ctx.fillText('(>_<)', right + 4, top + 3.8 * row);
+        }
+        ctx.font = '14px sans-serif';
+        ctx.textAlign = 'center';
+        ctx.textBaseline = 'bottom';
+        ctx.fillText(chart.qfq ? 'Forward Adjusted History Price' : 'History Price', (left + right) / 2, top - 4);
+        ctx.font = '11px sans-serif';
+
+        // volume and turnover bars
+        var volumes = extent(chart.volume), big = volumes[1] > 1e6;
+        var volume = panel(top + 4 * row, top + 5 * row, 0, volumes[1], function (v) {
+            return big ? (v * 1e-6).toFixed(1) + 'M' : (v * 1e-3).toFixed(1) + 'K';
+        }, 'Volume');
+        ctx.lineWidth = 0.5;
+        bars(volume, new Float64Array(n), chart.volume, chart.open, chart.close);
+        [['v_ma5', 'blue'], ['v_ma10', '#bfbf00'], ['v_ma20', 'red']].forEach(function (ma) {
+            if (chart[ma[0]]) line(volume, chart[ma[0]], ma[1]);
+        });
+        var turnover = panel(top + 5 * row, bottom, 0, extent(chart.turnover)[1], function (v) {
+            return v.toFixed(2) + '%';
+        }, 'Turnover');
+        ctx.lineWidth = 0.5;
+        bars(turnover, new Float64Array(n), chart.turnover, chart.open, chart.close);
+
+        ctx.fillStyle = 'black';
+        ctx.textAlign = 'center';
+        ctx.textBaseline = 'top';
+        ticks.forEach(function (i) {
+            ctx.fillText(chart.dates[i], x(i), bottom + 4);
+        });
+        ctx.fillText('Date', (left + right) / 2, bottom + 20);
+        return canvas;
+    }
+
+    /* show chart of code at the mouse like the plot images, loading its data if not yet */
+    function show(e, code) {
+        var box = document.getElementById('candlestick'), x = e.clientX;
+        box.style.left = x + 2 + 'px';
+        box.style.top = 0;
+        box.style.display = '';
+        if (shown === code) {
+            return;
+        }
+        shown = code;
+        box.innerHTML = '';
+        load(code, function (chart) {
+            if (shown === code) {
+                var width = Math.max(window.innerWidth - x - 20, 400);
+                box.appendChild(draw(chart, width, width / 2));
+            }
+        });
+    }
+
+    function hide() {
+        var box = document.getElementById('candlestick');
+        shown = null;
+        box.innerHTML = '';
+        box.style.display = 'none';
+    }
+
+    return {load: load, loaded: loaded, draw: draw, show: show, hide: hide};
+})();
@@ -0,0 +1,73 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+sys.path.insert(0, os.path.join(SRC, 'tushare'))
+from matplotlib.font_manager import FontProperties
+import plot
+from plot import StockPlot, PlotCache
+from analyzer import Analyzer, Result
+from tests.test_screen import make_market
+
+
+class PlotStocksTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        StockPlot.use_backend('Agg')
+        if not os.path.exists('simsun.ttc'):
+            plot.FontProperties = lambda fname=None: FontProperties()
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        stocks, index = make_market(count=3, days=60)
+        self.analyzer = Analyzer(stocks, {'000001': index}, {})
+        self.results = [Result(stock) for stock in stocks.values()]
+        self.built = []
+        self.data_of = StockPlot.data_of
+
+        def data_of(stock, index, *args):
+            self.built.append(stock.code)
+            return self.data_of(stock, index, *args)
+        StockPlot.data_of = staticmethod(data_of)
+
+    def tearDown(self):
+        StockPlot.data_of = staticmethod(self.data_of)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def plot(self, processes, cache):
+        img_dir = os.path.join(self.root, 'images%d' % processes)
+        self.built = []
+        self.analyzer._plot_stocks(img_dir, self.results, processes, cache)
+        self.assertEqual(sorted(os.listdir(img_dir)), sorted('%s.png' % r.stock.code for r in self.results))
+        return img_dir
+
+    def test_plot_in_processes(self):
+        cache = PlotCache(os.path.join(self.root, 'cache'))
+        self.plot(2, cache)
+        self.assertEqual(sorted(self.built), sorted(r.stock.code for r in self.results))  # data built once a plot
+        self.assertEqual(len(os.listdir(cache.cache_dir)), len(self.results))
+
+    def test_cached(self):
+        cache = PlotCache(os.path.join(self.root, 'cache'))
+        self.plot(0, cache)
+        self.assertEqual(len(self.built), len(self.results))
+        img_dir = self.plot(0, cache)
+        for result in self.results:
+            path = os.path.join(img_dir, '%s.png' % result.stock.code)
+            self.assertTrue(os.path.samefile(path, cache.path(StockPlot().key_of(self.data_of(result.stock,
+                                                                                     self.analyzer.indexs['000001'])))))
+
+    def test_without_cache(self):
+        self.plot(0, None)
+        self.assertEqual(len(self.built), len(self.results))
+
+
+if __name__ == '__main__':
+    unittest.main()
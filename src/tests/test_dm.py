@@ -0,0 +1,80 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pandas import DataFrame, bdate_range
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+sys.path.insert(0, os.path.join(SRC, 'tushare'))
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+from stock import Stock
+
+
+def make_hist(days, seed=0):
+    rng = np.random.RandomState(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.03, days)))
+    return DataFrame({'open': close, 'close': close, 'high': close * 1.01, 'low': close * 0.99,
+                      'volume': rng.uniform(1e5, 1e6, days), 'turnover': rng.uniform(0.5, 8, days),
+                      'factor': np.ones(days)}, index=bdate_range('2016-01-04', periods=days))
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class SavedIndicatorsTest(unittest.TestCase):
+    """indicators are saved along with picked history and loaded instead of calculated again"""
+    def setUp(self):
+        import dm
+        self.dm = dm
+        self.root = tempfile.mkdtemp()
+        self.manager = dm.DataManager('npy', self.root, db=mongomock.MongoClient().rufeng_finance)
+        self.local_dm = self.manager.local_dm
+        self.hist = make_hist(300)
+        stock = Stock('600000', 'pf')
+        stock.hist_data = self.hist.iloc[:250].copy()
+        self.local_dm.save_stock(stock)  # saved before indicators were saved with history
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def pick(self, stock, hist):
+        writer = self.dm.BulkWriter(self.local_dm, ready=None)
+        self.manager._merge_hist_and_save(stock, False, True, hist.drop(columns=['factor']), hist[['factor']], writer)
+        self.assertTrue(writer.close())
+
+    def test_indicators_saved_by_picking(self):
+        stock = self.local_dm.find_one_stock('600000')
+        stock.ma30  # calculated by analyzing, not saved
+        self.pick(stock, self.hist.iloc[249:])
+
+        frames = self.local_dm.hist_store.frames('stocks', '600000')
+        for name, window in Stock.saved_indicators:
+            self.assertIn('%s%d' % (name, window), frames)
+
+        loaded = self.local_dm.find_one_stock('600000')
+        full = Stock('600000')
+        full.hist_data = self.hist.copy()
+        for name, window in Stock.saved_indicators:
+            cached = loaded.indicators[(name, window)]
+            self.assertIs(loaded._get_indicator(name, window), cached)
+            self.assertTrue(cached.index.equals(full.hist_data.index))
+            np.testing.assert_allclose(cached.values, full._get_indicator(name, window).values)
+
+    def test_picked_again(self):
+        self.pick(self.local_dm.find_one_stock('600000'), self.hist.iloc[249:280])
+        self.pick(self.local_dm.find_one_stock('600000'), self.hist.iloc[279:])
+        loaded = self.local_dm.find_one_stock('600000')
+        full = Stock('600000')
+        full.hist_data = self.hist.copy()
+        np.testing.assert_allclose(loaded.indicators[('ma', 60)].values, full.ma60.values)
+
+
+if __name__ == '__main__':
+    unittest.main()
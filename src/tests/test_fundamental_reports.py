@@ -0,0 +1,75 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import unittest
+from threading import Lock
+import pandas as pd
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+sys.path.insert(0, os.path.join(SRC, 'tushare'))
+from tushare.stock import fundamental
+
+
+class ReportPagesTest(unittest.TestCase):
+    """pages fetched concurrently by _get_report_pages are merged in page order"""
+    cols = ['code', 'value']
+
+    def setUp(self):
+        self.get_report_page = fundamental._get_report_page
+        self.fetched = []
+        self.lock = Lock()
+
+    def tearDown(self):
+        fundamental._get_report_page = self.get_report_page
+
+    def fake_pages(self, count, shown=None, empty=()):
+        """count pages of 2 rows, the page bar shows shown pages after the current one, all if None"""
+        def get_page(url, cols, year, quarter, pageNo, retry_count, drop, strip_dash):
+            with self.lock:
+                self.fetched.append(pageNo)
+            if pageNo > count:
+                return None, None, pageNo
+            df = None if pageNo in empty else pd.DataFrame({'code': [pageNo * 10, pageNo * 10 + 1],
+                                                             'value': [1.0, 2.0]}, columns=cols)
+            last = count if shown is None else min(pageNo + shown, count)
+            return df, pageNo + 1 if pageNo < count else None, last
+        fundamental._get_report_page = get_page
+
+    def pages(self, workers=4):
+        return fundamental._get_report_pages('%s', self.cols, 2017, 3, workers=workers)
+
+    def expected_codes(self, pages):
+        return [code for page in pages for code in (page * 10, page * 10 + 1)]
+
+    def test_known_pages(self):
+        self.fake_pages(9)
+        df = self.pages()
+        self.assertEqual(list(df.code), self.expected_codes(range(1, 10)))
+        self.assertEqual(list(df.index), list(range(18)))
+        self.assertEqual(sorted(self.fetched), list(range(1, 10)))
+
+    def test_pages_found_on_the_way(self):
+        self.fake_pages(11, shown=2)
+        df = self.pages(workers=3)
+        self.assertEqual(list(df.code), self.expected_codes(range(1, 12)))
+        self.assertEqual(sorted(set(self.fetched)), sorted(self.fetched))  # no page twice
+
+    def test_one_page(self):
+        self.fake_pages(1)
+        self.assertEqual(list(self.pages().code), [10, 11])
+        self.assertEqual(self.fetched, [1])
+
+    def test_empty_pages(self):
+        self.fake_pages(3, empty=(2,))
+        self.assertEqual(list(self.pages().code), self.expected_codes([1, 3]))
+        self.fake_pages(1, empty=(1,))
+        df = self.pages()
+        self.assertEqual(list(df.columns), self.cols)
+        self.assertEqual(df.index.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
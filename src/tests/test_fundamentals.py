@@ -0,0 +1,66 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import math
+import unittest
+import numpy as np
+from pandas import DataFrame
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fundamentals import Fundamentals
+from stock import Stock
+
+
+class FundamentalsTest(unittest.TestCase):
+    def setUp(self):
+        self.table = Fundamentals((2017, 3))
+        df = DataFrame({'industry': [u'银行', None], 'pe': [6.5, None], 'timeToMarket': [19991110, None]},
+                       index=['600000', '600001'])
+        self.table.update(df)
+
+    def test_values(self):
+        self.assertEqual(self.table.get('600000', 'industry'), u'银行')
+        self.assertEqual(self.table.get('600000', 'pe'), 6.5)
+        self.assertTrue(math.isnan(self.table.get('600001', 'pe')))
+        self.assertEqual(self.table.get('600001', 'timeToMarket'), 0)
+        self.assertIsNone(self.table.get('600002', 'industry'))
+        np.testing.assert_array_equal(self.table.values('pe', ['600002', '600000']), [np.nan, 6.5])
+
+    def test_document_round_trip(self):
+        self.table.set('600002', 'nmc', 123.0)
+        doc = self.table.to_document()
+        self.assertEqual(doc['period'], '2017-3')
+        self.assertFalse(self.table.modified)
+        table = Fundamentals.from_document(doc)
+        self.assertEqual(table.period, (2017, 3))
+        self.assertEqual(table.codes, ['600000', '600001', '600002'])
+        self.assertFalse(table.modified)
+        for name, dtype in Fundamentals.FIELDS:
+            expected, loaded = self.table.values(name), table.values(name)
+            self.assertEqual(loaded.dtype, expected.dtype)
+            if dtype == 'O':
+                self.assertEqual(list(loaded), list(expected))
+            else:
+                np.testing.assert_array_equal(loaded, expected)
+
+    def test_modified(self):
+        self.table.to_document()
+        self.table.set('600000', 'pe', 7.0)
+        self.assertTrue(self.table.modified)
+
+    def test_attach(self):
+        stock = Stock('600003')
+        stock.pe = 20.0
+        stock.attach_fundamentals(self.table)
+        self.assertEqual(self.table.get('600003', 'pe'), 20.0)
+        self.assertEqual(Stock('600000').fundamentals, None)
+        stock = Stock('600000')
+        stock.pe = 1.0
+        stock.attach_fundamentals(self.table)  # the table has the stock already
+        self.assertEqual(stock.pe, 6.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pandas import DataFrame, bdate_range
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stock import Stock, Index
+from panel import MarketPanel
+
+
+class MarketPanelTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'panel')
+        self.dates = bdate_range('2016-01-04', periods=10)
+        self.index = Index('000001', 'sh')
+        self.index.hist_data = DataFrame({'close': np.arange(10.0)}, index=self.dates)
+        self.stocks = {}
+        for code, days in (('600000', self.dates), ('600001', self.dates[[2, 3, 6]]), ('600002', self.dates[:0])):
+            stock = Stock(code)
+            stock.hist_data = DataFrame({'close': np.arange(days.size) + 1.0, 'factor': np.ones(days.size)},
+                                        index=days)
+            self.stocks[code] = stock
+        self.stocks['600003'] = Stock('600003')  # no history at all
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_layout(self):
+        panel = MarketPanel.build(self.path, self.stocks, self.index)
+        self.assertEqual(panel.codes, sorted(self.stocks))
+        self.assertEqual(panel.shape, (4, 10))
+        self.assertEqual(panel.last_date, np.datetime64(self.dates[-1], 'D'))
+        self.assertEqual(panel['close'].dtype, np.float32)
+        np.testing.assert_array_equal(panel.series('600000', 'close'), np.arange(10) + 1)
+        # days of a stock are placed on the trading days of index, other days are NaN
+        close = panel.series('600001', 'close')
+        np.testing.assert_array_equal(close[[2, 3, 6]], [1, 2, 3])
+        self.assertTrue(np.isnan(np.delete(close, [2, 3, 6])).all())
+        # missing columns are NaN
+        self.assertTrue(np.isnan(panel.series('600000', 'volume')).all())
+
+    def test_has_data(self):
+        panel = MarketPanel.build(self.path, self.stocks, self.index)
+        self.assertTrue(panel.has_data('600000'))
+        self.assertTrue(panel.has_data('600001'))
+        self.assertFalse(panel.has_data('600002'))
+        self.assertFalse(panel.has_data('600003'))
+
+    def test_open(self):
+        MarketPanel.build(self.path, self.stocks, self.index)
+        panel = MarketPanel.open(self.path)
+        self.assertIn('600001', panel)
+        self.assertEqual(panel.row('600001'), 1)
+        np.testing.assert_array_equal(panel.series('600000', 'close'), np.arange(10) + 1)
+        self.assertIsNone(MarketPanel.open(os.path.join(self.root, 'none')))
+
+    def test_open_old_layout(self):
+        MarketPanel.build(self.path, self.stocks, self.index)
+        meta_file = os.path.join(self.path, 'meta.json')
+        with open(meta_file) as f:
+            meta = json.load(f)
+        meta['fields'] = meta['fields'][:-1]
+        with open(meta_file, 'w') as f:
+            json.dump(meta, f)
+        self.assertIsNone(MarketPanel.open(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from plot import PlotCache, StockPlot, candlestick, volume_bars
+from matplotlib.figure import Figure
+from matplotlib.colors import to_rgba
+
+
+class PlotCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = PlotCache(os.path.join(self.root, 'cache'), max_age_days=7)
+        self.report = os.path.join(self.root, 'report')
+        os.makedirs(self.report)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def plot(self, name, content):
+        path = os.path.join(self.report, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_miss(self):
+        self.assertFalse(self.cache.fetch('key', os.path.join(self.report, 'a.png')))
+        self.assertFalse(os.path.exists(os.path.join(self.report, 'a.png')))
+
+    def test_hit(self):
+        self.cache.put('key', self.plot('a.png', b'plot'))
+        dest = os.path.join(self.report, 'b.png')
+        self.assertTrue(self.cache.fetch('key', dest))
+        self.assertEqual(self.read(dest), b'plot')
+        # fetched again onto the same link
+        self.assertTrue(self.cache.fetch('key', dest))
+        self.assertEqual(sorted(os.listdir(self.report)), ['a.png', 'b.png'])
+
+    def test_replaced_report_keeps_cached_plot(self):
+        path = self.plot('a.png', b'old')
+        self.cache.put('old', path)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b'new')
+        os.replace(tmp, path)  # as StockPlot.plot() saves a plot
+        self.cache.put('new', path)
+        self.assertEqual(self.read(self.cache.path('old')), b'old')
+        self.assertEqual(self.read(self.cache.path('new')), b'new')
+
+    def test_prune(self):
+        self.cache.put('old', self.plot('a.png', b'old'))
+        self.cache.put('used', self.plot('b.png', b'used'))
+        expired = time.time() - 8 * 24 * 3600
+        for key in ('old', 'used'):
+            os.utime(self.cache.path(key), (expired, expired))
+        self.assertTrue(self.cache.fetch('used', os.path.join(self.report, 'c.png')))
+        self.cache.prune()
+        self.assertFalse(os.path.exists(self.cache.path('old')))
+        self.assertTrue(os.path.exists(self.cache.path('used')))
+
+
+class CandlestickTest(unittest.TestCase):
+    """days are up only when closed above open, like matplotlib.finance did"""
+    opens = [10.0, 10.0, 10.0]
+    closes = [11.0, 10.0, 9.0]  # up, doji, down
+
+    def colors(self, collection):
+        return [tuple(c) for c in collection.get_facecolor()]
+
+    def test_candlestick(self):
+        ax = Figure().add_subplot(1, 1, 1)
+        ranges, bars = candlestick(ax, self.opens, [12.0] * 3, [8.0] * 3, self.closes, colorup='g', colordown='r')
+        up, down = to_rgba('g', 0.75), to_rgba('r', 0.75)
+        self.assertEqual(self.colors(bars), [up, down, down])
+        self.assertEqual([tuple(c) for c in ranges.get_color()], [up, down, down])
+
+    def test_volume_bars(self):
+        ax = Figure().add_subplot(1, 1, 1)
+        bars = volume_bars(ax, self.opens, self.closes, [100, 200, 300], colorup='g', colordown='r')
+        self.assertEqual(self.colors(bars), [to_rgba('g'), to_rgba('r'), to_rgba('r')])
+
+
+class SaveChartTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_round_trip(self):
+        dates = np.array(['2017-03-01', '2017-03-02', '2017-03-03', '2017-03-06'], dtype='datetime64[D]')
+        close = np.array([10.0, 10.12, np.nan, 9.87])
+        data = {'stock': '600000', 'code': '600000', 'title': u'浦发银行', 'qfq': True, 'index_name': 'sh',
+                'pe': 6.5, 'nmc': 1.0, 'mktcap': 2.0, 'dates': dates, 'index_dates': dates,
+                'factor': np.array([1.0, 1.0, 1.0, 1.1]), 'close': close, 'volume': np.array([100, 90, 0, 120])}
+        path = os.path.join(self.root, '600000.js')
+        StockPlot.save_chart(data, path)
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        self.assertTrue(text.startswith('rufengChart.loaded(') and text.endswith(');\n'))
+        chart = json.loads(text[len('rufengChart.loaded('):-len(');\n')])
+        self.assertEqual(chart['title'], u'浦发银行')
+        self.assertEqual(chart['factors'], [[3, 1.1]])
+        self.assertEqual(chart['decimals'], {'close': 2, 'volume': 0})
+        self.assertEqual(chart['days'], [0, 1, 1, 3])
+        self.assertEqual(chart['close'], [1000, 12, None, -25])
+        self.assertEqual(chart['volume'], [100, -10, -90, 120])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pandas import DataFrame, bdate_range
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+sys.path.insert(0, os.path.join(SRC, 'tushare'))
+from stock import Stock, Index
+from panel import MarketPanel
+from analyzer import Analyzer
+
+
+def make_market(count=40, days=160, seed=0):
+    """stocks of various history lengths with suspensions and ex-rights, and index 000001"""
+    rng = np.random.RandomState(seed)
+    dates = bdate_range('2016-01-04', periods=days)
+    index = Index('000001', 'sh', u'上证指数')
+    index.hist_data = DataFrame({'open': np.ones(days), 'close': np.ones(days), 'high': np.ones(days),
+                                 'low': np.ones(days), 'ma10': np.ones(days), 'ma20': np.zeros(days)}, index=dates)
+    stocks = {}
+    for i in range(count):
+        code = '%06d' % (300000 + i if i % 3 == 0 else 600000 + i)
+        start = (days - 30) if i == 1 else rng.randint(0, days // 2) if i % 4 == 0 else 0
+        keep = np.ones(days - start, dtype=bool)
+        if i % 5 == 0:
+            keep[rng.randint(0, days - start - 20):][:10] = False
+        stock_dates = dates[start:][keep]
+        n = stock_dates.size
+        close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.03, n))), 2)
+        factor = np.ones(n)
+        if i % 2:
+            factor[n // 2:] = 1.3
+        df = DataFrame({'open': close, 'close': close, 'high': close * 1.01, 'low': close * 0.99,
+                        'volume': rng.uniform(1e5, 1e6, n), 'turnover': rng.uniform(0.5, 8, n),
+                        'p_change': np.r_[0, np.diff(close) / close[:-1] * 100], 'factor': factor},
+                       index=stock_dates)
+        for window in (5, 10, 20):
+            df['ma%d' % window] = df.close.rolling(window).mean().round(2)
+            df['v_ma%d' % window] = df.volume.rolling(window).mean().round(2)
+        stock = Stock(code, ('*ST' if i % 7 == 0 else '') + 'stock%d' % i)
+        stock.hist_data = df
+        stock.price = float(close[-1])
+        stock.nmc = rng.uniform(1e5, 5e6)
+        stock.mktcap = stock.nmc * 1.5
+        stock.pe = rng.uniform(5, 80)
+        stock.industry = 'industry%d' % (i % 3)
+        stock.area = 'area%d' % (i % 2)
+        stocks[code] = stock
+    return stocks, index
+
+
+class ScreenParityTest(unittest.TestCase):
+    """ScreenEngine gives every stock the same verdict and reason as Analyzer._analyze_single_stock"""
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.stocks, cls.index = make_market()
+        cls.panel = MarketPanel.build(os.path.join(cls.root, 'panel'), cls.stocks, cls.index)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def assertSameResults(self, config):
+        results = []
+        for panel in (None, self.panel):
+            analyzer = Analyzer(self.stocks, {'000001': self.index}, config, panel=panel)
+            analyzer.analyze()
+            results.append({r.stock.code: (r.status, r.log) for r in analyzer.good_stocks + analyzer.bad_stocks})
+        self.assertEqual(len(results[0]), len(self.stocks))
+        self.assertEqual(results[0], results[1])
+        return results[1]
+
+    def test_rules(self):
+        results = self.assertSameResults({
+            'exclude_gem': True, 'exclude_st': True, 'min_hist_data': 20, 'max_price': 12, 'max_pe': 70,
+            'min_turnover_avg': [[5, 2.0], [30, 3.0]], 'position': [[60, 0.5], [30, 0.01]],
+            'amp_scope': [[60, 0.05, 2.0]], 'raise_drop_scope': [[20, -0.3, 0.3]],
+            'min_change_count': [[30, 3, 2]], 'ma': [[5, 10, 2], [30, 60, 3]]})
+        self.assertTrue(any(status == 'GOOD' for status, log in results.values()))
+
+    def test_exclude_st_configured_false(self):
+        results = self.assertSameResults({'exclude_st': False})
+        self.assertEqual(results['600007'], ('BAD', 'Special Treatment (ST)'))
+
+    def test_raise_drop_scope_of_whole_history(self):
+        self.assertEqual(self.stocks['600001'].hist_len, 30)
+        results = self.assertSameResults({'raise_drop_scope': [[30, -0.01, 0.01]]})
+        self.assertEqual(results['600001'][0], 'GOOD')
+
+
+if __name__ == '__main__':
+    unittest.main()
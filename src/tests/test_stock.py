@@ -0,0 +1,71 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import unittest
+import numpy as np
+from pandas import DataFrame, bdate_range, concat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stock import Stock
+
+
+def make_hist(days, seed=0):
+    rng = np.random.RandomState(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.03, days)))
+    factor = np.ones(days)
+    factor[days // 2:] = 1.3
+    return DataFrame({'open': close, 'close': close, 'high': close * 1.01, 'low': close * 0.99,
+                      'volume': rng.uniform(1e5, 1e6, days), 'turnover': rng.uniform(0.5, 8, days),
+                      'factor': factor}, index=bdate_range('2016-01-04', periods=days))
+
+
+class IncrementalCacheTest(unittest.TestCase):
+    """caches extended by update_cache must equal the ones calculated from the whole history"""
+    windows = (30, 60)
+
+    def assertCacheEqual(self, stock):
+        full = Stock(stock.code)
+        full.hist_data = stock.hist_data.copy()
+        for window in self.windows:
+            self.assertTrue(stock.indicators[('ma', window)].index.equals(full.hist_data.index))
+            np.testing.assert_allclose(stock.indicators[('ma', window)].values, full._get_ma(window).values)
+        self.assertIsNotNone(stock._qfq)
+        self.assertTrue(stock._qfq.index.equals(full.qfq_data.index))
+        np.testing.assert_allclose(stock._qfq.values, full.qfq_data.values)
+
+    def merge(self, stock, hist):
+        """what LocalDataManager does with picked days when they are appended"""
+        old = stock.hist_data[~stock.hist_data.index.isin(hist.index)]
+        stock.hist_data = concat([old, hist])
+        stock.update_cache(hist.index[0])
+
+    def setUp(self):
+        self.hist = make_hist(300)
+        self.stock = Stock('600000')
+        self.stock.hist_data = self.hist.iloc[:250].copy()
+        for window in self.windows:
+            self.stock._get_ma(window)
+        self.stock.qfq_data
+
+    def test_append(self):
+        self.merge(self.stock, self.hist.iloc[250:])
+        self.assertCacheEqual(self.stock)
+
+    def test_overlap_day_changed(self):
+        # the last local day is picked again, with a different close than the one cached
+        hist = self.hist.iloc[249:].copy()
+        hist.iloc[0, hist.columns.get_loc('close')] *= 1.05
+        self.merge(self.stock, hist)
+        self.assertCacheEqual(self.stock)
+
+    def test_only_overlap_day_changed(self):
+        hist = self.hist.iloc[247:250].copy()
+        hist['close'] *= 0.95
+        self.merge(self.stock, hist)
+        self.assertCacheEqual(self.stock)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pandas import DataFrame, bdate_range
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from store import NpyHistoryStore
+
+
+class NpyHistoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = NpyHistoryStore(self.root)
+        self.df = DataFrame({'close': np.arange(100.0)}, index=bdate_range('2016-01-04', periods=100))
+        self.store.save('stocks', '600000', self.df.iloc[:50])
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_append_replaces_overlap_days(self):
+        df = self.df.copy()
+        df.iloc[48:50] += 1000
+        self.store.append('stocks', '600000', df.iloc[48:])
+        saved = self.store.load('stocks', '600000')
+        self.assertTrue(saved.index.equals(df.index))
+        np.testing.assert_array_equal(saved.values, df.values)
+
+    def test_load_last_n(self):
+        self.assertEqual(self.store.load('stocks', '600000', last_n=0).index.size, 0)
+        self.assertEqual(self.store.load('stocks', '600000', last_n=3).index[-1], self.df.index[49])
+        self.assertEqual(self.store.load('stocks', '600000', last_n=1000).index.size, 50)
+
+    def test_date_range(self):
+        self.store.append('stocks', '600000', self.df.iloc[40:60])
+        days, first, last = self.store.date_range('stocks', '600000')
+        self.assertEqual((days, first, last), (60, np.datetime64(self.df.index[0], 'D'),
+                                               np.datetime64(self.df.index[59], 'D')))
+        self.assertIsNone(self.store.date_range('stocks', '600001'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# coding=utf-8
+__author__ = 'Du, Changbin <changbin.du@gmail.com>'
+
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import util
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_strQ2B(self):
+        self.assertEqual(util.strQ2B(u'ＡＢＣ１２３　（＊ＳＴ）'), u'ABC123 (*ST)')
+        self.assertEqual(util.strQ2B(u'银行ab 1'), u'银行ab 1')
+
+    def test_normalize_str(self):
+        self.assertEqual(util.normalize(u'Ｓ＊ＳＴ　前锋 '), u'S*ST前锋')
+        self.assertEqual(util.normalize(1.5), 1.5)
+        self.assertIsNone(util.normalize(None))
+
+    def test_normalize_series(self):
+        series = pd.Series([u'银行　', None, u'ＩＴ 设备', 3, u'银行　', np.nan], index=list('abcdef'), name='industry')
+        result = util.normalize(series)
+        self.assertEqual(result.name, 'industry')
+        self.assertTrue(result.index.equals(series.index))
+        self.assertEqual(list(result.iloc[:5]), [u'银行', None, u'IT设备', 3, u'银行'])
+        self.assertTrue(np.isnan(result.iloc[5]))
+        self.assertEqual(series.iloc[0], u'银行　')  # not modified in place
+
+    def test_normalize_other_series(self):
+        numbers = pd.Series([1.0, 2.0])
+        self.assertIs(util.normalize(numbers), numbers)
+        nothing = pd.Series([None, None], dtype=object)
+        self.assertIs(util.normalize(nothing), nothing)
+
+
+if __name__ == '__main__':
+    unittest.main()
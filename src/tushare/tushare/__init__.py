@@ -71,6 +71,7 @@ from tushare.stock.billboard import (top_list, cap_tops, broker_tops,
 for utils
 """
 from tushare.util.dateu import (trade_cal, is_holiday)
+from tushare.util.netbase import (set_server, get_server, set_pool, get_pool)
 
 
 """
@@ -17,9 +17,10 @@ import numpy as np
 from tushare.fund import cons as ct
 from tushare.util import dateu as du
 try:
-    from urllib.request import urlopen, Request
+    from urllib.request import Request
 except ImportError:
-    from urllib2 import urlopen, Request
+    from urllib2 import Request
+from tushare.util.netbase import urlopen
 
 
 def get_nav_open(fund_type='all'):
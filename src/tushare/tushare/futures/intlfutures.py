@@ -14,9 +14,10 @@ import pandas as pd
 from tushare.futures import cons as ct
 
 try:
-    from urllib.request import urlopen, Request
+    from urllib.request import Request
 except ImportError:
-    from urllib2 import urlopen, Request
+    from urllib2 import Request
+from tushare.util.netbase import urlopen
     
     
 def get_intlfuture(symbols=None):
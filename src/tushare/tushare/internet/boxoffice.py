@@ -10,9 +10,10 @@ import pandas as pd
 from tushare.stock import cons as ct
 from tushare.util import dateu as du
 try:
-    from urllib.request import urlopen, Request
+    from urllib.request import Request
 except ImportError:
-    from urllib2 import urlopen, Request
+    from urllib2 import Request
+from tushare.util.netbase import urlopen
 import time
 import json
 
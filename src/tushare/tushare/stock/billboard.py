@@ -20,9 +20,10 @@ from lxml import etree
 from tushare.util import dateu as du
 from tushare.stock import ref_vars as rv
 try:
-    from urllib.request import urlopen, Request
+    from urllib.request import Request
 except ImportError:
-    from urllib2 import urlopen, Request
+    from urllib2 import Request
+from tushare.util.netbase import urlopen
 
 
 def top_list(date = None, retry_count=3, pause=0.001):
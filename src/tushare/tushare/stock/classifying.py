@@ -19,9 +19,10 @@ import tushare.stock.fundamental as fd
 from tushare.util.netbase import Client
 
 try:
-    from urllib.request import urlopen, Request
+    from urllib.request import Request
 except ImportError:
-    from urllib2 import urlopen, Request
+    from urllib2 import Request
+from tushare.util.netbase import urlopen
 
 
 def get_industry_classified(standard='sina'):
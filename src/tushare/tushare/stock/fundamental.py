@@ -12,12 +12,14 @@ import lxml.html
 from lxml import etree
 import re
 import time
+from multiprocessing.pool import ThreadPool
 from pandas.compat import StringIO
 from socket import timeout
 try:
-    from urllib.request import urlopen, Request, URLError, HTTPError
+    from urllib.request import Request, URLError, HTTPError
 except ImportError:
-    from urllib2 import urlopen, Request, URLError, HTTPError
+    from urllib2 import Request, URLError, HTTPError
+from tushare.util.netbase import urlopen
 
 def get_stock_basics(retry_count=3):
     """
@@ -74,7 +76,7 @@ def get_last_report_period():
 
     return int(year), int(quarter)
 
-def get_report_data(year, quarter, retry_count=3):
+def get_report_data(year, quarter, retry_count=3, workers=4):
     """
         获取业绩报表数据
     Parameters
@@ -82,6 +84,7 @@ def get_report_data(year, quarter, retry_count=3):
     year:int 年度 e.g:2014
     quarter:int 季度 :1、2、3、4，只能输入这4个季度
        说明：由于是从网站获取的数据，需要一页页抓取，速度取决于您当前网络速度
+    workers:int 同时抓取的页数
 
     Return
     --------
@@ -100,7 +103,7 @@ def get_report_data(year, quarter, retry_count=3):
     """
     if ct._check_input(year,quarter) is True:
         ct._write_head()
-        df =  _get_report_data(year, quarter, 1, pd.DataFrame(), retry_count=retry_count)
+        df = _get_report_pages(ct.REPORT_URL, ct.REPORT_COLS, year, quarter, retry_count, workers, drop=11)
         if df is not None:
             # df = df.drop_duplicates('code')
             df['code'] = df['code'].map(lambda x:str(x).zfill(6))
@@ -108,15 +111,19 @@ def get_report_data(year, quarter, retry_count=3):
         return df
 
 
-def _get_report_data(year, quarter, pageNo, dataArr, retry_count=3):
+def _get_report_page(url, cols, year, quarter, pageNo, retry_count, drop, strip_dash):
+    """
+        获取一页报表数据，返回(DataFrame或None, 下一页页码或None, 页码栏中最大的页码)
+    """
     for _ in range(retry_count):
         try:
             ct._write_console()
-            request = Request(ct.REPORT_URL%(ct.P_TYPE['http'], ct.DOMAINS['vsf'], ct.PAGES['fd'],
-                             year, quarter, pageNo, ct.PAGE_NUM[1]))
+            request = Request(url%(ct.P_TYPE['http'], ct.DOMAINS['vsf'], ct.PAGES['fd'],
+                                   year, quarter, pageNo, ct.PAGE_NUM[1]))
             text = urlopen(request, timeout=ct.DEFAULT_TIMEOUT).read()
             text = text.decode('GBK')
-            text = text.replace('--', '')
+            if strip_dash:
+                text = text.replace('--', '')
             if not text:
                 raise URLError('no data received')
             html = lxml.html.parse(StringIO(text))
@@ -125,24 +132,54 @@ def _get_report_data(year, quarter, pageNo, dataArr, retry_count=3):
                 sarr = [etree.tostring(node).decode('utf-8') for node in res]
             else:
                 sarr = [etree.tostring(node) for node in res]
-            sarr = ''.join(sarr)
-            sarr = '<table>%s</table>'%sarr
-            df = pd.read_html(sarr)[0]
-            df = df.drop(11, axis=1)
-            df.columns = ct.REPORT_COLS
-            dataArr = dataArr.append(df, ignore_index=True)
+            df = None
+            if len(sarr) > 0:
+                sarr = '<table>%s</table>'%''.join(sarr)
+                df = pd.read_html(sarr)[0]
+                if drop is not None:
+                    df = df.drop(drop, axis=1)
+                df.columns = cols
+            pages = [int(n) for onclick in html.xpath('//div[@class=\"pages\"]/a/@onclick')
+                     for n in re.findall(r'\d+', onclick)]
             nextPage = html.xpath('//div[@class=\"pages\"]/a[last()]/@onclick')
-            if len(nextPage)>0:
-                pageNo = re.findall(r'\d+', nextPage[0])[0]
-                return _get_report_data(year, quarter, pageNo, dataArr)
-            else:
-                return dataArr
+            nextPage = int(re.findall(r'\d+', nextPage[0])[0]) if len(nextPage)>0 else None
+            if nextPage is not None and nextPage <= pageNo:
+                nextPage = None
+            return df, nextPage, max(pages + [pageNo])
         except (URLError, HTTPError, timeout) as e:
             time.sleep(ct.DEFAULT_TIMEOUT)
     raise IOError(ct.NETWORK_URL_ERROR_MSG)
 
 
-def get_profit_data(year, quarter, retry_count=3):
+def _get_report_pages(url, cols, year, quarter, retry_count=3, workers=4, drop=None, strip_dash=True):
+    """
+        获取分页的报表数据：先取第一页，得到页码栏中的页码后以workers个线程并发抓取其余各页，
+        页码未知时每批预取workers页直到没有下一页，各页单独重试，最后一次合并
+    """
+    fetch = lambda pageNo: _get_report_page(url, cols, year, quarter, pageNo, retry_count, drop, strip_dash)
+    df, nextPage, lastPage = fetch(1)
+    dataArr = [df]
+    if nextPage is not None:
+        pool = ThreadPool(workers)
+        try:
+            while nextPage is not None:
+                pageNos = list(range(nextPage, max(lastPage, nextPage + workers - 1) + 1))
+                nextPage = None
+                for pageNo, (df, nextNo, lastNo) in zip(pageNos, pool.map(fetch, pageNos)):
+                    dataArr.append(df)
+                    lastPage = max(lastPage, lastNo)
+                    if nextNo is None:
+                        break
+                    nextPage = nextNo if pageNo == pageNos[-1] else None
+        finally:
+            pool.close()
+    dataArr = [df for df in dataArr if df is not None]
+    if len(dataArr) == 0:
+        return pd.DataFrame(columns=cols)
+    return pd.concat(dataArr, ignore_index=True)
+
+
+def get_profit_data(year, quarter, retry_count=3, workers=4):
     """
         获取盈利能力数据
     Parameters
@@ -150,6 +187,7 @@ def get_profit_data(year, quarter, retry_count=3):
     year:int 年度 e.g:2014
     quarter:int 季度 :1、2、3、4，只能输入这4个季度
        说明：由于是从网站获取的数据，需要一页页抓取，速度取决于您当前网络速度
+    workers:int 同时抓取的页数
 
     Return
     --------
@@ -166,7 +204,7 @@ def get_profit_data(year, quarter, retry_count=3):
     """
     if ct._check_input(year, quarter) is True:
         ct._write_head()
-        data =  _get_profit_data(year, quarter, 1, pd.DataFrame(), retry_count=retry_count)
+        data = _get_report_pages(ct.PROFIT_URL, ct.PROFIT_COLS, year, quarter, retry_count, workers)
         if data is not None:
 #             data = data.drop_duplicates('code')
             data['code'] = data['code'].map(lambda x:str(x).zfill(6))
@@ -174,41 +212,7 @@ def get_profit_data(year, quarter, retry_count=3):
         return data
 
 
-def _get_profit_data(year, quarter, pageNo, dataArr, retry_count=3):
-    for _ in range(retry_count):
-        try:
-            ct._write_console()
-            request = Request(ct.PROFIT_URL%(ct.P_TYPE['http'], ct.DOMAINS['vsf'],
-                                                  ct.PAGES['fd'], year,
-                                                  quarter, pageNo, ct.PAGE_NUM[1]))
-            text = urlopen(request, timeout=ct.DEFAULT_TIMEOUT).read()
-            text = text.decode('GBK')
-            text = text.replace('--', '')
-            if not text:
-                raise URLError('no data received')
-            html = lxml.html.parse(StringIO(text))
-            res = html.xpath("//table[@class=\"list_table\"]/tr")
-            if ct.PY3:
-                sarr = [etree.tostring(node).decode('utf-8') for node in res]
-            else:
-                sarr = [etree.tostring(node) for node in res]
-            sarr = ''.join(sarr)
-            sarr = '<table>%s</table>'%sarr
-            df = pd.read_html(sarr)[0]
-            df.columns=ct.PROFIT_COLS
-            dataArr = dataArr.append(df, ignore_index=True)
-            nextPage = html.xpath('//div[@class=\"pages\"]/a[last()]/@onclick')
-            if len(nextPage)>0:
-                pageNo = re.findall(r'\d+', nextPage[0])[0]
-                return _get_profit_data(year, quarter, pageNo, dataArr)
-            else:
-                return dataArr
-        except (URLError, HTTPError, timeout) as e:
-            time.sleep(ct.DEFAULT_TIMEOUT)
-    raise IOError(ct.NETWORK_URL_ERROR_MSG)
-
-
-def get_operation_data(year, quarter, retry_count=3):
+def get_operation_data(year, quarter, retry_count=3, workers=4):
     """
         获取营运能力数据
     Parameters
@@ -216,6 +220,7 @@ def get_operation_data(year, quarter, retry_count=3):
     year:int 年度 e.g:2014
     quarter:int 季度 :1、2、3、4，只能输入这4个季度
        说明：由于是从网站获取的数据，需要一页页抓取，速度取决于您当前网络速度
+    workers:int 同时抓取的页数
 
     Return
     --------
@@ -231,7 +236,7 @@ def get_operation_data(year, quarter, retry_count=3):
     """
     if ct._check_input(year, quarter) is True:
         ct._write_head()
-        data =  _get_operation_data(year, quarter, 1, pd.DataFrame(), retry_count=retry_count)
+        data = _get_report_pages(ct.OPERATION_URL, ct.OPERATION_COLS, year, quarter, retry_count, workers)
         if data is not None:
 #             data = data.drop_duplicates('code')
             data['code'] = data['code'].map(lambda x:str(x).zfill(6))
@@ -239,41 +244,7 @@ def get_operation_data(year, quarter, retry_count=3):
         return data
 
 
-def _get_operation_data(year, quarter, pageNo, dataArr, retry_count=3):
-    for _ in range(retry_count):
-        try:
-            ct._write_console()
-            request = Request(ct.OPERATION_URL%(ct.P_TYPE['http'], ct.DOMAINS['vsf'],
-                                                     ct.PAGES['fd'], year,
-                                                     quarter, pageNo, ct.PAGE_NUM[1]))
-            text = urlopen(request, timeout=ct.DEFAULT_TIMEOUT).read()
-            text = text.decode('GBK')
-            text = text.replace('--', '')
-            if not text:
-                raise URLError('no data received')
-            html = lxml.html.parse(StringIO(text))
-            res = html.xpath("//table[@class=\"list_table\"]/tr")
-            if ct.PY3:
-                sarr = [etree.tostring(node).decode('utf-8') for node in res]
-            else:
-                sarr = [etree.tostring(node) for node in res]
-            sarr = ''.join(sarr)
-            sarr = '<table>%s</table>'%sarr
-            df = pd.read_html(sarr)[0]
-            df.columns=ct.OPERATION_COLS
-            dataArr = dataArr.append(df, ignore_index=True)
-            nextPage = html.xpath('//div[@class=\"pages\"]/a[last()]/@onclick')
-            if len(nextPage)>0:
-                pageNo = re.findall(r'\d+', nextPage[0])[0]
-                return _get_operation_data(year, quarter, pageNo, dataArr)
-            else:
-                return dataArr
-        except (URLError, HTTPError, timeout) as e:
-            time.sleep(ct.DEFAULT_TIMEOUT)
-    raise IOError(ct.NETWORK_URL_ERROR_MSG)
-
-
-def get_growth_data(year, quarter, retry_count=3):
+def get_growth_data(year, quarter, retry_count=3, workers=4):
     """
         获取成长能力数据
     Parameters
@@ -281,6 +252,7 @@ def get_growth_data(year, quarter, retry_count=3):
     year:int 年度 e.g:2014
     quarter:int 季度 :1、2、3、4，只能输入这4个季度
        说明：由于是从网站获取的数据，需要一页页抓取，速度取决于您当前网络速度
+    workers:int 同时抓取的页数
 
     Return
     --------
@@ -296,7 +268,7 @@ def get_growth_data(year, quarter, retry_count=3):
     """
     if ct._check_input(year, quarter) is True:
         ct._write_head()
-        data =  _get_growth_data(year, quarter, 1, pd.DataFrame(), retry_count=retry_count)
+        data = _get_report_pages(ct.GROWTH_URL, ct.GROWTH_COLS, year, quarter, retry_count, workers)
         if data is not None:
 #             data = data.drop_duplicates('code')
             data['code'] = data['code'].map(lambda x:str(x).zfill(6))
@@ -304,41 +276,7 @@ def get_growth_data(year, quarter, retry_count=3):
         return data
 
 
-def _get_growth_data(year, quarter, pageNo, dataArr, retry_count=3):
-    for _ in range(retry_count):
-        try:
-            ct._write_console()
-            request = Request(ct.GROWTH_URL%(ct.P_TYPE['http'], ct.DOMAINS['vsf'],
-                                                  ct.PAGES['fd'], year,
-                                                  quarter, pageNo, ct.PAGE_NUM[1]))
-            text = urlopen(request, timeout=ct.DEFAULT_TIMEOUT).read()
-            text = text.decode('GBK')
-            text = text.replace('--', '')
-            if not text:
-                raise URLError('no data received')
-            html = lxml.html.parse(StringIO(text))
-            res = html.xpath("//table[@class=\"list_table\"]/tr")
-            if ct.PY3:
-                sarr = [etree.tostring(node).decode('utf-8') for node in res]
-            else:
-                sarr = [etree.tostring(node) for node in res]
-            sarr = ''.join(sarr)
-            sarr = '<table>%s</table>'%sarr
-            df = pd.read_html(sarr)[0]
-            df.columns=ct.GROWTH_COLS
-            dataArr = dataArr.append(df, ignore_index=True)
-            nextPage = html.xpath('//div[@class=\"pages\"]/a[last()]/@onclick')
-            if len(nextPage)>0:
-                pageNo = re.findall(r'\d+', nextPage[0])[0]
-                return _get_growth_data(year, quarter, pageNo, dataArr)
-            else:
-                return dataArr
-        except (URLError, HTTPError, timeout) as e:
-            time.sleep(ct.DEFAULT_TIMEOUT)
-    raise IOError(ct.NETWORK_URL_ERROR_MSG)
-
-
-def get_debtpaying_data(year, quarter, retry_count=3):
+def get_debtpaying_data(year, quarter, retry_count=3, workers=4):
     """
         获取偿债能力数据
     Parameters
@@ -346,6 +284,7 @@ def get_debtpaying_data(year, quarter, retry_count=3):
     year:int 年度 e.g:2014
     quarter:int 季度 :1、2、3、4，只能输入这4个季度
        说明：由于是从网站获取的数据，需要一页页抓取，速度取决于您当前网络速度
+    workers:int 同时抓取的页数
 
     Return
     --------
@@ -361,7 +300,7 @@ def get_debtpaying_data(year, quarter, retry_count=3):
     """
     if ct._check_input(year, quarter) is True:
         ct._write_head()
-        df =  _get_debtpaying_data(year, quarter, 1, pd.DataFrame(), retry_count=retry_count)
+        df = _get_report_pages(ct.DEBTPAYING_URL, ct.DEBTPAYING_COLS, year, quarter, retry_count, workers, strip_dash=False)
         if df is not None:
 #             df = df.drop_duplicates('code')
             df['code'] = df['code'].map(lambda x:str(x).zfill(6))
@@ -369,40 +308,7 @@ def get_debtpaying_data(year, quarter, retry_count=3):
         return df
 
 
-def _get_debtpaying_data(year, quarter, pageNo, dataArr, retry_count=3):
-    for _ in range(retry_count):
-        try:
-            ct._write_console()
-            request = Request(ct.DEBTPAYING_URL%(ct.P_TYPE['http'], ct.DOMAINS['vsf'],
-                                                      ct.PAGES['fd'], year,
-                                                      quarter, pageNo, ct.PAGE_NUM[1]))
-            text = urlopen(request, timeout=ct.DEFAULT_TIMEOUT).read()
-            text = text.decode('GBK')
-            if not text:
-                raise URLError('no data received')
-            html = lxml.html.parse(StringIO(text))
-            res = html.xpath("//table[@class=\"list_table\"]/tr")
-            if ct.PY3:
-                sarr = [etree.tostring(node).decode('utf-8') for node in res]
-            else:
-                sarr = [etree.tostring(node) for node in res]
-            sarr = ''.join(sarr)
-            sarr = '<table>%s</table>'%sarr
-            df = pd.read_html(sarr)[0]
-            df.columns = ct.DEBTPAYING_COLS
-            dataArr = dataArr.append(df, ignore_index=True)
-            nextPage = html.xpath('//div[@class=\"pages\"]/a[last()]/@onclick')
-            if len(nextPage)>0:
-                pageNo = re.findall(r'\d+', nextPage[0])[0]
-                return _get_debtpaying_data(year, quarter, pageNo, dataArr)
-            else:
-                return dataArr
-        except (URLError, HTTPError, timeout) as e:
-            time.sleep(ct.DEFAULT_TIMEOUT)
-    raise IOError(ct.NETWORK_URL_ERROR_MSG)
-
-
-def get_cashflow_data(year, quarter, retry_count=3):
+def get_cashflow_data(year, quarter, retry_count=3, workers=4):
     """
         获取现金流量数据
     Parameters
@@ -410,6 +316,7 @@ def get_cashflow_data(year, quarter, retry_count=3):
     year:int 年度 e.g:2014
     quarter:int 季度 :1、2、3、4，只能输入这4个季度
        说明：由于是从网站获取的数据，需要一页页抓取，速度取决于您当前网络速度
+    workers:int 同时抓取的页数
 
     Return
     --------
@@ -424,7 +331,7 @@ def get_cashflow_data(year, quarter, retry_count=3):
     """
     if ct._check_input(year, quarter) is True:
         ct._write_head()
-        df =  _get_cashflow_data(year, quarter, 1, pd.DataFrame(), retry_count=retry_count)
+        df = _get_report_pages(ct.CASHFLOW_URL, ct.CASHFLOW_COLS, year, quarter, retry_count, workers)
         if df is not None:
 #             df = df.drop_duplicates('code')
             df['code'] = df['code'].map(lambda x:str(x).zfill(6))
@@ -432,40 +339,6 @@ def get_cashflow_data(year, quarter, retry_count=3):
         return df
 
 
-def _get_cashflow_data(year, quarter, pageNo, dataArr, retry_count=3):
-    for _ in range(retry_count):
-        try:
-            ct._write_console()
-            request = Request(ct.CASHFLOW_URL%(ct.P_TYPE['http'], ct.DOMAINS['vsf'],
-                                                    ct.PAGES['fd'], year,
-                                                    quarter, pageNo, ct.PAGE_NUM[1]))
-            text = urlopen(request, timeout=ct.DEFAULT_TIMEOUT).read()
-            text = text.decode('GBK')
-            text = text.replace('--', '')
-            if not text:
-                raise URLError('no data received')
-            html = lxml.html.parse(StringIO(text))
-            res = html.xpath("//table[@class=\"list_table\"]/tr")
-            if ct.PY3:
-                sarr = [etree.tostring(node).decode('utf-8') for node in res]
-            else:
-                sarr = [etree.tostring(node) for node in res]
-            sarr = ''.join(sarr)
-            sarr = '<table>%s</table>'%sarr
-            df = pd.read_html(sarr)[0]
-            df.columns = ct.CASHFLOW_COLS
-            dataArr = dataArr.append(df, ignore_index=True)
-            nextPage = html.xpath('//div[@class=\"pages\"]/a[last()]/@onclick')
-            if len(nextPage)>0:
-                pageNo = re.findall(r'\d+', nextPage[0])[0]
-                return _get_cashflow_data(year, quarter, pageNo, dataArr)
-            else:
-                return dataArr
-        except (URLError, HTTPError, timeout) as e:
-            time.sleep(ct.DEFAULT_TIMEOUT)
-    raise IOError(ct.NETWORK_URL_ERROR_MSG)
-
-
 def _data_path():
     import os
     import inspect
@@ -15,9 +15,10 @@ import json
 from tushare.stock import macro_vars as vs
 from tushare.stock import cons as ct
 try:
-    from urllib.request import urlopen, Request
+    from urllib.request import Request
 except ImportError:
-    from urllib2 import urlopen, Request
+    from urllib2 import Request
+from tushare.util.netbase import urlopen
 
 
 def get_gdp_year():
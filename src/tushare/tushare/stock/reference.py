@@ -21,9 +21,10 @@ from tushare.util import dateu as du
 from tushare.util.netbase import Client
 
 try:
-    from urllib.request import urlopen, Request
+    from urllib.request import Request
 except ImportError:
-    from urllib2 import urlopen, Request
+    from urllib2 import Request
+from tushare.util.netbase import urlopen
 
 
 def profit_data(year=2015, top=25, 
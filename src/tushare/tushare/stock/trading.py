@@ -20,9 +20,10 @@ from pandas.compat import StringIO
 from tushare.util import dateu as du
 from socket import timeout
 try:
-    from urllib.request import urlopen, Request, URLError, HTTPError
+    from urllib.request import Request, URLError, HTTPError
 except ImportError:
-    from urllib2 import urlopen, Request, URLError, HTTPError
+    from urllib2 import Request, URLError, HTTPError
+from tushare.util.netbase import urlopen
 
 
 def get_hist_data(code=None, start=None, end=None,
@@ -49,57 +50,66 @@ def get_hist_data(code=None, start=None, end=None,
       DataFrame
           属性:日期 ，开盘价， 最高价， 收盘价， 最低价， 成交量， 价格变动 ，涨跌幅，5日均价，10日均价，20日均价，5日均量，10日均量，20日均量，换手率
     """
-    symbol = _code_to_symbol(code)
-    url = ''
-    if ktype.upper() in ct.K_LABELS:
-        url = ct.DAY_PRICE_URL%(ct.P_TYPE['http'], ct.DOMAINS['ifeng'],
-                                ct.K_TYPE[ktype.upper()], symbol)
-    elif ktype in ct.K_MIN_LABELS:
-        url = ct.DAY_PRICE_MIN_URL%(ct.P_TYPE['http'], ct.DOMAINS['ifeng'],
-                                    symbol, ktype)
-    else:
-        raise TypeError('ktype input error.')
-
+    url = _hist_data_url(code, ktype)
     for _ in range(retry_count):
         try:
             request = Request(url)
             lines = urlopen(request, timeout = 10).read()
-            if len(lines) < 15: #no data
-                return None
         except (URLError, HTTPError, timeout) as e:
             time.sleep(pause)
         else:
-            js = json.loads(lines.decode('utf-8') if ct.PY3 else lines)
-            cols = []
-            if (code in ct.INDEX_LABELS) & (ktype.upper() in ct.K_LABELS):
-                cols = ct.INX_DAY_PRICE_COLUMNS
-            else:
-                cols = ct.DAY_PRICE_COLUMNS
-            if len(js['record'][0]) == 14:
-                cols = ct.INX_DAY_PRICE_COLUMNS
-            df = pd.DataFrame(js['record'], columns=cols)
-            if ktype.upper() in ['D', 'W', 'M']:
-                df = df.applymap(lambda x: x.replace(u',', u''))
-                df[df==''] = 0
-            for col in cols[1:]:
-                df[col] = df[col].astype(float)
-            if start is not None:
-                df = df[df.date >= start]
-            if end is not None:
-                df = df[df.date <= end]
-            if (code in ct.INDEX_LABELS) & (ktype in ct.K_MIN_LABELS):
-                df = df.drop('turnover', axis=1)
-            df = df.set_index('date')
-            df = df.sort_index(ascending = False)
-
-            # WA: sina sometimes return wrong data at 2015-02-24 and 2015-10-07, which are not trading days.
-            for date in ('2015-02-24', '2015-10-07'):
-                if date in df.index:
-                    df.drop(date, inplace=True)
-            return df
+            return _parse_hist_data(lines, code, start, end, ktype)
     raise IOError(ct.NETWORK_URL_ERROR_MSG + ': ' + url)
 
 
+def _hist_data_url(code, ktype='D'):
+    symbol = _code_to_symbol(code)
+    if ktype.upper() in ct.K_LABELS:
+        return ct.DAY_PRICE_URL%(ct.P_TYPE['http'], ct.DOMAINS['ifeng'],
+                                 ct.K_TYPE[ktype.upper()], symbol)
+    elif ktype in ct.K_MIN_LABELS:
+        return ct.DAY_PRICE_MIN_URL%(ct.P_TYPE['http'], ct.DOMAINS['ifeng'],
+                                     symbol, ktype)
+    else:
+        raise TypeError('ktype input error.')
+
+
+def _parse_hist_data(lines, code, start=None, end=None, ktype='D'):
+    """
+        解析get_hist_data返回的原始数据
+    """
+    if len(lines) < 15: #no data
+        return None
+    js = json.loads(lines.decode('utf-8') if ct.PY3 else lines)
+    cols = []
+    if (code in ct.INDEX_LABELS) & (ktype.upper() in ct.K_LABELS):
+        cols = ct.INX_DAY_PRICE_COLUMNS
+    else:
+        cols = ct.DAY_PRICE_COLUMNS
+    if len(js['record'][0]) == 14:
+        cols = ct.INX_DAY_PRICE_COLUMNS
+    df = pd.DataFrame(js['record'], columns=cols)
+    if ktype.upper() in ['D', 'W', 'M']:
+        df = df.applymap(lambda x: x.replace(u',', u''))
+        df[df==''] = 0
+    for col in cols[1:]:
+        df[col] = df[col].astype(float)
+    if start is not None:
+        df = df[df.date >= start]
+    if end is not None:
+        df = df[df.date <= end]
+    if (code in ct.INDEX_LABELS) & (ktype in ct.K_MIN_LABELS):
+        df = df.drop('turnover', axis=1)
+    df = df.set_index('date')
+    df = df.sort_index(ascending = False)
+
+    # WA: sina sometimes return wrong data at 2015-02-24 and 2015-10-07, which are not trading days.
+    for date in ('2015-02-24', '2015-10-07'):
+        if date in df.index:
+            df.drop(date, inplace=True)
+    return df
+
+
 def _parsing_dayprice_json(pageNum=1, retry_count=3):
     """
            处理当日行情分页数据，格式为json
@@ -390,23 +400,35 @@ def get_realtime_quotes(symbols=None, retry_count=3):
 def get_fq_factor(code, start=None, end=None, retry_count=3, pause=0.001):
     start = du.today_last_year() if start is None else start
     end = du.today() if end is None else end
-    qs = du.get_quarts(start, end)
-    qt = qs[0]
-    # ct._write_head()
-    data = _parse_fq_data(_get_index_url(False, code, qt), False,
-                          retry_count, pause)
-    if data is None:
-        data = pd.DataFrame()
-    if len(qs) > 1:
-        for d in range(1, len(qs)):
-            qt = qs[d]
-            # ct._write_console()
-            df = _parse_fq_data(_get_index_url(False, code, qt), False,
-                                retry_count, pause)
-            if df is None:  # 可能df为空，退出循环
-                break
-            else:
-                data = data.append(df, ignore_index=True)
+    frames = []
+    for url in _fq_factor_urls(code, start, end):
+        # ct._write_console()
+        df = _parse_fq_data(url, False, retry_count, pause)
+        if df is None and len(frames):  # 可能df为空，退出循环
+            break
+        frames.append(df)
+    return _merge_fq_factor(frames, start, end)
+
+
+def _fq_factor_urls(code, start, end):
+    """
+        复权因子按季度分页，返回从最近到最早每个季度的url
+    """
+    return [_get_index_url(False, code, qt) for qt in du.get_quarts(start, end)]
+
+
+def _merge_fq_factor(frames, start, end):
+    """
+        合并各季度复权数据为复权因子，frames按季度从近到远排列，遇到None表示更早的季度已无数据
+    """
+    data = []
+    for i, df in enumerate(frames):
+        if df is None:
+            if i == 0:
+                continue  # 最近的季度可能还没有数据
+            break
+        data.append(df)
+    data = pd.concat(data, ignore_index=True) if len(data) else pd.DataFrame()
     if len(data) == 0 or len(data[(data.date >= start) & (data.date <= end)]) == 0:
         return None
 
@@ -576,38 +598,45 @@ def _parse_fq_data(url, index, retry_count, pause):
         try:
             request = Request(url)
             text = urlopen(request, timeout=ct.DEFAULT_TIMEOUT).read()
-            text = text.decode('GBK')
             if not text:
                 raise URLError('no data received')
-            html = lxml.html.parse(StringIO(text))
-            res = html.xpath('//table[@id=\"FundHoldSharesTable\"]')
-            if ct.PY3:
-                sarr = [etree.tostring(node).decode('utf-8') for node in res]
-            else:
-                sarr = [etree.tostring(node) for node in res]
-            sarr = ''.join(sarr)
-            if not sarr:
-                return None
-            df = pd.read_html(sarr, skiprows = [0, 1])[0]
-            if len(df) == 0:
-                return pd.DataFrame()
-            if index:
-                df.columns = ct.HIST_FQ_COLS[0:7]
-            else:
-                df.columns = ct.HIST_FQ_COLS
-            if df['date'].dtypes == np.object:
-                df['date'] = df['date'].astype(np.datetime64)
-            df = df.drop_duplicates('date')
-        except ValueError as e:
-            # 时间较早，已经读不到数据
-            return None
+            return _parse_fq_text(text, index)
         except (URLError, HTTPError, timeout) as e:
             time.sleep(pause)
-        else:
-            return df
     raise IOError(ct.NETWORK_URL_ERROR_MSG + ': ' + url)
 
 
+def _parse_fq_text(text, index):
+    """
+        解析一个季度的复权数据页面，时间较早已经读不到数据时返回None
+    """
+    try:
+        text = text.decode('GBK')
+        html = lxml.html.parse(StringIO(text))
+        res = html.xpath('//table[@id=\"FundHoldSharesTable\"]')
+        if ct.PY3:
+            sarr = [etree.tostring(node).decode('utf-8') for node in res]
+        else:
+            sarr = [etree.tostring(node) for node in res]
+        sarr = ''.join(sarr)
+        if not sarr:
+            return None
+        df = pd.read_html(sarr, skiprows = [0, 1])[0]
+        if len(df) == 0:
+            return pd.DataFrame()
+        if index:
+            df.columns = ct.HIST_FQ_COLS[0:7]
+        else:
+            df.columns = ct.HIST_FQ_COLS
+        if df['date'].dtypes == np.object:
+            df['date'] = df['date'].astype(np.datetime64)
+        df = df.drop_duplicates('date')
+    except ValueError as e:
+        # 时间较早，已经读不到数据
+        return None
+    return df
+
+
 def get_index(retry_count=3):
     """
     获取大盘指数行情
@@ -1,9 +1,210 @@
 # -*- coding:utf-8 -*- 
 
+import zlib
+from io import BytesIO
+from socket import timeout as socket_timeout, error as socket_error
+from threading import Lock, BoundedSemaphore
 try:
-    from urllib.request import urlopen, Request
+    from urllib.request import urlopen as _urlopen, Request
+    from urllib.error import URLError, HTTPError
+    from urllib.parse import urlsplit, urljoin
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
 except ImportError:
-    from urllib2 import urlopen, Request
+    from urllib2 import urlopen as _urlopen, Request, URLError, HTTPError
+    from urlparse import urlsplit, urljoin
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+from tushare.stock import cons as ct
+
+
+def set_server(url=None):
+    """
+        所有DOMAINS的http请求改由url处的服务器响应，如本地录制/回放服务器
+        服务器以代理方式收到完整的原始url，url=None时恢复直连
+        只作用于经由本模块urlopen的请求，不改变urllib的全局opener
+    """
+    ct.SERVER = url
+
+
+def get_server():
+    return ct.SERVER
+
+
+class _Response(object):
+    """
+        urlopen返回的响应，内容已全部读出，连接已还回连接池
+    """
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = self.code = status
+        self.reason = reason
+        self.headers = headers
+        self._fp = BytesIO(body)
+
+    def read(self, amt=None):
+        return self._fp.read() if amt is None else self._fp.read(amt)
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool(object):
+    """
+        按主机复用keep-alive连接的http连接池，多线程共享
+    Parameters
+    ------
+      maxsize:int 每个主机同时使用的最大连接数，超出的请求等待空闲连接
+      timeout:float 超时秒数，为None时使用各调用处的超时设置
+      gzip:bool 是否请求gzip/deflate压缩的响应
+    """
+    user_agent = 'Mozilla/5.0 (Windows NT 6.1; rv:37.0) Gecko/20100101 Firefox/37.0'
+    max_redirects = 5
+
+    def __init__(self, maxsize=10, timeout=None, gzip=True):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.gzip = gzip
+        self._lock = Lock()
+        self._hosts = {}  # (scheme, netloc) -> (semaphore, idle connections)
+
+    def urlopen(self, url, data=None, timeout=None):
+        """
+            与urllib的urlopen用法相同，url可以是Request，http错误抛出HTTPError，连接错误抛出URLError
+        """
+        if isinstance(url, Request):
+            method, headers = url.get_method(), dict(url.header_items())
+            data = url.data if data is None else data
+            url = url.get_full_url()
+        else:
+            method, headers = 'GET' if data is None else 'POST', {}
+        timeout = self.timeout if self.timeout is not None else timeout or ct.DEFAULT_TIMEOUT
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                return _urlopen(url, data, timeout)
+            status, reason, resp_headers, body = self._request(parts, method, headers, data, timeout)
+            location = resp_headers.get('Location')
+            if status not in (301, 302, 303, 307, 308) or not location:
+                break
+            url = urljoin(url, location)
+            if status in (301, 302, 303):
+                method, data = 'GET', None
+        if status >= 400:
+            raise HTTPError(url, status, reason, resp_headers, BytesIO(body))
+        return _Response(url, status, reason, resp_headers, body)
+
+    def clear(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            hosts, self._hosts = self._hosts, {}
+        for _, idle in hosts.values():
+            for conn in idle:
+                conn.close()
+
+    def _host(self, key):
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                host = self._hosts[key] = (BoundedSemaphore(self.maxsize), [])
+            return host
+
+    def _request(self, parts, method, headers, data, timeout):
+        scheme, netloc = parts.scheme, parts.netloc
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        if ct.SERVER is not None and scheme == 'http':
+            path = 'http://%s%s' % (netloc, path)  # 代理方式，服务器收到完整url
+            proxy = urlsplit(ct.SERVER)
+            scheme, netloc = proxy.scheme, proxy.netloc
+        headers = dict(headers)
+        names = set(k.lower() for k in headers)
+        if 'host' not in names:
+            headers['Host'] = parts.netloc
+        if 'user-agent' not in names:
+            headers['User-Agent'] = self.user_agent
+        if self.gzip and 'accept-encoding' not in names:
+            headers['Accept-Encoding'] = 'gzip, deflate'
+
+        semaphore, idle = self._host((scheme, netloc))
+        with semaphore:
+            while True:
+                with self._lock:
+                    conn = idle.pop() if idle else None
+                reused = conn is not None
+                if conn is None:
+                    conn = (HTTPSConnection if scheme == 'https' else HTTPConnection)(netloc, timeout=timeout)
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                try:
+                    conn.request(method, path, body=data, headers=headers)
+                    resp = conn.getresponse()
+                    body = resp.read()
+                except socket_timeout:
+                    conn.close()
+                    raise
+                except (HTTPException, socket_error) as e:
+                    conn.close()
+                    if reused:
+                        continue  # 服务器已关闭的空闲连接，换新连接重试
+                    raise URLError(e)
+                if resp.will_close:
+                    conn.close()
+                else:
+                    with self._lock:
+                        idle.append(conn)
+                break
+
+        resp_headers = resp.msg
+        encoding = (resp_headers.get('Content-Encoding') or '').lower()
+        if encoding in ('gzip', 'deflate'):
+            try:
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+            except zlib.error:
+                body = zlib.decompress(body, -zlib.MAX_WBITS)  # 不带zlib头的deflate
+            del resp_headers['Content-Encoding']
+        return resp.status, resp.reason, resp_headers, body
+
+
+_pool = ConnectionPool()
+
+
+def urlopen(url, data=None, timeout=None):
+    """
+        经由共享连接池发出请求，tushare各模块都通过此函数访问网络
+    """
+    return _pool.urlopen(url, data, timeout)
+
+
+def set_pool(maxsize=10, timeout=None, gzip=True):
+    """
+        重新设置共享连接池
+    Parameters
+    ------
+      maxsize:int 每个主机同时使用的最大连接数
+      timeout:float 超时秒数，为None时使用各调用处的超时设置
+      gzip:bool 是否请求压缩的响应
+    """
+    global _pool
+    old, _pool = _pool, ConnectionPool(maxsize, timeout, gzip)
+    old.clear()
+
+
+def get_pool():
+    return _pool
 
 
 class Client(object):
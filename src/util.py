@@ -2,17 +2,44 @@
 __author__ = 'Du, Changbin <changbin.du@gmail.com>'
 
 
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+
+# str.translate table of full-width characters to half-width ones
+Q2B_TABLE = dict([(0x3000, 0x20)] + [(c, c - 0xfee0) for c in range(0xFF01, 0xFF5F)])
+
+
 def strQ2B(ustring):
     """把字符串全角转半角"""
-    rstring = ""
-    for uchar in ustring:
-        inside_code = ord(uchar)
-        if inside_code == 0x3000:
-            inside_code = 0x20
-        elif 0xFF01 <= inside_code <= 0xFF5E:
-            inside_code -= 0xfee0
-        rstring += chr(inside_code)
-    return rstring
+    return ustring.translate(Q2B_TABLE)
+
+
+@lru_cache(maxsize=4096)
+def _normalize_str(ustring):
+    return ustring.translate(Q2B_TABLE).replace(' ', '')
+
+
+def normalize(value):
+    """
+    全角转半角并去掉空格，value可以是字符串或pandas Series，不是字符串的值原样返回。
+    行业、地区等重复的字符串只转换一次
+    """
+    if isinstance(value, str):
+        return _normalize_str(value)
+    if not isinstance(value, pd.Series) or value.dtype != object:
+        return value
+    values = value.values
+    is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=values.size)
+    if not is_str.any():
+        return value
+    codes, uniques = pd.factorize(values[is_str])
+    table = np.empty(len(uniques), dtype=object)
+    table[:] = [_normalize_str(s) for s in uniques]
+    values = values.copy()
+    values[is_str] = table[codes]
+    return pd.Series(values, index=value.index, name=value.name)
 
 
 def chunks(l, n):